@@ -1,16 +1,56 @@
 import os
 import feedback_cpg as sim
-from model_variations import generate_temp_model_file, generate_model_variations
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
+from model_variations import generate_temp_model_file, generate_model_variations, can_patch_variations, sample_model_deltas
+from pymongo.errors import PyMongoError
+from bson.errors import InvalidDocument
 from utils import printProgressBar
+from worker_pool import get_shared_pool
+from surrogate import Surrogate
+from pareto import NSGA2, ParetoArchive
+from record_log import RecordWriter, get_simulations
+from mongo_store import get_database, save_experiment
 import datetime
 import generate_model
 import cma
-import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+import time
 import numpy as np
 import random
 
+# Restarts of runs that stop within two generations when no restart strategy is configured
+MAX_EARLY_RESTARTS = 10
+
+# Objectives of multi_objective experiments as minimized functions of a
+# rollout (succes, simulated time, distance, energy, ...) that succeeded.
+OBJECTIVES = {
+	'distance': lambda r: -max(r[2], 0),
+	'energy': lambda r: r[3],
+	'speed': lambda r: -max(r[2], 0) / r[1] if r[1] > 0 else 0,
+}
+
+# The same objectives of a rollout that failed, or was ended early by a stop
+# rule, as functions of the worst energy (see Experiment.failed_energy): it
+# did not move and used the worst energy. Like its reward of 0, a failed
+# rollout only lowers the mean over the rollouts of a candidate. Otherwise it
+# would keep the small energy of its short run.
+FAILED_OBJECTIVES = {
+	'distance': lambda worst_energy: 0,
+	'energy': lambda worst_energy: worst_energy,
+	'speed': lambda worst_energy: 0,
+}
+
+
+def set_covariance(es, C):
+	# Covariance matrix of a warm started CMA-ES. cma 1.x keeps the matrix and
+	# its eigendecomposition (D holds the square roots of the eigenvalues) on
+	# the ES itself.
+	es.C = np.array(C, dtype=float)
+	es.dC = np.diag(es.C).copy()
+	eigenvalues, es.B = np.linalg.eigh(es.C)
+	es.D = np.sqrt(np.maximum(eigenvalues, 0))
+	es.itereigenupdated = es.countiter
+
 
 def eval_wrapper(variables):
 	model_files = variables['model_files']
@@ -19,17 +59,100 @@ def eval_wrapper(variables):
 	perturbations = variables['perturbations']
 	render = variables['render']
 	logging = variables['logging']
+	model_deltas = variables['model_deltas']
+	history_dtype = variables['history_dtype']
+	integrator_options = variables['integrator_options']
+	simulation_options = variables['simulation_options']
+	stop_rules = variables['stop_rules']
 	# print(model_files)
+
+	# The open-loop CPG output is the same on every model variation, compute it once and replay it
+	trajectory = variables.get('trajectory')
+	if trajectory is None and not closed_loop and len(model_files) > 1:
+		trajectory = open_loop_trajectory(variables)
+
 	results = []
-	for model_file in model_files:
-		r = sim.evaluate(model_file, closed_loop, params.tolist(), perturbations, render, logging)
+	for model_file, deltas in zip(model_files, model_deltas):
+		r = sim.evaluate(model_file, closed_loop, params.tolist(), perturbations, render, logging, model_deltas=deltas, history_dtype=history_dtype, trajectory=trajectory, stop_rules=stop_rules, **integrator_options, **simulation_options)
 		results.append(r)
 	# print(results)
-	print("I'm done")
+	return results
+
+def open_loop_trajectory(variables):
+	# Only the timestep of the model is used, which is the same for all
+	# variations. trajectory_model_file is the base model of the experiment,
+	# so no variation XML has to be compiled for it.
+	model_file = variables.get('trajectory_model_file') or variables['model_files'][0]
+	return sim.open_loop_trajectory(variables['params'].tolist(), model_file=model_file, **variables['integrator_options'], **variables['simulation_options'])
+
+def split_rollouts(variables_list):
+	# One task per (candidate, variation) rollout, so the rollouts of one slow
+	# candidate are spread over all workers instead of pinning a single one
+	tasks = []
+	for candidate, variables in enumerate(variables_list):
+		trajectory = None
+		if not variables['closed_loop'] and len(variables['model_files']) > 1:
+			trajectory = open_loop_trajectory(variables)
+
+		for variation, (model_file, deltas) in enumerate(zip(variables['model_files'], variables['model_deltas'])):
+			task = dict(variables, model_files=[model_file], model_deltas=[deltas], trajectory=trajectory)
+			tasks.append(((candidate, variation), task))
+	return tasks
+
+def rollout_wrapper(task):
+	index, variables = task
+	return (index, eval_wrapper(variables)[0])
+
+def imap_unordered(pool, function, tasks):
+	# Yield results as soon as they complete, for both worker pool types
+	if isinstance(pool, ThreadPoolExecutor):
+		for future in as_completed([pool.submit(function, task) for task in tasks]):
+			yield future.result()
+	else:
+		for result in pool.imap_unordered(function, tasks):
+			yield result
+
+def submit_async(pool, function, task, callback):
+	# Call callback with the result, or the exception, once the task is done
+	if isinstance(pool, ThreadPoolExecutor):
+		pool.submit(function, task).add_done_callback(lambda future: callback(future.exception() or future.result()))
+	else:
+		pool.apply_async(function, (task,), callback=callback, error_callback=callback)
+
+def evaluate_rollouts(pool, variables_list):
+	# Regroup the rollouts in the same layout as eval_wrapper returns them
+	results = [[None] * len(variables['model_files']) for variables in variables_list]
+	for (candidate, variation), r in imap_unordered(pool, rollout_wrapper, split_rollouts(variables_list)):
+		results[candidate][variation] = r
+	return results
+
+def evaluate_batch(variables_list, n_threads):
+	# Flatten all (candidate, model file) rollouts into one native call and
+	# regroup the results in the same layout as eval_wrapper returns them
+	model_files, params, perturbations, model_deltas, counts = [], [], [], [], []
+	for variables in variables_list:
+		for model_file, deltas in zip(variables['model_files'], variables['model_deltas']):
+			model_files.append(model_file)
+			params.append(variables['params'])
+			perturbations.append(variables['perturbations'])
+			model_deltas.append(deltas)
+		counts.append(len(variables['model_files']))
+
+	closed_loop = variables_list[0]['closed_loop']
+	integrator_options = variables_list[0]['integrator_options']
+	simulation_options = variables_list[0]['simulation_options']
+	stop_rules = variables_list[0]['stop_rules']
+	succes, st, d, ec, termination = sim.evaluate_batch(model_files, closed_loop, np.array(params), perturbations, n_threads, model_deltas=model_deltas, stop_rules=stop_rules, **integrator_options, **simulation_options)
+
+	results = []
+	i = 0
+	for count in counts:
+		results.append([(bool(succes[j]), float(st[j]), float(d[j]), float(ec[j]), [], [], sim.TERMINATION_REASONS[termination[j]]) for j in range(i, i + count)])
+		i += count
 	return results
 
 class Experiment:
-	def __init__(self, default_morphology, closed_loop, initial_values, lower_bounds, upper_bounds, variances, max_iters, E_ref=20, perturbation_params=None, variation_params=None, num_variations=0, collection_name='experiments_2', save_in_database=False, experiment_tag=None, experiment_tag_index=0, remarks='', popsize=30):
+	def __init__(self, default_morphology, closed_loop, initial_values, lower_bounds, upper_bounds, variances, max_iters, E_ref=20, perturbation_params=None, variation_params=None, num_variations=0, collection_name='experiments_2', save_in_database=False, experiment_tag=None, experiment_tag_index=0, remarks='', popsize=30, batch_threads=0, patch_variations=True, history_dtype='float64', num_workers=None, worker_type='process', integrator_options=None, stop_rules=None, reward_threshold_quantile=None, simulation_options=None, async_mode=False, worker_pool=None, checkpoint_interval=0, checkpoint_path=None, common_random_numbers=False, racing=None, surrogate=None, restarts=None, multi_objective=None, warm_start=None, stream_simulations=False, simulation_log_path=None, broker_options=None):
 		self.default_morphology = default_morphology
 		self.closed_loop = closed_loop
 		self.initial_values = initial_values
@@ -48,6 +171,136 @@ class Experiment:
 		self.collection_name = collection_name
 		self.save_in_database = save_in_database
 		self.popsize = popsize
+		self.batch_threads = batch_threads
+		self.history_dtype = history_dtype
+
+		# CPG integrator settings, e.g. {'integrator': 'rk4', 'dt': 0.01}
+		self.integrator_options = integrator_options if integrator_options is not None else {}
+
+		# Episode timing and MuJoCo fidelity, e.g. {'duration': 10, 'timestep': 0.004}
+		# for a fast screening pass, see SimulationOptions in QuadrupedEnv.h
+		self.simulation_options = simulation_options if simulation_options is not None else {}
+
+		# Early termination of hopeless rollouts, see StopRules in Experiment.h.
+		# With reward_threshold_quantile and stop_rules['max_speed'], a rollout is
+		# stopped once it can no longer beat that quantile of the previous
+		# generation's rewards. CMA-ES only uses the ranking of the best half of
+		# the population, so quantiles up to 0.5 do not change the selection much.
+		self.stop_rules = dict(stop_rules) if stop_rules is not None else {}
+		self.stop_rules.setdefault('E_ref', self.E_ref)
+		self.reward_threshold_quantile = reward_threshold_quantile
+
+		# feedback_cpg releases the GIL during a rollout, so rollouts can run
+		# on threads in this process instead of separate worker processes.
+		# Without an explicit worker_pool the workers are taken from the shared
+		# pool in worker_pool.py, so consecutive experiments reuse them.
+		# num_workers defaults to the number of CPUs. worker_type 'broker' runs
+		# the rollouts on worker daemons on other machines, see executors.py,
+		# with broker_options passed to Broker, e.g.
+		# {'address': ('', 6000), 'authkey': b'secret'}.
+		self.num_workers = num_workers
+		self.worker_type = worker_type
+		self.broker_options = broker_options
+		self.worker_pool = worker_pool
+
+		# Save a checkpoint every checkpoint_interval generations that resume()
+		# continues from. The file is replaced atomically and removed once the
+		# results are saved. checkpoint_path defaults to a timestamped file in
+		# experiment_logs.
+		self.checkpoint_interval = checkpoint_interval
+		self.checkpoint_path = checkpoint_path
+
+		# Variations, perturbations and restart settings are drawn from this
+		# experiment's own random state, so experiments of a sweep in one
+		# process do not share a stream and a checkpoint restores it exactly.
+		# It is seeded from the global numpy random state.
+		self.random = np.random.RandomState(np.random.randint(2**31 - 1))
+
+		# Steady-state CMA-ES that keeps all workers busy, see run_async_generations.
+		# batch_threads is not used in this mode.
+		self.async_mode = async_mode
+
+		# Evaluate all candidates of a generation on the same sampled variations
+		# and perturbations. Rankings within a generation then only reflect the
+		# candidates, and every variation is generated once per generation.
+		self.common_random_numbers = common_random_numbers
+
+		# Successive halving over the variations, e.g. {'keep_fraction': 0.5,
+		# 'max_variations': 16, 'budget': 400}. Every candidate is evaluated on
+		# num_variations variations first, then the best keep_fraction of the
+		# candidates still racing get as many variations again, until they
+		# reach max_variations or the generation has used budget rollouts.
+		# At least one of the two limits is required. Not supported in async mode,
+		# nor without variation_params or perturbation_params, as rollouts are
+		# deterministic and further rounds would only repeat them.
+		self.racing = dict(racing) if racing is not None else None
+		if self.racing is not None:
+			if self.async_mode:
+				raise ValueError('racing is not supported in async_mode')
+			if self.racing.get('max_variations') is None and self.racing.get('budget') is None:
+				raise ValueError('racing needs max_variations or budget')
+			if not variation_params and not perturbation_params:
+				raise ValueError('racing needs variation_params or perturbation_params to sample')
+
+		# Pre-screen candidates with a model of the reward fitted on the rollouts
+		# so far and only simulate the promising ones, e.g. {'model': 'gp',
+		# 'evaluate_fraction': 0.5}. See Surrogate for the options. Not
+		# supported in async mode.
+		self.surrogate_options = dict(surrogate) if surrogate is not None else None
+		if self.surrogate_options is not None and self.async_mode:
+			raise ValueError('surrogate is not supported in async_mode')
+
+		# Restart strategy, e.g. {'strategy': 'bipop', 'max_restarts': 9,
+		# 'concurrent': True}, see new_run. All runs add to the same document
+		# and best_id is the best candidate over all of them. With concurrent,
+		# restarts already start while the active runs leave workers idle.
+		self.restarts = dict(restarts) if restarts is not None else None
+
+		# Optimize several objectives with NSGA-II instead of the tanh reward
+		# with CMA-ES, e.g. {'objectives': ['distance', 'energy']}, see
+		# OBJECTIVES. The non-dominated candidates over all runs are kept in
+		# the results as pareto_front. The best candidate for any E_ref is on
+		# that front, so one experiment covers a whole E_ref sweep.
+		# reward and best_id still use E_ref. Not supported with async_mode,
+		# racing, surrogate or reward_threshold_quantile, which all rank
+		# candidates on the reward.
+		self.multi_objective = dict(multi_objective) if multi_objective is not None else None
+		if self.multi_objective is not None:
+			self.multi_objective.setdefault('objectives', ['distance', 'energy'])
+			for name in self.multi_objective['objectives']:
+				if name not in OBJECTIVES:
+					raise ValueError('Unknown objective ' + name)
+			if self.async_mode or self.racing is not None or self.surrogate_options is not None or self.reward_threshold_quantile is not None:
+				raise ValueError('multi_objective is not supported with async_mode, racing, surrogate or reward_threshold_quantile')
+
+		# Write every simulation to a record log (see record_log.py) as it is
+		# recorded instead of keeping them in memory until the results are
+		# saved. The log is flushed every generation and the document refers
+		# to it as simulation_log instead of holding the simulations, use
+		# record_log.get_simulations to read them. simulation_log_path
+		# defaults to a timestamped file in experiment_logs.
+		self.stream_simulations = stream_simulations
+		self.simulation_log_path = simulation_log_path
+
+		# Start from the result of an earlier experiment instead of
+		# initial_values, e.g. {'path': 'final_cpgs/baseline.pickle'}. The file
+		# is either a pickled CMAEvolutionStrategy (save_es_object_to_file),
+		# whose mean, step size and covariance matrix are reused, or CPG
+		# parameters as in final_cpgs (a list, or a simulation with
+		# 'cpg_params'), which only give the mean. The ES must come from an
+		# experiment with the same bounds. 'sigma' overrides the step size,
+		# which is variances for parameter files. A string is taken as the path.
+		# Restarts of a restart strategy are not warm started.
+		self.warm_start = {'path': warm_start} if isinstance(warm_start, str) else (dict(warm_start) if warm_start is not None else None)
+		self.initial_sigma = self.variances
+		self.initial_covariance = None
+		if self.warm_start is not None:
+			self.load_warm_start()
+
+		# Apply sampled variations to the compiled base model instead of
+		# generating an XML file per sample when all varied parameters allow it
+		self.patch_variations = patch_variations and can_patch_variations(variation_params, default_morphology)
+		self.base_model_file = None
 
 		self.type = "closed" if self.closed_loop else "open"
 
@@ -59,15 +312,23 @@ class Experiment:
 		self.max_score_evolution = []
 		self.total_simulated_time = 0
 		self.total_computation_time = 0
+		self.total_rollouts = 0
+		self.rollouts_per_second = 0
+		self.simulation_writer = None
 		self.best_id = 0
 		self.best_reward = 0
+		self.best_run = 0
+		self.surrogate = Surrogate(**self.surrogate_options) if self.surrogate_options is not None else None
+		self.surrogate_saved_rollouts = 0
+		self.pareto_archive = ParetoArchive() if self.multi_objective is not None else None
+		self.max_rollout_energy = 0 # most energy used by a successful rollout
 
 	def setup_model_variations(self):
 		self.model_files = []
 		if not self.variation_params:
 			self.model_files.append(generate_temp_model_file(self.default_morphology))
 		else:
-			variation_xml_paths, delta_dicts = generate_model_variations(self.default_morphology, self.variation_params, self.num_variations)
+			variation_xml_paths, delta_dicts = generate_model_variations(self.default_morphology, self.variation_params, self.num_variations, random_state=self.random)
 			self.model_files.extend(variation_xml_paths)
 			self.variation_delta_dicts = delta_dicts
 
@@ -80,6 +341,48 @@ class Experiment:
 		initial_normalized = [(x-l) / (u-l) for x, l, u in zip(self.initial_values, self.lower_bounds, self.upper_bounds)]
 		return initial_normalized
 
+	def load_warm_start(self):
+		import pickle
+		with open(self.warm_start['path'], 'rb') as f:
+			start = pickle.load(f)
+
+		if hasattr(start, 'mean') and hasattr(start, 'C'):
+			# With BoundTransform es.mean is the genotype, map it onto [0, 1]
+			# like the ES does for its candidates
+			if hasattr(start, 'boundary_handler'):
+				mean = np.array(start.boundary_handler.transform(start.mean), dtype=float)
+			else:
+				mean = np.clip(np.array(start.mean, dtype=float), 0, 1)
+			if len(mean) != len(self.initial_values):
+				raise ValueError('Warm start ES has {} parameters, expected {}'.format(len(mean), len(self.initial_values)))
+			self.initial_values = [float(l + x * (u - l)) for x, l, u in zip(mean, self.lower_bounds, self.upper_bounds)]
+			self.initial_sigma = float(start.sigma)
+			self.initial_covariance = np.array(start.C, dtype=float)
+			self.warm_start['source'] = 'es'
+		else:
+			params = start['cpg_params'] if isinstance(start, dict) else start
+			self.initial_values = [float(x) for x in np.clip(self.inverse_denormalize(params), self.lower_bounds, self.upper_bounds)]
+			self.warm_start['source'] = 'params'
+
+		if self.warm_start.get('sigma') is not None:
+			self.initial_sigma = self.warm_start['sigma']
+
+	def inverse_denormalize(self, params):
+		# Optimization variables (not normalized) that denormalize maps to the
+		# given CPG parameters, for mapping A or B depending on the number of
+		# initial_values. Swing bounds are taken above the offsets, as the
+		# default bounds require.
+		params = np.array(params, dtype=float)
+		if len(self.initial_values) == 8:
+			amplitude_front = np.sqrt(params[0])
+			amplitude_hind = np.sqrt(params[2])
+			return [params[4] + amplitude_front, params[5] + amplitude_hind, params[4] - amplitude_front, params[5] - amplitude_hind,
+					params[6] / (2 * np.pi), params[7], params[8], params[10]]
+		elif len(self.initial_values) == 12:
+			return [params[4] + np.sqrt(params[0]), params[4] + np.sqrt(params[1]), params[5] + np.sqrt(params[2]), params[5] + np.sqrt(params[3]),
+					params[4], params[5], params[6] / (2 * np.pi), params[7], params[8], params[9], params[10], params[11]]
+		raise ValueError('No mapping for {} parameters'.format(len(self.initial_values)))
+
 	def denormalize(self, x):
 		array = np.array(len(self.initial_values)*[0.0])
 		i = 0
@@ -155,150 +458,689 @@ class Experiment:
 	def sample_variations(self, num):
 		model_files = []
 		variation_delta_dicts = []
-		if not self.variation_params:
+		model_deltas = []
+		if self.patch_variations:
+			if not self.variation_params:
+				model_deltas.append(None)
+			else:
+				model_deltas, variation_delta_dicts = sample_model_deltas(self.variation_params, num, random_state=self.random)
+			model_files = [self.get_base_model_file()] * len(model_deltas)
+		elif not self.variation_params:
 			model_files.append(generate_temp_model_file(self.default_morphology))
+			model_deltas.append(None)
 		else:
-			variation_xml_paths, delta_dicts = generate_model_variations(self.default_morphology, self.variation_params, num)
+			variation_xml_paths, delta_dicts = generate_model_variations(self.default_morphology, self.variation_params, num, random_state=self.random)
 			model_files.extend(variation_xml_paths)
 			variation_delta_dicts = delta_dicts
+			model_deltas = [None] * len(model_files)
+
+		return (model_files, variation_delta_dicts, model_deltas)
+
+	def get_base_model_file(self):
+		# Default morphology, generated once per experiment
+		if self.base_model_file is None:
+			self.base_model_file = generate_temp_model_file(self.default_morphology)
+		return self.base_model_file
+
+	def remove_base_model_file(self):
+		if self.base_model_file is not None:
+			os.remove(self.base_model_file)
+			self.base_model_file = None
+
+	def sample_perturbations(self, num):
+		if not self.perturbation_params:
+			return [[]]*num
+
+		perturb_cov = np.diag(self.perturbation_params['perturb_variances'])
+		solution_perturbations = []
+		for _ in range(num):
+			occurences = self.random.geometric(p=1/self.perturbation_params['expected_occurences']) - 1 # numpy uses shifted geometric
+			perturbations = []
+			for i in range(occurences):
+				perturb_time = self.random.random_sample() * (self.simulation_options.get('duration', 15) - 1)
+				force_torque = self.random.multivariate_normal(self.perturbation_params['perturb_means'], perturb_cov)
+				perturbations.append([perturb_time, list(force_torque)])
+			solution_perturbations.append(perturbations)
+		return solution_perturbations
+
+	def get_stop_rules(self, previous_rewards):
+		stop_rules = self.stop_rules
+		if self.reward_threshold_quantile is not None and previous_rewards:
+			stop_rules = dict(stop_rules, min_reward=float(np.percentile(previous_rewards, self.reward_threshold_quantile * 100)))
+		return stop_rules
+
+	def get_rollout_variables(self, solution, variations, perturbation, logging, stop_rules):
+		# Open-loop rollouts on several variations replay one trajectory, see
+		# split_rollouts
+		trajectory_model_file = None
+		if not self.closed_loop and len(variations[0]) > 1:
+			trajectory_model_file = self.get_base_model_file()
+
+		return {
+			'model_files': variations[0],
+			'trajectory_model_file': trajectory_model_file,
+			'closed_loop': self.closed_loop,
+			'params': self.denormalize(solution),
+			'render': False,
+			'logging': logging,
+			'history_dtype': self.history_dtype,
+			'integrator_options': self.integrator_options,
+			'simulation_options': self.simulation_options,
+			'stop_rules': stop_rules,
+			'model_deltas': variations[2],
+			'perturbations': perturbation}
+
+	def remove_variation_files(self, variations):
+		# Clean temp files
+		if not self.patch_variations:
+			for f in variations[0]:
+				os.remove(f)
+
+	def record_simulation(self, run, solution, result, perturbation, objectives=None):
+		# Store the rollouts of one candidate of a run and return its reward
+		solution_rewards = []
+
+		simulated_time, distance, energy_consumed, action_history, sensor_history, termination = [], [], [], [], [], []
+
+		for r in result:
+			succes, st, d, ec, ah, sh, reason = r
+			termination.append(reason)
+			simulated_time.append(st)
+			distance.append(d)
+			energy_consumed.append(ec)
+			action_history.append(ah)
+			sensor_history.append(sh)
+			self.total_simulated_time += st
+			self.total_rollouts += 1
+			solution_rewards.append(self.rollout_reward(r))
+
+		reward = sum(solution_rewards) / len(solution_rewards)
+		reward_ci = self.confidence_interval(solution_rewards)
+		if objectives is None and self.multi_objective is not None:
+			objectives = self.generation_objectives([result])[0]
+
+		# variations_delta_dicts = [v[1] for v in variations]
+
+		simulation_dict = {'iter': run['iteration'],
+							'run': run['run'],
+							'cpg_params': self.denormalize(solution).tolist(),
+							'simulated_time': simulated_time,
+							'distance': distance,
+							'energy': energy_consumed,
+							'action_history': action_history,
+							'sensor_history': sensor_history,
+							'termination': termination,
+							'reward': reward,
+							'reward_ci': reward_ci,
+							'objectives': objectives,
+							# 'variation_index': variation_index,
+							'perturbation': perturbation,
+							# 'variations': variations_delta_dicts,
+						}
+		simulation_id = self.add_simulation(simulation_dict)
+
+		# update self.best_id
+		if reward > self.best_reward:
+			self.best_id = simulation_id
+			self.best_reward = reward
+			self.best_run = run['run']
+
+		# A candidate without any successful rollout is never part of the
+		# front, like it never has the best reward
+		if objectives is not None and any(r[0] for r in result):
+			self.pareto_archive.add(objectives, simulation_id)
+
+		return reward
+
+	def add_simulation(self, simulation):
+		# Returns the index of the simulation, also when it goes to the log
+		if self.simulation_writer is not None:
+			return self.simulation_writer.write(simulation)
+		self.simulations.append(simulation)
+		return len(self.simulations) - 1
+
+	def tell(self, es, solutions, rewards, simulated_rewards=None, objectives=None):
+		# The score evolutions only include simulated rewards, not predicted ones
+		if simulated_rewards is None:
+			simulated_rewards = rewards
+		self.avg_score_evolution.append(sum(simulated_rewards) / len(simulated_rewards))
+		self.max_score_evolution.append(max([0] + simulated_rewards))
+
+		if objectives is not None:
+			es.tell(solutions, objectives)
+		else:
+			es.tell(solutions, [-1 * r for r in rewards]) # May need to be a numpy.ndarray
+
+		if self.simulation_writer is not None:
+			self.simulation_writer.flush()
+		# es.disp()
+
+	def rollout_reward(self, r):
+		succes, st, d, ec = r[:4]
+		return 0 if d < 0 or not succes else (d * np.tanh(self.E_ref/ec))
+
+	def failed_energy(self, r):
+		# Worst energy of a failed rollout: the energy budget of the stop
+		# rules, or else the most energy a successful rollout used so far, and
+		# never less than the rollout used itself
+		budget = self.stop_rules.get('max_energy', -1)
+		return max(budget if budget >= 0 else self.max_rollout_energy, r[3])
+
+	def candidate_objectives(self, result):
+		# Mean of every objective over the rollouts of a candidate
+		return [float(np.mean([OBJECTIVES[name](r) if r[0] else FAILED_OBJECTIVES[name](self.failed_energy(r)) for r in result])) for name in self.multi_objective['objectives']]
+
+	def generation_objectives(self, results):
+		# candidate_objectives of a generation, all with the same worst energy
+		for result in results:
+			for r in result:
+				if r[0]:
+					self.max_rollout_energy = max(self.max_rollout_energy, r[3])
+		return [self.candidate_objectives(result) for result in results]
+
+	def confidence_interval(self, rewards):
+		# 95% interval of the mean reward, normal approximation
+		mean = sum(rewards) / len(rewards)
+		if len(rewards) < 2:
+			return [mean, mean]
+		half_width = 1.96 * np.std(rewards, ddof=1) / np.sqrt(len(rewards))
+		return [float(mean - half_width), float(mean + half_width)]
+
+	def ask_generation(self, es, logging, previous_rewards):
+		# Sample a population and everything needed to evaluate it. The
+		# 'variables' entry holds the eval_wrapper input of every candidate that
+		# is simulated, the other candidates are in 'screened_solutions'.
+		solutions = es.ask()
+
+		predictions = None
+		screened_solutions, screened_rewards = [], []
+		if self.surrogate is not None:
+			simulate, predictions = self.surrogate.screen(solutions)
+			if predictions is not None:
+				screened_solutions = [x for x, s in zip(solutions, simulate) if not s]
+				screened_rewards = [float(p) for p, s in zip(predictions, simulate) if not s]
+				predictions = [float(p) for p, s in zip(predictions, simulate) if s]
+				solutions = [x for x, s in zip(solutions, simulate) if s]
+
+		if self.common_random_numbers:
+			solution_variations = [self.sample_variations(self.num_variations)] * len(solutions)
+			solution_perturbations = self.sample_perturbations(1) * len(solutions)
+		else:
+			solution_variations = [self.sample_variations(self.num_variations) for _ in range(len(solutions))]
 
-		return (model_files, variation_delta_dicts)
+			# variation_indices = [int(random.uniform(0, len(self.model_files))) for _ in range(len(solutions))]
+			# model_files = [self.model_files[i] for i in variation_indices]
 
-	def run_optimization(self, logging=False):
-		es = cma.CMAEvolutionStrategy(self.normalize_initial_values(), self.variances,
-			{'popsize': self.popsize, 'boundary_handling': 'BoundTransform ','bounds': [0,1], 'maxiter' : self.max_iters,'verbose' :-1})
+			solution_perturbations = self.sample_perturbations(len(solutions))
+
+		stop_rules = self.get_stop_rules(previous_rewards)
+		x = [self.get_rollout_variables(x, variations, p, logging, stop_rules) for x, variations, p in zip(solutions, solution_variations, solution_perturbations)]
+
+		return {'solutions': solutions, 'variations': solution_variations, 'perturbations': solution_perturbations, 'variables': x, 'stop_rules': stop_rules, 'logging': logging,
+				'predictions': predictions, 'screened_solutions': screened_solutions, 'screened_rewards': screened_rewards}
+
+	def race(self, generation, results):
+		# Next successive halving round. Returns the indices of the candidates to
+		# evaluate further and their eval_wrapper input, nothing once the race
+		# is over. The caller appends the new rollouts to results[candidate].
+		if self.racing is None:
+			return ([], [])
+
+		used = sum(len(result) for result in results)
+		racing_variations = max(len(result) for result in results)
+		racing = [candidate for candidate, result in enumerate(results) if len(result) == racing_variations]
+
+		keep = int(np.ceil(self.racing.get('keep_fraction', 0.5) * len(racing)))
+		mean_rewards = {candidate: np.mean([self.rollout_reward(r) for r in results[candidate]]) for candidate in racing}
+		survivors = sorted(racing, key=lambda candidate: -mean_rewards[candidate])[:keep]
+
+		num = racing_variations
+		if self.racing.get('max_variations') is not None:
+			num = min(num, self.racing['max_variations'] - racing_variations)
+		if self.racing.get('budget') is not None:
+			num = min(num, (self.racing['budget'] - used) // len(survivors))
+		if num <= 0:
+			return ([], [])
+
+		if self.common_random_numbers:
+			shared_variations = self.sample_variations(num)
+
+		variables = []
+		for candidate in survivors:
+			variations = shared_variations if self.common_random_numbers else self.sample_variations(num)
+			generation['variations'].append(variations)
+			variables.append(self.get_rollout_variables(generation['solutions'][candidate], variations, generation['perturbations'][candidate], generation['logging'], generation['stop_rules']))
+
+		return (survivors, variables)
+
+	def evaluate_variables(self, mp_pool, variables, logging):
+		if self.batch_threads and not logging:
+			return evaluate_batch(variables, self.batch_threads)
+		return evaluate_rollouts(mp_pool, variables)
+
+	def tell_generation(self, run, generation, results):
+		# Record the results of an asked generation and update the CMA-ES of
+		# its run. Returns the rewards, which the next generation of the run
+		# uses as previous_rewards.
+		# Shared by all candidates with common_random_numbers
+		for variations in {id(v): v for v in generation['variations']}.values():
+			self.remove_variation_files(variations)
+
+		objectives = self.generation_objectives(results) if self.multi_objective is not None else [None] * len(results)
+		rewards = [self.record_simulation(run, solution, result, perturbation, o) for result, solution, perturbation, o in zip(results, generation['solutions'], generation['perturbations'], objectives)]
+
+		if self.surrogate is not None:
+			self.surrogate.update(generation['solutions'], rewards, generation['predictions'])
+			self.surrogate_saved_rollouts += len(generation['screened_solutions']) * max(self.num_variations, 1)
+
+		if self.multi_objective is None:
+			objectives = None
+		self.tell(run['es'], generation['solutions'] + generation['screened_solutions'], rewards + generation['screened_rewards'], rewards, objectives)
+		run['iteration'] += 1
+		run['evaluations'] += len(generation['solutions']) + len(generation['screened_solutions'])
+		run['previous_rewards'] = rewards
+
+		return rewards
+
+	def ask_step(self, logging):
+		# One generation of every active run, evaluated together so that
+		# concurrent restarts share the workers. The 'variables' entry holds
+		# the eval_wrapper input of all of them.
+		self.start_concurrent_runs()
+
+		step = {'runs': list(self.runs), 'generations': [], 'offsets': [], 'variables': [], 'logging': logging}
+		for run in step['runs']:
+			generation = self.ask_generation(run['es'], logging, run['previous_rewards'])
+			step['generations'].append(generation)
+			step['offsets'].append(len(step['variables']))
+			step['variables'].extend(generation['variables'])
+		return step
+
+	def race_step(self, step, results):
+		# race() for every generation of a step, with candidate indices into the
+		# results of the whole step
+		candidates, variables = [], []
+		for generation, offset in zip(step['generations'], step['offsets']):
+			c, v = self.race(generation, results[offset:offset + len(generation['variables'])])
+			candidates.extend(offset + candidate for candidate in c)
+			variables.extend(v)
+		return (candidates, variables)
+
+	def tell_step(self, step, results):
+		# Tell every run of the step its results, then retire the runs that
+		# stopped and schedule their restarts. Returns False once no run is left.
+		for run, generation, offset in zip(step['runs'], step['generations'], step['offsets']):
+			self.tell_generation(run, generation, results[offset:offset + len(generation['variables'])])
+
+		for run in step['runs']:
+			if run['es'].stop():
+				self.finish_run(run)
+
+		self.steps += 1
+		self.checkpoint(step['logging'])
+		return len(self.runs) > 0
+
+	def evaluate_step(self, mp_pool, step, logging):
+		results = self.evaluate_variables(mp_pool, step['variables'], logging)
+
+		while True:
+			candidates, variables = self.race_step(step, results)
+			if not candidates:
+				return results
+
+			for candidate, result in zip(candidates, self.evaluate_variables(mp_pool, variables, logging)):
+				results[candidate].extend(result)
+
+	def run_generations(self, mp_pool, logging):
+		while self.runs:
+			step = self.ask_step(logging)
+
+			# print("New solutions #" + str(iteration))
+			printProgressBar(step['runs'][0]['iteration'], self.max_iters-1, prefix = 'Progress:', suffix = 'Complete', length = 50)
+
+			results = self.evaluate_step(mp_pool, step, logging)
+			self.tell_step(step, results)
+
+	def run_async_generations(self, mp_pool, logging):
+		# Steady-state variant of run_generations. Candidates are asked ahead
+		# and submitted one at a time, so that every worker always has a
+		# rollout to run, and CMA-ES is told each popsize candidates as soon
+		# as they complete, whichever population they were asked in. Workers
+		# never wait for the slowest rollout of a generation. Restarts run one
+		# after the other.
+		# Candidates still in flight are not part of a checkpoint, a resumed
+		# run asks a new population instead, so it does not repeat the
+		# original run exactly.
+		while self.runs:
+			run = self.runs[0]
+			self.run_async_population(run, mp_pool, logging)
+			self.finish_run(run)
+
+	def run_async_population(self, run, mp_pool, logging):
+		es = run['es']
+		done = queue.Queue()
+		worker_pool = self.get_worker_pool()
+		asked = [] # (solution, variations, perturbation, stop_rules) not submitted yet
+		pending = {} # candidate id -> [solution, variations, perturbation, results, remaining rollouts]
+		finished = [] # (solution, reward)
+		variation_users = {} # id(variations) -> candidates still using them
+		in_flight = 0 # rollouts submitted and not finished
+		next_id = 0
+
+		def release(variations):
+			variation_users[id(variations)] -= 1
+			if variation_users[id(variations)] == 0:
+				del variation_users[id(variations)]
+				self.remove_variation_files(variations)
+
+		def ask_population():
+			solutions = es.ask()
+			stop_rules = self.get_stop_rules(run['previous_rewards'])
+			if self.common_random_numbers:
+				shared_variations = self.sample_variations(self.num_variations)
+				variation_users[id(shared_variations)] = len(solutions)
+				perturbations = self.sample_perturbations(1) * len(solutions)
+			else:
+				perturbations = self.sample_perturbations(len(solutions))
+
+			for solution, perturbation in zip(solutions, perturbations):
+				asked.append((solution, shared_variations if self.common_random_numbers else None, perturbation, stop_rules))
+
+		def drop_asked():
+			# Candidates asked from a distribution that CMA-ES has moved on from
+			for _, variations, _, _ in asked:
+				if variations is not None:
+					release(variations)
+			del asked[:]
+
+		def submit_candidate():
+			nonlocal next_id, in_flight
+			if not asked:
+				ask_population()
+			solution, variations, perturbation, stop_rules = asked.pop(0)
+			if variations is None:
+				variations = self.sample_variations(self.num_variations)
+				variation_users[id(variations)] = 1
+
+			variables = self.get_rollout_variables(solution, variations, perturbation, logging, stop_rules)
+			tasks = split_rollouts([variables])
+			pending[next_id] = [solution, variations, perturbation, [None] * len(tasks), len(tasks)]
+			for (_, variation), task in tasks:
+				submit_async(mp_pool, rollout_wrapper, ((next_id, variation), task), done.put)
+			in_flight += len(tasks)
+			next_id += 1
+
+		def fill():
+			# Keep at least one rollout per worker in flight, broker workers
+			# can connect and leave during the run
+			while in_flight < worker_pool.num_workers and not es.stop():
+				submit_candidate()
+
+		fill()
+		while pending:
+			item = done.get()
+			if isinstance(item, BaseException):
+				raise item
+			(candidate, variation), r = item
+			in_flight -= 1
+
+			entry = pending[candidate]
+			entry[3][variation] = r
+			entry[4] -= 1
+			if entry[4] == 0:
+				del pending[candidate]
+				solution, variations, perturbation, result, _ = entry
+				release(variations)
+				if es.stop():
+					# Stopped, only wait for the rollouts still running
+					continue
+
+				finished.append((solution, self.record_simulation(run, solution, result, perturbation)))
+				if len(finished) >= es.popsize:
+					printProgressBar(run['iteration'], self.max_iters-1, prefix = 'Progress:', suffix = 'Complete', length = 50)
+					told, finished = finished[:es.popsize], finished[es.popsize:]
+					rewards = [reward for _, reward in told]
+					self.tell(es, [solution for solution, _ in told], rewards)
+					run['previous_rewards'] = rewards
+					run['iteration'] += 1
+					run['evaluations'] += len(told)
+					self.steps += 1
+					self.checkpoint(logging)
+					drop_asked()
+
+			fill()
+		drop_asked()
+
+	def get_worker_pool(self):
+		return self.worker_pool if self.worker_pool is not None else get_shared_pool(self.num_workers, self.worker_type, self.broker_options)
+
+	def next_run_settings(self):
+		# The first run starts from initial_values. Without restart options, a
+		# run that stops within two generations is restarted the same way. With
+		# IPOP every restart starts from a uniformly random point with twice
+		# the population size of the previous one. BIPOP alternates between
+		# those large populations and small populations with a smaller step
+		# size, spending about as many evaluations on both.
+		# The settings are drawn once and kept until the run is started.
+		if self.next_run is not None:
+			return self.next_run
+
+		restarts = self.restarts if self.restarts is not None else {}
+		strategy = restarts.get('strategy', 'ipop')
+		factor = restarts.get('popsize_factor', 2)
+		index = len(self.finished_runs) + len(self.runs)
+		x0 = self.normalize_initial_values()
+		sigma = self.initial_sigma
+		covariance = self.initial_covariance
+		popsize = self.popsize
+		regime = 'default'
+		if index > 0 and self.restarts is not None:
+			x0 = list(self.random.rand(len(x0)))
+			sigma = self.variances
+			covariance = None
+			evaluations = {'large': 0, 'small': 0}
+			for run in self.finished_runs + self.runs:
+				if run['regime'] in evaluations:
+					evaluations[run['regime']] += run['evaluations']
+
+			if strategy == 'bipop' and self.large_restarts > 0 and evaluations['small'] < evaluations['large']:
+				regime = 'small'
+				u = self.random.rand()
+				popsize = int(self.popsize * (0.5 * factor**self.large_restarts)**(u**2))
+				sigma = self.variances * 10**(-2 * u)
+			else:
+				regime = 'large'
+				self.large_restarts += 1
+				popsize = self.popsize * factor**self.large_restarts
+
+		self.next_run = {'run': index, 'x0': x0, 'sigma': sigma, 'covariance': covariance, 'popsize': max(popsize, 2), 'regime': regime}
+		return self.next_run
+
+	def new_run(self):
+		settings = self.next_run_settings()
+		self.next_run = None
+
+		if self.multi_objective is not None:
+			es = NSGA2(settings['x0'], settings['sigma'], {'popsize': settings['popsize'], 'maxiter': self.max_iters})
+		else:
+			es = cma.CMAEvolutionStrategy(settings['x0'], settings['sigma'],
+				{'popsize': settings['popsize'], 'boundary_handling': 'BoundTransform ','bounds': [0,1], 'maxiter' : self.max_iters,'verbose' :-1})
+			if settings['covariance'] is not None:
+				set_covariance(es, settings['covariance'])
 		# print('Population size: ' + str(es.popsize))
-		self.seed = es.opts['seed']
 
-		iteration = 0
-		simulation_id = 0
-		mp_pool = multiprocessing.Pool(8)
+		run = {'run': settings['run'], 'es': es, 'iteration': 0, 'evaluations': 0, 'previous_rewards': None, 'regime': settings['regime'], 'popsize': es.popsize, 'sigma': settings['sigma'], 'seed': es.opts['seed']}
+		self.runs.append(run)
+		return run
+
+	def can_restart(self, run=None):
+		if self.restarts is None:
+			# Only runs that stopped before their second generation
+			return run is not None and run['iteration'] < 2 and len(self.finished_runs) <= MAX_EARLY_RESTARTS
+		return len(self.finished_runs) + len(self.runs) <= self.restarts.get('max_restarts', 9)
+
+	def start_concurrent_runs(self):
+		# Start restarts early while one generation of all active runs leaves
+		# workers idle, only when restarts are configured with concurrent=True
+		if self.restarts is None or not self.restarts.get('concurrent', False) or self.async_mode:
+			return
+
+		workers = self.get_worker_pool().num_workers
+		rollouts_per_candidate = max(self.num_variations, 1)
+		while self.can_restart():
+			rollouts = sum(run['popsize'] for run in self.runs) + self.next_run_settings()['popsize']
+			if rollouts * rollouts_per_candidate > workers:
+				return
+			self.new_run()
+
+	def finish_run(self, run):
+		self.runs.remove(run)
+		stop = run['es'].stop()
+		run['stop'] = [str(key) for key in stop] if isinstance(stop, dict) else str(stop)
+		self.finished_runs.append(run)
+
+		if self.can_restart(run):
+			self.new_run()
+
+	def start_optimization(self):
+		self.runs = []
+		self.finished_runs = []
+		self.next_run = None
+		self.large_restarts = 0
+		self.steps = 0
+		self.seed = self.new_run()['seed']
+
+		if self.checkpoint_interval and self.checkpoint_path is None:
+			self.checkpoint_path = 'experiment_logs/' + self.collection_name + '-checkpoint-' + time.strftime("%Y%m%d-%H%M%S") + '.pickle'
+
+		if self.stream_simulations:
+			if self.simulation_log_path is None:
+				self.simulation_log_path = 'experiment_logs/' + self.collection_name + '-simulations-' + time.strftime("%Y%m%d-%H%M%S") + '.records'
+			self.simulation_writer = RecordWriter(self.simulation_log_path, truncate=0)
+
+		self.start_time = time.time()
+
+	def finish_optimization(self):
+		# Save the results once all runs have stopped
+		self.total_computation_time = time.time() - self.start_time
+
+		self.rollouts_per_second = self.total_rollouts / self.total_computation_time
+		print('{} rollouts in {:.1f} s: {:.2f} rollouts per second ({})'.format(self.total_rollouts, self.total_computation_time, self.rollouts_per_second, 'async' if self.async_mode else 'sync'))
+
+		if self.surrogate is not None:
+			print('Surrogate saved {} rollouts'.format(self.surrogate_saved_rollouts))
+
+		if self.pareto_archive is not None:
+			print('Pareto front of {} candidates'.format(len(self.pareto_archive.ids)))
 
-		if self.perturbation_params:
-			perturb_cov = np.diag(self.perturbation_params['perturb_variances'])
+		print("Stopping CMA ES")
+		self.remove_base_model_file()
 
-		while not es.stop():
-			solutions = es.ask()
+		# The ES of the run that found the best candidate
+		es = [run['es'] for run in self.finished_runs if run['run'] == self.best_run][0]
+		res = es.result()
 
-			solution_variations = [self.sample_variations(self.num_variations) for _ in range(len(solutions))]
+		if self.simulation_writer is not None:
+			self.simulation_writer.close()
 
-			# variation_indices = [int(random.uniform(0, len(self.model_files))) for _ in range(len(solutions))]
-			# model_files = [self.model_files[i] for i in variation_indices]
-			
-			if self.perturbation_params:
-				solution_perturbations = []
-				for _ in range(len(solutions)):
-					occurences = np.random.geometric(p=1/self.perturbation_params['expected_occurences']) - 1 # numpy uses shifted geometric
-					perturbations = []
-					for i in range(occurences):
-						perturb_time = np.random.random() * 14
-						force_torque = np.random.multivariate_normal(self.perturbation_params['perturb_means'], perturb_cov)
-						perturbations.append([perturb_time, list(force_torque)])
-					solution_perturbations.append(perturbations)
-			else:
-				solution_perturbations = [[]]*len(solutions)
+		document = self.get_document()
+		if self.save_in_database:
+			self.save_in_db(document)
+			self.save_es_object_to_file(es)
+		else:
+			self.save_to_file(document)
+			self.save_es_object_to_file(es)
+		self.remove_checkpoint()
 
-			# print("New solutions #" + str(iteration))
-			printProgressBar(iteration, self.max_iters-1, prefix = 'Progress:', suffix = 'Complete', length = 50)
-
-			x = [{
-				'model_files': variations[0],
-				'closed_loop': self.closed_loop,
-				'params': self.denormalize(x),
-				'render': False,
-				'logging': logging,
-				'perturbations': p} for x, variations, p in zip(solutions, solution_variations, solution_perturbations)]
-			results = mp_pool.map(eval_wrapper, x)
-
-			# Clean temp files
-			for var in solution_variations:
-				for f in var[0]:
-					os.remove(f)
-
-			rewards = []
-			max_reward = 0
-			avg_reward = 0
-			for result, solution, variations, perturbation in zip(results, solutions, solution_variations, solution_perturbations):
-				solution_rewards = []
-
-				simulated_time, distance, energy_consumed, action_history, sensor_history = [], [], [], [], []
-
-				for r in result:
-					succes, st, d, ec, ah, sh = r
-					simulated_time.append(st)
-					distance.append(d)
-					energy_consumed.append(ec)
-					action_history.append(ah)
-					sensor_history.append(sh)
-					self.total_simulated_time += st
-					reward = 0 if d < 0 or not succes else (d * np.tanh(self.E_ref/ec))
-					solution_rewards.append(reward)
-
-				reward = sum(solution_rewards) / len(solution_rewards)
-
-				rewards.append(reward*-1) # May need to be a numpy.ndarray
-
-				# variations_delta_dicts = [v[1] for v in variations]
-				
-				avg_reward += reward
-				simulation_dict = {'iter': iteration,
-									'cpg_params': self.denormalize(solution).tolist(),
-									'simulated_time': simulated_time,
-									'distance': distance,
-									'energy': energy_consumed,
-									'action_history': action_history,
-									'sensor_history': sensor_history,
-									'reward': reward,
-									# 'variation_index': variation_index,
-									'perturbation': perturbation,
-									# 'variations': variations_delta_dicts,
-								}
-				self.simulations.append(simulation_dict)
+	def continue_optimization(self, logging):
+		mp_pool = self.get_worker_pool().get()
 
-				# update self.best_id
-				if reward > self.best_reward:
-					self.best_id = simulation_id
-					self.best_reward = reward
+		if self.async_mode:
+			self.run_async_generations(mp_pool, logging)
+		else:
+			self.run_generations(mp_pool, logging)
 
-				if reward > max_reward:
-					max_reward = reward
+		self.finish_optimization()
 
-				simulation_id += 1
+	def run_optimization(self, logging=False):
+		self.start_optimization()
+		self.continue_optimization(logging)
 
-			avg_reward /= len(solutions)
-			self.avg_score_evolution.append(avg_reward)
-			self.max_score_evolution.append(max_reward)
+	def checkpoint(self, logging):
+		if not self.checkpoint_interval or self.steps % self.checkpoint_interval != 0:
+			return
 
-			es.tell(solutions, rewards)
-			# es.disp()
+		import pickle
+		self.total_computation_time = time.time() - self.start_time
+
+		state = dict(self.__dict__)
+		# The workers stay with this process, and the temporary base model is
+		# generated again after a resume
+		state['worker_pool'] = None
+		state['base_model_file'] = None
+		# Records written after this checkpoint are dropped on resume
+		if self.simulation_writer is not None:
+			self.simulation_writer.sync()
+
+		checkpoint = {'experiment': state,
+					'logging': logging,
+					'numpy_random_state': np.random.get_state(),
+					'random_state': random.getstate(),
+		}
 
-			iteration += 1
+		# Write next to the old checkpoint and swap, a crash while writing
+		# leaves the previous checkpoint intact
+		tmp_path = self.checkpoint_path + '.tmp'
+		with open(tmp_path, 'wb') as f:
+			pickle.dump(checkpoint, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, self.checkpoint_path)
+
+	def remove_checkpoint(self):
+		if self.checkpoint_interval and self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+			os.remove(self.checkpoint_path)
+
+	@classmethod
+	def resume(cls, path, worker_pool=None):
+		# Continue an experiment from a checkpoint written by checkpoint().
+		# The experiment's own random state comes back with it. CMA-ES samples
+		# its candidates from the global numpy random state, which is restored
+		# as well, but experiments running in the same process share that
+		# state. Only a standalone synchronous run continues exactly as it would
+		# have without the interruption.
+		import pickle
+		with open(path, 'rb') as f:
+			checkpoint = pickle.load(f)
 
-		print("Stopping CMA ES")
-		res = es.result()
+		experiment = cls.__new__(cls)
+		experiment.__dict__.update(checkpoint['experiment'])
+		experiment.worker_pool = worker_pool
+		experiment.checkpoint_path = path
 
-		if iteration < 2: #restart
-			mp_pool.terminate()
-			self.init_document()
-			return self.run_optimization(logging)
-		else:
-			document = self.get_document()
-			if self.save_in_database:
-				self.save_in_db(document)
-				self.save_es_object_to_file(es)
-			else:
-				self.save_to_file(document)
-				self.save_es_object_to_file(es)
+		np.random.set_state(checkpoint['numpy_random_state'])
+		random.setstate(checkpoint['random_state'])
+
+		# Time spent before the checkpoint counts towards the total
+		experiment.start_time = time.time() - experiment.total_computation_time
+		experiment.continue_optimization(checkpoint['logging'])
+		return experiment
 
 	def save_in_db(self, document):
+		# Summary document plus one document per generation, see mongo_store.py
 		try:
-			# Save results in DB
-			client = MongoClient('localhost', 27017)
-			db = client['thesis']
-			experiments_collection = db[self.collection_name]
-			insert_result = experiments_collection.insert_one(document)
-			return insert_result.inserted_id
-		except ServerSelectionTimeoutError:
+			start = time.time()
+			simulations = get_simulations(document)
+			try:
+				experiment_id, num_documents = save_experiment(get_database(), self.collection_name, document, simulations)
+			finally:
+				if hasattr(simulations, 'close'):
+					simulations.close()
+			duration = time.time() - start
+			print('Saved {} documents in {:.1f} s: {:.0f} documents per second'.format(num_documents, duration, num_documents / max(duration, 1e-6)))
+			return experiment_id
+		except (PyMongoError, InvalidDocument) as e:
+			print('Could not save in the database ({!r}), saving to file'.format(e))
 			self.save_to_file(document)
 
 	def save_to_file(self, document):
@@ -323,12 +1165,15 @@ class Experiment:
 		doc['timestamp'] = datetime.datetime.utcnow()
 		doc['generate_model_version'] = generate_model.get_model_generator_version()
 		doc['cpg_version'] = sim.get_cpg_version()
+		doc['integrator_options'] = self.integrator_options
+		doc['simulation_options'] = self.simulation_options
 		doc['E_ref'] = self.E_ref
+		doc['stop_rules'] = self.stop_rules
 		doc['experiment_tag'] = self.experiment_tag
 		doc['experiment_tag_index'] = self.experiment_tag_index
 		doc['remarks'] = self.remarks,
 		doc['default_morphology'] = self.default_morphology
-		doc['optimization'] = 	{'type': 'CMA',
+		doc['optimization'] = 	{'type': 'NSGA2' if self.multi_objective is not None else 'CMA',
 									 'params': {
 									 	'initial_values': self.initial_values,
 									 	'lower_bounds': self.lower_bounds,
@@ -336,6 +1181,13 @@ class Experiment:
 									 	'variances': self.variances,
 									 	'max_iters': self.max_iters,
 									 	'seed': self.seed,
+									 	'async_mode': self.async_mode,
+									 	'common_random_numbers': self.common_random_numbers,
+									 	'racing': self.racing,
+									 	'surrogate': self.surrogate_options,
+									 	'restarts': self.restarts,
+									 	'multi_objective': self.multi_objective,
+									 	'warm_start': self.warm_start,
 									 }
 								}
 		doc['delta_dicts'] = self.variation_delta_dicts
@@ -345,15 +1197,28 @@ class Experiment:
 						'best_id': self.best_id,
 						'total_simulated_time': self.total_simulated_time,
 						'total_computation_time': self.total_computation_time,
+						'total_rollouts': self.total_rollouts,
+						'rollouts_per_second': self.rollouts_per_second,
+						'surrogate_saved_rollouts': self.surrogate_saved_rollouts,
+						'surrogate_correlations': self.surrogate.correlations if self.surrogate is not None else [],
 						'avg_score_evolution': self.avg_score_evolution,
 						'max_score_evolution': self.max_score_evolution,
 						'simulations': self.simulations,
+						'simulation_log': self.simulation_log_path if self.stream_simulations else None,
+						'pareto_front': [simulation_id for simulation_id, _ in self.pareto_archive.front()] if self.pareto_archive is not None else [],
+						'runs': [{key: run[key] for key in ('run', 'regime', 'popsize', 'sigma', 'seed', 'iteration', 'evaluations', 'stop')} for run in self.finished_runs],
 		}
 
 		return doc
 
 
 if __name__ == '__main__':
+	import sys
+	if len(sys.argv) > 2 and sys.argv[1] == 'resume':
+		# python Experiment.py resume experiment_logs/<checkpoint>.pickle
+		Experiment.resume(sys.argv[2])
+		sys.exit()
+
 	# lb = [0, 0, 0, 0, -1, -4, 0.5, 0.5, 0.2, 0.2, 0, 0, 0, 0, 0, 0, 0]
 	# ub = [2, 2, 2, 2, 2, 4, 10, 10, 0.7, 0.7, 1, 1, 1, 1, 1, 1, 2*np.pi]
 
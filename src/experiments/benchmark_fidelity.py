@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import pickle
+import feedback_cpg as sim
+import generate_model
+from model_variations import generate_temp_model_file
+
+NUM_ROLLOUTS = 5
+
+# Simulation settings to compare, passed as keyword arguments to feedback_cpg.evaluate.
+# The control period stays 10 ms in all of them so the same open-loop parameters apply.
+SETTINGS = [
+	('full fidelity', {}),
+	('short episode', {'duration': 10, 'warmup': 3}),
+	('coarse timestep', {'timestep': 0.005, 'skip_frames': 2}),
+	('fewer solver iterations', {'solver_iterations': 20, 'solver_tolerance': 1e-6}),
+	('rk4 cpg', {'integrator': 'rk4', 'dt': 0.01}),
+	('screening', {'duration': 10, 'warmup': 3, 'timestep': 0.005, 'skip_frames': 2, 'solver_iterations': 20, 'solver_tolerance': 1e-6, 'integrator': 'rk4', 'dt': 0.01}),
+]
+
+def benchmark(model_file, params, options):
+	simulated_time = 0
+	start = time.time()
+	for _ in range(NUM_ROLLOUTS):
+		succes, st, d, ec, ah, sh, termination = sim.evaluate(model_file, False, params, [], False, False, **options)
+		simulated_time += st
+	wall_time = time.time() - start
+
+	return (simulated_time / wall_time, wall_time / NUM_ROLLOUTS, d, ec, termination)
+
+if __name__ == '__main__':
+	params_file = sys.argv[1] if len(sys.argv) > 1 else 'final_cpgs/baseline.pickle'
+	with open(params_file, 'rb') as f:
+		params = list(pickle.load(f))
+
+	model_file = generate_temp_model_file(generate_model.model_config)
+
+	print('{:<25} {:>12} {:>12} {:>10} {:>10}  {}'.format('setting', 'sim s/wall s', 'ms/rollout', 'distance', 'energy', 'termination'))
+	for name, options in SETTINGS:
+		speed, rollout_time, distance, energy, termination = benchmark(model_file, params, options)
+		print('{:<25} {:>12.1f} {:>12.1f} {:>10.3f} {:>10.3f}  {}'.format(name, speed, rollout_time * 1000, distance, energy, termination))
+
+	os.remove(model_file)
@@ -0,0 +1,336 @@
+import os
+import sys
+import queue
+import socket
+import threading
+import time
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from worker_pool import PRELOAD_MODULES, preload_modules
+
+# Rollouts can be executed by any object with this subset of the
+# multiprocessing.Pool interface:
+#
+#   apply_async(function, args, callback, error_callback)
+#   imap_unordered(function, tasks)
+#   close(), join(), terminate()
+#
+# Local rollouts use multiprocessing.Pool itself (see WorkerPool). Broker
+# implements the same interface on top of worker daemons that connect to it,
+# from this machine or others:
+#
+#   python -m executors worker HOST:PORT --processes 8
+#
+# The messages are pickled over multiprocessing.connection, so the transport
+# is TCP for a (host, port) address and a Unix socket for a path. Workers
+# import the functions they receive, they need the same src/experiments tree
+# on their path. Connections are authenticated with the same authkey on both
+# ends, taken from the ROLLOUT_AUTHKEY environment variable by default.
+# Anyone with the authkey can run code on the workers and the broker.
+
+DEFAULT_PORT = 6000
+HEARTBEAT_INTERVAL = 5 # seconds between heartbeats of a busy worker
+HEARTBEAT_TIMEOUT = 30 # seconds without a message before a worker is considered lost
+RECONNECT_DELAY = 5
+
+def get_authkey(authkey=None):
+	if authkey is not None:
+		return authkey if isinstance(authkey, bytes) else authkey.encode()
+	if 'ROLLOUT_AUTHKEY' not in os.environ:
+		raise ValueError('No authkey given and ROLLOUT_AUTHKEY is not set')
+	return os.environ['ROLLOUT_AUTHKEY'].encode()
+
+def parse_address(address):
+	# 'host:port' for TCP, anything else is a Unix socket path
+	host, _, port = address.rpartition(':')
+	if host and port.isdigit():
+		return (host, int(port))
+	return address
+
+class WorkerLost(Exception):
+	pass
+
+class Task:
+	def __init__(self, task_id, function, args, callback, error_callback):
+		self.id = task_id
+		self.function = function
+		self.args = args
+		self.callback = callback
+		self.error_callback = error_callback
+		self.attempts = 0
+
+class Broker:
+	# Hands out tasks to connected workers, one task per worker connection at
+	# a time. A worker that disconnects or stays silent for heartbeat_timeout
+	# seconds while running a task is dropped and its task queued again, at
+	# most max_retries times. Exceptions raised by a task are not retried,
+	# they are passed to its error_callback.
+	#
+	# local_workers worker processes are started on this machine as well,
+	# with local_workers=0 all rollouts run on remote workers.
+	def __init__(self, address=('', DEFAULT_PORT), authkey=None, local_workers=0, max_retries=3, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+		self.authkey = get_authkey(authkey)
+		self.max_retries = max_retries
+		self.heartbeat_timeout = heartbeat_timeout
+
+		self.tasks = queue.Queue()
+		self.next_id = 0
+		self.pending = 0
+		self.workers = 0
+		self.lock = threading.Condition()
+		self.accepting = True
+		self.closed = False
+		self.handlers = []
+
+		self.listener = Listener(address, authkey=self.authkey)
+		self.address = self.listener.address
+		if isinstance(self.address, tuple) and self.address[0] in ('', '0.0.0.0'):
+			self.address = ('127.0.0.1', self.address[1])
+
+		# Start the local workers before any thread of this process is running
+		self.local_workers = [multiprocessing.Process(target=worker_loop, args=(self.address, self.authkey, True), daemon=True) for _ in range(local_workers)]
+		for process in self.local_workers:
+			process.start()
+
+		self.accept_thread = threading.Thread(target=self.accept, daemon=True)
+		self.accept_thread.start()
+
+	def accept(self):
+		while not self.closed:
+			try:
+				conn = self.listener.accept()
+			except (OSError, EOFError, multiprocessing.AuthenticationError):
+				# Closed listener, or a client that failed authentication
+				continue
+			handler = threading.Thread(target=self.handle, args=(conn,), daemon=True)
+			self.handlers.append(handler)
+			handler.start()
+
+	def handle(self, conn):
+		try:
+			_, host, pid = conn.recv()
+		except (OSError, EOFError):
+			conn.close()
+			return
+		name = '{}:{}'.format(host, pid)
+
+		with self.lock:
+			self.workers += 1
+		print('Worker {} connected, {} workers'.format(name, self.workers))
+
+		task = None
+		try:
+			while not self.closed:
+				try:
+					task = self.tasks.get(timeout=1)
+				except queue.Empty:
+					continue
+
+				try:
+					conn.send(('task', task.id, task.function, task.args))
+				except (OSError, EOFError):
+					raise
+				except Exception as e:
+					# Could not pickle the task, nothing was sent
+					finished, task = task, None
+					self.finish(finished, False, e)
+					continue
+
+				while True:
+					if not conn.poll(self.heartbeat_timeout):
+						raise WorkerLost()
+					try:
+						message = conn.recv()
+					except (OSError, EOFError):
+						raise
+					except Exception as e:
+						# Could not unpickle the result
+						message = ('result', task.id, False, e)
+					if message[0] != 'heartbeat':
+						break
+
+				_, _, succes, value = message
+				finished, task = task, None
+				self.finish(finished, succes, value)
+
+			conn.send(('stop',))
+		except (WorkerLost, OSError, EOFError):
+			print('Worker {} lost'.format(name))
+			if task is not None:
+				self.retry(task)
+		finally:
+			conn.close()
+			with self.lock:
+				self.workers -= 1
+
+	def finish(self, task, succes, value):
+		if succes:
+			task.callback(value)
+		else:
+			task.error_callback(value)
+
+		with self.lock:
+			self.pending -= 1
+			self.lock.notify_all()
+
+	def retry(self, task):
+		task.attempts += 1
+		if task.attempts > self.max_retries:
+			self.finish(task, False, WorkerLost('Task lost {} times'.format(task.attempts)))
+		else:
+			self.tasks.put(task)
+
+	def apply_async(self, function, args=(), callback=None, error_callback=None):
+		if not self.accepting:
+			raise ValueError('Broker is closed')
+
+		def ignore(value):
+			pass
+
+		with self.lock:
+			task = Task(self.next_id, function, args, callback or ignore, error_callback or ignore)
+			self.next_id += 1
+			self.pending += 1
+		self.tasks.put(task)
+		return task.id
+
+	def imap_unordered(self, function, tasks):
+		results = queue.Queue()
+		count = 0
+		for task in tasks:
+			self.apply_async(function, (task,), lambda r: results.put((True, r)), lambda e: results.put((False, e)))
+			count += 1
+
+		for _ in range(count):
+			succes, value = results.get()
+			if not succes:
+				raise value
+			yield value
+
+	def close(self):
+		self.accepting = False
+
+	def join(self):
+		# Wait for the submitted tasks, then release the workers
+		with self.lock:
+			while self.pending > 0:
+				self.lock.wait()
+		self.stop(wait=True)
+
+	def terminate(self):
+		self.accepting = False
+		self.stop(wait=False)
+
+	def stop(self, wait):
+		if self.closed:
+			return
+		self.closed = True
+		self.listener.close()
+		if wait:
+			# Let every handler send its worker the stop message
+			for handler in self.handlers:
+				handler.join()
+		for process in self.local_workers:
+			process.join(timeout=RECONNECT_DELAY)
+			if process.is_alive():
+				process.terminate()
+
+
+def serve(address, authkey):
+	# Run tasks for one broker connection until the broker stops
+	conn = Client(address, authkey=authkey)
+	send_lock = threading.Lock()
+	busy = threading.Event()
+	done = threading.Event()
+
+	def send(message):
+		with send_lock:
+			conn.send(message)
+
+	def heartbeat():
+		while not done.wait(HEARTBEAT_INTERVAL):
+			if busy.is_set():
+				try:
+					send(('heartbeat',))
+				except OSError:
+					return
+
+	send(('hello', socket.gethostname(), os.getpid()))
+	threading.Thread(target=heartbeat, daemon=True).start()
+
+	try:
+		while True:
+			message = conn.recv()
+			if message[0] == 'stop':
+				return
+
+			_, task_id, function, args = message
+			busy.set()
+			try:
+				result = ('result', task_id, True, function(*args))
+			except Exception as e:
+				result = ('result', task_id, False, e)
+			busy.clear()
+			send(result)
+	except EOFError:
+		pass
+	finally:
+		done.set()
+		conn.close()
+
+def worker_loop(address, authkey, once=False):
+	preload_modules(PRELOAD_MODULES)
+
+	while True:
+		try:
+			serve(address, authkey)
+			if once:
+				return
+		except (ConnectionRefusedError, FileNotFoundError):
+			# Broker not running (yet)
+			if once:
+				return
+		except OSError:
+			# Connection dropped, reconnect to the restarted broker
+			if once:
+				return
+		time.sleep(RECONNECT_DELAY)
+
+def run_worker(address, authkey=None, processes=None):
+	# Worker daemon: one process per core by default, each with its own
+	# connection to the broker. Workers reconnect when the broker restarts,
+	# so the same daemons serve every experiment of a sweep.
+	authkey = get_authkey(authkey)
+	processes = processes if processes else (os.cpu_count() or 1)
+
+	def start():
+		process = multiprocessing.Process(target=worker_loop, args=(address, authkey))
+		process.start()
+		return process
+
+	workers = [start() for _ in range(processes)]
+	print('Started {} workers for broker {}'.format(processes, address))
+
+	try:
+		while True:
+			# Replace workers that crashed, e.g. in the simulator
+			for i, process in enumerate(workers):
+				if not process.is_alive():
+					print('Worker {} exited with code {}, restarting'.format(process.pid, process.exitcode))
+					workers[i] = start()
+			time.sleep(RECONNECT_DELAY)
+	except KeyboardInterrupt:
+		for process in workers:
+			process.terminate()
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 3 or sys.argv[1] != 'worker':
+		print('Usage: python -m executors worker HOST:PORT [--processes N]')
+		sys.exit(1)
+
+	processes = None
+	if '--processes' in sys.argv:
+		processes = int(sys.argv[sys.argv.index('--processes') + 1])
+
+	run_worker(parse_address(sys.argv[2]), processes=processes)
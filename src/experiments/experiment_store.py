@@ -0,0 +1,237 @@
+import os
+import sys
+import bisect
+import json
+import glob
+import pickle
+import shutil
+import numpy as np
+from record_log import get_simulations
+
+# Columnar copy of the simulations of many experiment documents, for plots
+# and summaries that only need a few numbers per simulation. A store is a
+# directory with one .npy file per column (one row per simulation) and
+# meta.json, which describes the experiments. Columns are memory-mapped, so
+# opening a store reads nothing until a column is used.
+#
+# Columns:
+#   experiment      index into ExperimentStore.experiments
+#   experiment_tag  code into ExperimentStore.tags, sorted like the tags
+#   E_ref, iter, run, reward
+#   distance, energy, simulated_time  means over the rollouts of a simulation
+#   best            the best simulation (best_id) of its experiment
+#   cpg_params      one row of CPG parameters per simulation
+#
+# INDEXED_COLUMNS have a sorted index: the argsort of the column
+# (<column>.index.npy) and the sorted values (<column>.sorted.npy). Equality
+# and range queries on them use a binary search on the sorted values.
+
+INDEXED_COLUMNS = ['experiment_tag', 'E_ref', 'iter', 'reward']
+COLUMN_TYPES = {
+	'experiment': np.int32,
+	'experiment_tag': np.int32,
+	'E_ref': np.float64,
+	'iter': np.int32,
+	'run': np.int32,
+	'reward': np.float64,
+	'distance': np.float64,
+	'energy': np.float64,
+	'simulated_time': np.float64,
+	'best': np.bool_,
+	'cpg_params': np.float64,
+}
+
+def write_store(path, documents):
+	# Build a store from experiment documents, replacing any store at path.
+	# The documents are read one at a time, only the columns are kept.
+	columns = {name: [] for name in COLUMN_TYPES}
+	experiments = []
+	tags = []
+	for doc in documents:
+		E_ref = doc.get('E_ref', doc.get('E0'))
+		E_ref = float(E_ref) if E_ref is not None else np.nan
+		tag = doc.get('experiment_tag') or ''
+		# Experiment documents store remarks in a tuple
+		remarks = doc.get('remarks')
+		if isinstance(remarks, (list, tuple)):
+			remarks = remarks[0] if remarks else None
+		results = doc['results']
+
+		first_row = len(columns['iter'])
+		simulations = get_simulations(doc)
+		for simulation_id, simulation in enumerate(simulations):
+			columns['experiment'].append(len(experiments))
+			columns['experiment_tag'].append(tag)
+			columns['E_ref'].append(E_ref)
+			columns['iter'].append(simulation['iter'])
+			columns['run'].append(simulation.get('run', 0))
+			columns['reward'].append(simulation['reward'])
+			columns['distance'].append(np.mean(simulation['distance']))
+			columns['energy'].append(np.mean(simulation['energy']))
+			columns['simulated_time'].append(np.mean(simulation['simulated_time']))
+			columns['best'].append(simulation_id == results['best_id'])
+			columns['cpg_params'].append(simulation['cpg_params'])
+		if hasattr(simulations, 'close'):
+			simulations.close()
+
+		experiments.append({
+			'id': str(doc.get('_id', '')),
+			'experiment_tag': tag,
+			'E_ref': E_ref,
+			'remarks': remarks,
+			'timestamp': str(doc.get('timestamp')),
+			'first_row': first_row,
+			'num_simulations': len(columns['iter']) - first_row,
+			'best_row': first_row + results['best_id'],
+		})
+		if tag not in tags:
+			tags.append(tag)
+
+	# Tag codes in sorted order, so the index on them sorts by tag
+	tags = sorted(tags)
+	codes = {tag: code for code, tag in enumerate(tags)}
+	columns['experiment_tag'] = [codes[tag] for tag in columns['experiment_tag']]
+
+	tmp_path = path.rstrip('/') + '.tmp'
+	if os.path.exists(tmp_path):
+		shutil.rmtree(tmp_path)
+	os.makedirs(tmp_path)
+
+	for name, values in columns.items():
+		array = np.array(values, dtype=COLUMN_TYPES[name])
+		if name == 'cpg_params' and array.ndim != 2:
+			array = array.reshape(len(values), -1 if values else 0)
+		np.save(os.path.join(tmp_path, name + '.npy'), array)
+		if name in INDEXED_COLUMNS:
+			index = np.argsort(array, kind='stable').astype(np.int64)
+			np.save(os.path.join(tmp_path, name + '.index.npy'), index)
+			np.save(os.path.join(tmp_path, name + '.sorted.npy'), array[index])
+
+	with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+		json.dump({'rows': len(columns['iter']), 'tags': tags, 'experiments': experiments}, f, default=str)
+
+	# Swap in the new store only once it is complete
+	if os.path.exists(path):
+		shutil.rmtree(path)
+	os.rename(tmp_path, path)
+
+class ExperimentStore:
+	def __init__(self, path):
+		self.path = path
+		with open(os.path.join(path, 'meta.json')) as f:
+			meta = json.load(f)
+		self.rows = meta['rows']
+		self.tags = meta['tags']
+		self.experiments = meta['experiments']
+		self.cache = {}
+
+	def column(self, name):
+		if name not in self.cache:
+			self.cache[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+		return self.cache[name]
+
+	def index(self, name):
+		# Argsort and sorted values of an indexed column
+		return (self.column(name + '.index'), self.column(name + '.sorted'))
+
+	def encode(self, name, value):
+		# Tags are queried by name
+		if name != 'experiment_tag':
+			return value
+		if value not in self.tags:
+			return -1
+		return self.tags.index(value)
+
+	def encode_range(self, name, low, high):
+		# Inclusive range of tag names as a range of codes. Codes are sorted
+		# like the tags, so the ends do not have to be existing tags.
+		if name != 'experiment_tag':
+			return (low, high)
+		if low is not None:
+			low = bisect.bisect_left(self.tags, low)
+		if high is not None:
+			high = bisect.bisect_right(self.tags, high) - 1
+		return (low, high)
+
+	def query(self, **filters):
+		# Sorted row numbers of the simulations that match all filters. A
+		# filter value is matched exactly, a (low, high) tuple is an inclusive
+		# range, either end can be None. For example
+		# query(experiment_tag='mass_noise_inertia', E_ref=15, iter=(100, None))
+		# Tag ranges compare the names, e.g. experiment_tag=('mass', 'mass_z')
+		rows = None
+		masks = []
+		for name, value in filters.items():
+			if isinstance(value, tuple):
+				low, high = self.encode_range(name, *value)
+			else:
+				low = high = self.encode(name, value)
+
+			if name in INDEXED_COLUMNS:
+				index, values = self.index(name)
+				start = 0 if low is None else np.searchsorted(values, low, side='left')
+				end = len(index) if high is None else np.searchsorted(values, high, side='right')
+				matches = np.sort(index[start:end])
+				rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+			else:
+				masks.append((name, low, high))
+
+		if rows is None:
+			rows = np.arange(self.rows)
+		for name, low, high in masks:
+			values = self.column(name)[rows]
+			keep = np.ones(len(rows), dtype=bool)
+			if low is not None:
+				keep &= values >= low
+			if high is not None:
+				keep &= values <= high
+			rows = rows[keep]
+		return rows
+
+	def select(self, columns, **filters):
+		# Arrays of the given columns for the rows that match the filters,
+		# e.g. select(['E_ref', 'distance', 'energy'], best=True)
+		rows = self.query(**filters)
+		return {name: np.array(self.column(name)[rows]) for name in columns}
+
+	def tag(self, rows):
+		return [self.tags[code] for code in self.column('experiment_tag')[rows]]
+
+
+def print_best(collection_name):
+	# Best simulation of every experiment in experiment_store/<collection_name>,
+	# build it first with: python experiment_store.py build COLLECTION_NAME
+	store = ExperimentStore(os.path.join('experiment_store', collection_name))
+	best = store.select(['experiment', 'reward', 'distance', 'energy'], best=True)
+	for i, experiment in enumerate(best['experiment']):
+		remarks = store.experiments[experiment]['remarks']
+		print('{}: reward {:.2f}, distance {:.2f}, energy {:.2f}'.format(remarks, best['reward'][i], best['distance'][i], best['energy'][i]))
+
+
+def load_documents(collection_name=None, files=None):
+	# Documents from a Mongo collection, or from pickles written by
+	# Experiment.save_to_file
+	if files:
+		for filename in files:
+			with open(filename, 'rb') as f:
+				yield pickle.load(f)
+	else:
+		from pymongo import MongoClient
+		client = MongoClient('localhost', 27017)
+		yield from client['thesis'][collection_name].find()
+
+
+if __name__ == '__main__':
+	# python experiment_store.py build COLLECTION [experiment_logs/*.pickle]
+	# writes experiment_store/COLLECTION from the collection, or from the
+	# given pickles
+	if len(sys.argv) < 3 or sys.argv[1] != 'build':
+		print('Usage: python experiment_store.py build COLLECTION [PICKLE ...]')
+		sys.exit(1)
+
+	collection_name = sys.argv[2]
+	files = [filename for pattern in sys.argv[3:] for filename in glob.glob(pattern)]
+	os.makedirs('experiment_store', exist_ok=True)
+	write_store(os.path.join('experiment_store', collection_name), load_documents(collection_name, files))
+	store = ExperimentStore(os.path.join('experiment_store', collection_name))
+	print('{} simulations of {} experiments'.format(store.rows, len(store.experiments)))
@@ -3,7 +3,8 @@ import math
 import numpy as np
 
 #In version 2 added limit to knee joint angles
-VERSION = 2
+#In version 3 named the knee joints, feet, springs and actuators so variations can be applied to the compiled model
+VERSION = 3
 
 # MODEL PARAMETERS
 model_config = {
@@ -245,14 +246,14 @@ class Leg(object):
 
 		tibia = etree.Element('body')
 		tibia_geom = etree.Element('geom', type='capsule', fromto=self.tibia_attachment.get_rescaled_text() + ' ' + self.tibia_foot.get_rescaled_text(), condim=str(condim))
-		tibia_joint = etree.Element('joint', limited='true', range='-60 0', pos=self.femur_tibia_joint.get_rescaled_text(), damping=str(self.config['knee_damping']))
+		tibia_joint = etree.Element('joint', limited='true', range='-60 0', pos=self.femur_tibia_joint.get_rescaled_text(), name='knee_' + str(self.leg_id), damping=str(self.config['knee_damping']))
 		tibia_site = etree.Element('site', name='s'+str(self.leg_id)+'_2', pos=self.tibia_attachment.get_rescaled_text())
 
 		foot = etree.Element('body', pos=self.tibia_foot.get_rescaled_text())
 		if not self.with_foot:
-			foot_geom = etree.Element('geom', condim='3', friction='1 0.005 0.0001', type='capsule', fromto=self.tibia_foot.get_rescaled_text() + ' ' + self.tibia_foot2.get_rescaled_text())
+			foot_geom = etree.Element('geom', condim='3', friction='1 0.005 0.0001', type='capsule', fromto=self.tibia_foot.get_rescaled_text() + ' ' + self.tibia_foot2.get_rescaled_text(), name='foot_' + str(self.leg_id))
 		else:
-			foot_geom = etree.Element('geom', condim='3', friction="{0:.5f} 0.005 0.0001".format(self.config['foot_friction']), type='capsule', fromto=self.tibia_foot.get_rescaled_text() + ' ' + self.tibia_foot2.get_rescaled_text(), size='0.075')
+			foot_geom = etree.Element('geom', condim='3', friction="{0:.5f} 0.005 0.0001".format(self.config['foot_friction']), type='capsule', fromto=self.tibia_foot.get_rescaled_text() + ' ' + self.tibia_foot2.get_rescaled_text(), size='0.075', name='foot_' + str(self.leg_id))
 		
 		foot_site = etree.Element('site', name='sensor_'+str(self.leg_id), pos=self.tibia_foot.get_rescaled_text())
 
@@ -264,7 +265,7 @@ class Leg(object):
 		tendon_max = tendon_min*10
 
 		tendon = etree.Element('tendon')
-		spatial = etree.Element('spatial', stiffness=str(self.config['spring_stiffness']), range="{0:.5f} {1:.5f}".format(tendon_min, tendon_max))
+		spatial = etree.Element('spatial', name='spring_' + str(self.leg_id), stiffness=str(self.config['spring_stiffness']), range="{0:.5f} {1:.5f}".format(tendon_min, tendon_max))
 		site1 = etree.Element('site', site='s'+str(self.leg_id)+'_1')
 		site2 = etree.Element('site', site='s'+str(self.leg_id)+'_2')
 
@@ -272,7 +273,7 @@ class Leg(object):
 		tendon.append(spatial)
 		tendons.append(tendon)
 
-		actuators.append(etree.Element('position', forcelimited="true", forcerange="-50 50", joint="shoulder_"+str(self.leg_id), gear="1", kp=str(self.config['actuator_kp'])))
+		actuators.append(etree.Element('position', name='act_' + str(self.leg_id), forcelimited="true", forcerange="-50 50", joint="shoulder_"+str(self.leg_id), gear="1", kp=str(self.config['actuator_kp'])))
 		sensors.append(etree.Element('force', site='sensor_'+str(self.leg_id)))
 
 		return leg
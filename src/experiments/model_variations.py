@@ -69,10 +69,12 @@ def insert_in_dict(d, path, value):
 		counter += 1
 
 
-def sample_multivariate_from_dict(d, num_samples=1):
+def sample_multivariate_from_dict(d, num_samples=1, random_state=None):
+	if random_state is None:
+		random_state = np.random
 	sample_paths, sample_mean, sample_var, bindings = extract_sample_variables(d)
 	cov = np.diag(sample_var)
-	samples = np.random.multivariate_normal(sample_mean, cov, num_samples)
+	samples = random_state.multivariate_normal(sample_mean, cov, num_samples)
 
 	delta_dicts = []
 
@@ -89,6 +91,85 @@ def sample_multivariate_from_dict(d, num_samples=1):
 	return delta_dicts
 
 
+# Variations that feedback_cpg can apply directly to a compiled model,
+# keyed by their path in the model config (see ModelVariation.cpp). The torso
+# segment masses are not among them: all segments are geoms of one body, so
+# their masses also move its center of mass, which the compiled model cannot
+# recompute.
+PATCHABLE_LEG_PARAMS = ['foot_friction', 'spring_stiffness', 'hip_damping', 'knee_damping', 'actuator_kp']
+PATCHABLE_PATHS = ['battery_weight']
+PATCHABLE_PATHS.extend(['legs.' + leg + '.' + param for leg in ['FL', 'FR', 'BL', 'BR'] for param in PATCHABLE_LEG_PARAMS])
+
+
+def flatten_delta_dict(d, top_path=''):
+	"""Flatten a (nested) delta dict to a dict keyed by dotted paths,
+	e.g. {'legs': {'FL': {'foot_friction': 0.1}}} -> {'legs.FL.foot_friction': 0.1}
+	
+	"""
+
+	flat = {}
+	for key, value in d.items():
+		current_path = top_path + '.' + key if top_path != '' else key
+		if isinstance(value, dict):
+			flat.update(flatten_delta_dict(value, current_path))
+		else:
+			flat[current_path] = float(value)
+
+	return flat
+
+
+def config_value(config, path):
+	"""Value at a dotted path of a (nested) config dict, None when it is missing."""
+
+	for key in path.split('.'):
+		if not isinstance(config, dict) or key not in config:
+			return None
+		config = config[key]
+	return config
+
+
+def can_patch_variations(variation_params, base_config=None):
+	"""Check if all parameters sampled from variation_params (including the
+	bound paths) can be applied to the compiled model instead of regenerating XML.
+	Every path has to be a number in base_config: generating XML ignores deltas
+	of parameters the config does not have, patching would not. The battery
+	weight can only be patched when base_config has a battery, the battery
+	body is left out of the model otherwise.
+	
+	"""
+
+	if not variation_params:
+		return True
+	if base_config is None:
+		return False
+
+	paths, _, _, bindings = extract_sample_variables(variation_params)
+	for bound_paths in bindings.values():
+		paths.extend(bound_paths)
+
+	for path in paths:
+		value = config_value(base_config, path)
+		if path not in PATCHABLE_PATHS or isinstance(value, bool) or not isinstance(value, (int, float)):
+			return False
+
+	if 'battery_weight' in paths and base_config['battery_weight'] <= 0:
+		return False
+
+	return True
+
+
+def sample_model_deltas(variation_params, num=1, random_state=None):
+	"""Sample variations like generate_model_variations, but return them as
+	flat delta dicts to be applied to the compiled base model by feedback_cpg.
+
+	returns a tuple: (model_deltas, delta_dicts)
+
+	"""
+
+	delta_dicts = sample_multivariate_from_dict(variation_params, num_samples=num, random_state=random_state)
+	return ([flatten_delta_dict(delta) for delta in delta_dicts], delta_dicts)
+
+
 def generate_temp_model_file(config):
 	fd, xml_path = tempfile.mkstemp(suffix='.xml', prefix='model')
 	generate_xml_model(xml_path, config)
@@ -101,18 +182,19 @@ def generate_temp_model_file(config):
 	return xml_path
 
 
-def generate_model_variations(base_config, variation_params, num=1):
+def generate_model_variations(base_config, variation_params, num=1, random_state=None):
 	"""Generate model variations based on a base config dictionary
 	and a dictionary of the variation parameters. These parameters
 	specify the mean and variance of the normal distribution used to
-	sample the new model config.
+	sample the new model config, from random_state (a numpy RandomState)
+	or the global numpy random state.
 
 	returns a tuple: (variation_xml_paths, delta_dicts)
 	
 	"""
 
 	variation_xml_paths = []
-	delta_dicts = sample_multivariate_from_dict(variation_params, num_samples=num)
+	delta_dicts = sample_multivariate_from_dict(variation_params, num_samples=num, random_state=random_state)
 
 	for delta in delta_dicts:
 		config = dict_elementwise_operator(base_config, delta, operator=operator.add)
@@ -0,0 +1,201 @@
+import io
+import numpy as np
+import bson
+import gridfs
+from bson import ObjectId
+from bson.binary import Binary
+from pymongo import MongoClient
+from utils import to_bson_compatible
+
+# Layout of an experiment in MongoDB, so that no document comes near the
+# 16 MB limit however long the run or whatever is logged:
+#
+#   <collection>              one summary document per experiment: the
+#                             experiment document without its simulations.
+#                             results.simulation_collection names the
+#                             collection that holds them.
+#   <collection>_simulations  one document per generation (consecutive
+#                             simulations of the same run and iteration),
+#                             with experiment_id, run, iter, first_id (index
+#                             of its first simulation) and simulations. A
+#                             generation larger than DOCUMENT_LIMIT is split
+#                             over several documents, each with the first_id
+#                             of its own first simulation.
+#   <collection>_arrays       GridFS files of the arrays above BINARY_LIMIT.
+#
+# Logged histories (ARRAY_FIELDS) are stored as .npy bytes, in a binary field
+# of the simulation or in GridFS when larger than BINARY_LIMIT, or when the
+# simulation would not fit in DOCUMENT_LIMIT otherwise. The summary document
+# is inserted last, an experiment that is found is complete.
+
+BINARY_LIMIT = 1 << 20
+DOCUMENT_LIMIT = 8 << 20 # encoded bytes per generation document, half the MongoDB limit
+BATCH_SIZE = 100 # generation documents per insert_many
+ARRAY_FIELDS = ['action_history', 'sensor_history']
+
+def get_database():
+	client = MongoClient('localhost', 27017)
+	return client['thesis']
+
+def array_bytes(value):
+	# .npy bytes of a rollout history, histories that are not arrays (e.g.
+	# empty when not logged) are kept as they are
+	if not isinstance(value, np.ndarray):
+		if value is None or len(value) == 0:
+			return value
+		try:
+			value = np.asarray(value, dtype=np.float64)
+		except ValueError:
+			return value
+
+	f = io.BytesIO()
+	np.save(f, value, allow_pickle=False)
+	return f.getvalue()
+
+def encode_simulation(simulation, fs, files):
+	# A simulation as it is stored and its encoded size. Histories above
+	# BINARY_LIMIT go to GridFS, then the largest ones that are left until the
+	# simulation fits in DOCUMENT_LIMIT. The ids of new GridFS files are added
+	# to files.
+	simulation = dict(simulation)
+	inline = [] # (size, field, rollout) of the histories stored in the document
+	for field in ARRAY_FIELDS:
+		if field in simulation:
+			simulation[field] = [array_bytes(value) for value in simulation[field]]
+			for rollout, data in enumerate(simulation[field]):
+				if not isinstance(data, bytes):
+					continue
+				if len(data) > BINARY_LIMIT:
+					files.append(fs.put(data))
+					simulation[field][rollout] = {'gridfs': files[-1]}
+				else:
+					simulation[field][rollout] = {'npy': Binary(data)}
+					inline.append((len(data), field, rollout))
+
+	inline.sort()
+	while True:
+		encoded = to_bson_compatible(simulation)
+		size = len(bson.encode(encoded))
+		if size <= DOCUMENT_LIMIT or not inline:
+			return (encoded, size)
+		_, field, rollout = inline.pop()
+		files.append(fs.put(bytes(simulation[field][rollout]['npy'])))
+		simulation[field][rollout] = {'gridfs': files[-1]}
+
+def decode_array(value, fs):
+	if not isinstance(value, dict):
+		return value
+	data = fs.get(value['gridfs']).read() if 'gridfs' in value else bytes(value['npy'])
+	return np.load(io.BytesIO(data), allow_pickle=False)
+
+def generations(simulations):
+	# (index of the first simulation, simulations) for every run of
+	# consecutive simulations with the same run and iteration
+	first_id, group = 0, []
+	for simulation_id, simulation in enumerate(simulations):
+		if group and (simulation.get('run', 0), simulation['iter']) != (group[0].get('run', 0), group[0]['iter']):
+			yield (first_id, group)
+			first_id, group = simulation_id, []
+		group.append(simulation)
+	if group:
+		yield (first_id, group)
+
+def generation_documents(experiment_id, first_id, group, fs, files):
+	# The documents of a generation, each with at most DOCUMENT_LIMIT bytes of
+	# simulations
+	def document(chunk_first_id, simulations):
+		return {
+			'experiment_id': experiment_id,
+			'run': group[0].get('run', 0),
+			'iter': group[0]['iter'],
+			'first_id': chunk_first_id,
+			'simulations': simulations,
+		}
+
+	chunk, chunk_first_id, chunk_size = [], first_id, 0
+	for simulation_id, simulation in enumerate(group, first_id):
+		encoded, size = encode_simulation(simulation, fs, files)
+		if chunk and chunk_size + size > DOCUMENT_LIMIT:
+			yield document(chunk_first_id, chunk)
+			chunk, chunk_first_id, chunk_size = [], simulation_id, 0
+		chunk.append(encoded)
+		chunk_size += size
+	yield document(chunk_first_id, chunk)
+
+def save_experiment(db, collection_name, document, simulations):
+	# Store an experiment document and its simulations (any iterable, e.g. a
+	# RecordReader) in the layout above. Returns the id of the summary
+	# document and the number of documents written, GridFS files included.
+	experiment_id = ObjectId()
+	simulation_collection = collection_name + '_simulations'
+	fs = gridfs.GridFS(db, collection=collection_name + '_arrays')
+	files = []
+	num_documents = 0
+	db[simulation_collection].create_index([('experiment_id', 1), ('first_id', 1)])
+
+	try:
+		batch = []
+		for first_id, group in generations(simulations):
+			for generation_document in generation_documents(experiment_id, first_id, group, fs, files):
+				batch.append(generation_document)
+				if len(batch) >= BATCH_SIZE:
+					db[simulation_collection].insert_many(batch)
+					num_documents += len(batch)
+					batch = []
+		if batch:
+			db[simulation_collection].insert_many(batch)
+			num_documents += len(batch)
+
+		summary = dict(document, _id=experiment_id)
+		summary['results'] = dict(document['results'], simulations=[], simulation_collection=simulation_collection)
+		db[collection_name].insert_one(to_bson_compatible(summary))
+	except Exception:
+		# Do not leave the simulations of an experiment that was not saved
+		db[simulation_collection].delete_many({'experiment_id': experiment_id})
+		for file_id in files:
+			fs.delete(file_id)
+		raise
+
+	return (experiment_id, num_documents + len(files) + 1)
+
+class StoredSimulations:
+	# The simulations of an experiment saved by save_experiment, fetched one
+	# generation at a time. Indexed like the simulations list of the
+	# experiment, e.g. simulations[doc['results']['best_id']].
+	def __init__(self, db, simulation_collection, experiment_id, arrays_collection):
+		self.collection = db[simulation_collection]
+		self.experiment_id = experiment_id
+		self.fs = gridfs.GridFS(db, collection=arrays_collection)
+		self.count = None
+
+	def decode(self, simulation):
+		for field in ARRAY_FIELDS:
+			if field in simulation:
+				simulation[field] = [decode_array(value, self.fs) for value in simulation[field]]
+		return simulation
+
+	def __len__(self):
+		if self.count is None:
+			last = self.collection.find_one({'experiment_id': self.experiment_id}, sort=[('first_id', -1)])
+			self.count = last['first_id'] + len(last['simulations']) if last is not None else 0
+		return self.count
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self)
+		generation = self.collection.find_one({'experiment_id': self.experiment_id, 'first_id': {'$lte': index}}, sort=[('first_id', -1)])
+		if generation is None or index - generation['first_id'] >= len(generation['simulations']):
+			raise IndexError(index)
+		return self.decode(generation['simulations'][index - generation['first_id']])
+
+	def __iter__(self):
+		for generation in self.collection.find({'experiment_id': self.experiment_id}).sort('first_id', 1):
+			for simulation in generation['simulations']:
+				yield self.decode(simulation)
+
+def load_simulations(doc, db=None):
+	# StoredSimulations of a summary document, from the default database
+	if db is None:
+		db = get_database()
+	collection_name = doc['results']['simulation_collection'][:-len('_simulations')]
+	return StoredSimulations(db, doc['results']['simulation_collection'], doc['_id'], collection_name + '_arrays')
@@ -0,0 +1,161 @@
+import numpy as np
+
+# Multi-objective optimization for Experiment. All objectives are minimized,
+# like the fitness values told to CMA-ES.
+
+def dominates(a, b):
+	return all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+def non_dominated_sort(F):
+	# Fronts as lists of indices into F, the first front is non-dominated
+	n = len(F)
+	dominated_by = [[] for _ in range(n)]
+	num_dominating = [0] * n
+	for i in range(n):
+		for j in range(i + 1, n):
+			if dominates(F[i], F[j]):
+				dominated_by[i].append(j)
+				num_dominating[j] += 1
+			elif dominates(F[j], F[i]):
+				dominated_by[j].append(i)
+				num_dominating[i] += 1
+
+	fronts = [[i for i in range(n) if num_dominating[i] == 0]]
+	while fronts[-1]:
+		next_front = []
+		for i in fronts[-1]:
+			for j in dominated_by[i]:
+				num_dominating[j] -= 1
+				if num_dominating[j] == 0:
+					next_front.append(j)
+		fronts.append(next_front)
+	return fronts[:-1]
+
+def crowding_distance(F):
+	# Larger for points in sparse parts of a front, infinite at its ends
+	F = np.array(F, dtype=float)
+	n = len(F)
+	distance = np.zeros(n)
+	if n < 3:
+		return distance + np.inf
+	for m in range(F.shape[1]):
+		order = np.argsort(F[:, m])
+		distance[order[0]] = distance[order[-1]] = np.inf
+		span = F[order[-1], m] - F[order[0], m]
+		if span > 0:
+			distance[order[1:-1]] += (F[order[2:], m] - F[order[:-2], m]) / span
+	return distance
+
+class NSGA2:
+	# NSGA-II with simulated binary crossover and polynomial mutation on the
+	# normalized parameters in [0, 1]. It implements the part of the
+	# cma.CMAEvolutionStrategy interface that Experiment uses (ask, tell,
+	# stop, result, popsize and opts), so runs, restarts, checkpoints and
+	# sweeps work the same for both. The first population is sampled around
+	# x0 with standard deviation sigma.
+	def __init__(self, x0, sigma, opts, crossover_eta=15, mutation_eta=20, crossover_probability=0.9):
+		self.x0 = np.array(x0, dtype=float)
+		self.sigma = sigma
+		self.popsize = opts['popsize']
+		self.maxiter = opts.get('maxiter', 100)
+		self.opts = {'seed': opts.get('seed', np.random.randint(2**31 - 1))}
+		self.opts.update(popsize=self.popsize, maxiter=self.maxiter)
+		self.random = np.random.RandomState(self.opts['seed'])
+
+		self.crossover_eta = crossover_eta
+		self.mutation_eta = mutation_eta
+		self.crossover_probability = crossover_probability
+		self.mutation_probability = 1.0 / len(self.x0)
+
+		self.countiter = 0
+		self.X = []
+		self.F = []
+		self.rank = []
+		self.crowding = []
+
+	def ask(self):
+		if len(self.X) == 0:
+			X = self.x0 + self.sigma * self.random.randn(self.popsize, len(self.x0))
+			return list(np.clip(X, 0, 1))
+
+		offspring = []
+		while len(offspring) < self.popsize:
+			child_a, child_b = self.crossover(self.X[self.tournament()], self.X[self.tournament()])
+			offspring.extend([self.mutate(child_a), self.mutate(child_b)])
+		return offspring[:self.popsize]
+
+	def tell(self, solutions, objectives):
+		# Keep the best popsize of parents and offspring, by front and then by
+		# crowding distance
+		X = np.array(solutions, dtype=float)
+		F = np.array(objectives, dtype=float)
+		if len(self.X):
+			X = np.vstack([self.X, X])
+			F = np.vstack([self.F, F])
+
+		selected, rank, crowding = [], [], []
+		for front_rank, front in enumerate(non_dominated_sort(F)):
+			distance = crowding_distance(F[front])
+			order = np.argsort(-distance)[:self.popsize - len(selected)]
+			selected.extend(front[i] for i in order)
+			rank.extend([front_rank] * len(order))
+			crowding.extend(distance[order])
+			if len(selected) >= self.popsize:
+				break
+
+		self.X, self.F = X[selected], F[selected]
+		self.rank, self.crowding = np.array(rank), np.array(crowding)
+		self.countiter += 1
+
+	def tournament(self):
+		# Binary tournament on front rank, then crowding distance
+		a, b = self.random.randint(len(self.X), size=2)
+		if self.rank[a] != self.rank[b]:
+			return a if self.rank[a] < self.rank[b] else b
+		return a if self.crowding[a] >= self.crowding[b] else b
+
+	def crossover(self, a, b):
+		a, b = a.copy(), b.copy()
+		if self.random.rand() > self.crossover_probability:
+			return (a, b)
+		u = self.random.rand(len(a))
+		beta = np.where(u <= 0.5, (2 * u)**(1 / (self.crossover_eta + 1)), (1 / (2 * (1 - u)))**(1 / (self.crossover_eta + 1)))
+		swap = self.random.rand(len(a)) < 0.5
+		child_a = 0.5 * ((1 + beta) * a + (1 - beta) * b)
+		child_b = 0.5 * ((1 - beta) * a + (1 + beta) * b)
+		return (np.clip(np.where(swap, child_b, child_a), 0, 1), np.clip(np.where(swap, child_a, child_b), 0, 1))
+
+	def mutate(self, x):
+		u = self.random.rand(len(x))
+		delta = np.where(u < 0.5, (2 * u)**(1 / (self.mutation_eta + 1)) - 1, 1 - (2 * (1 - u))**(1 / (self.mutation_eta + 1)))
+		mutate = self.random.rand(len(x)) < self.mutation_probability
+		return np.clip(x + mutate * delta, 0, 1)
+
+	def stop(self):
+		return {'maxiter': self.maxiter} if self.countiter >= self.maxiter else {}
+
+	def result(self):
+		# Non-dominated solutions of the current population and their objectives
+		if len(self.F) == 0:
+			return ([], [])
+		front = non_dominated_sort(self.F)[0]
+		return (self.X[front], self.F[front])
+
+class ParetoArchive:
+	# Non-dominated candidates over a whole experiment, all runs included.
+	# Stores the objectives and the index of the candidate in the simulations.
+	def __init__(self):
+		self.objectives = []
+		self.ids = []
+
+	def add(self, objectives, simulation_id):
+		if any(dominates(other, objectives) or list(other) == list(objectives) for other in self.objectives):
+			return False
+		keep = [i for i, other in enumerate(self.objectives) if not dominates(objectives, other)]
+		self.objectives = [self.objectives[i] for i in keep] + [list(objectives)]
+		self.ids = [self.ids[i] for i in keep] + [simulation_id]
+		return True
+
+	def front(self):
+		# (simulation id, objectives) sorted on the first objective
+		return sorted(zip(self.ids, self.objectives), key=lambda item: item[1])
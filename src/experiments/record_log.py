@@ -0,0 +1,130 @@
+import os
+import pickle
+import struct
+
+# Append-only log of pickled records, used by Experiment to write simulations
+# to disk as they are recorded instead of keeping them all in memory.
+#
+# The file starts with MAGIC, followed by one entry per record: the length of
+# the pickled record as an unsigned 64 bit little endian integer, then the
+# pickle itself. A record that was cut off by a crash is ignored by the reader
+# and overwritten by the next writer.
+
+MAGIC = b'RECLOG01'
+HEADER = struct.Struct('<Q')
+
+class RecordWriter:
+	def __init__(self, path, truncate=None):
+		# Appends to an existing log. truncate drops everything after that
+		# offset first, e.g. the records written after the last checkpoint.
+		self.path = path
+		exists = os.path.exists(path) and os.path.getsize(path) >= len(MAGIC)
+		self.file = open(path, 'r+b' if exists else 'wb')
+		if not exists:
+			self.file.write(MAGIC)
+			self.count = 0
+		else:
+			if self.file.read(len(MAGIC)) != MAGIC:
+				raise ValueError(path + ' is not a record log')
+			offsets, end = scan(self.file, truncate)
+			self.count = len(offsets)
+			self.file.seek(end)
+			self.file.truncate()
+
+	def write(self, record):
+		data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+		self.file.write(HEADER.pack(len(data)))
+		self.file.write(data)
+		self.count += 1
+		return self.count - 1
+
+	def flush(self):
+		self.file.flush()
+
+	def sync(self):
+		# Flush to disk, not only to the operating system
+		self.file.flush()
+		os.fsync(self.file.fileno())
+
+	def tell(self):
+		return self.file.tell()
+
+	def close(self):
+		if not self.file.closed:
+			self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def __getstate__(self):
+		# Checkpoints store the position, the file is opened again on resume
+		self.flush()
+		return {'path': self.path, 'offset': self.tell()}
+
+	def __setstate__(self, state):
+		self.__init__(state['path'], truncate=state['offset'])
+
+
+def scan(f, end=None):
+	# Offsets of the complete records in the first end bytes of a log, and the
+	# offset after the last one
+	size = os.fstat(f.fileno()).st_size if end is None else end
+	offsets = []
+	offset = len(MAGIC)
+	while offset + HEADER.size <= size:
+		f.seek(offset)
+		length, = HEADER.unpack(f.read(HEADER.size))
+		if offset + HEADER.size + length > size:
+			break
+		offsets.append(offset)
+		offset += HEADER.size + length
+	return (offsets, offset)
+
+class RecordReader:
+	# Random access to the records of a log without loading them all. Only
+	# the offsets are read when it is opened, records are unpickled on access.
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, 'rb')
+		if self.file.read(len(MAGIC)) != MAGIC:
+			raise ValueError(path + ' is not a record log')
+
+		self.offsets, _ = scan(self.file)
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [self[i] for i in range(*index.indices(len(self)))]
+		self.file.seek(self.offsets[index])
+		length, = HEADER.unpack(self.file.read(HEADER.size))
+		return pickle.loads(self.file.read(length))
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def close(self):
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+def get_simulations(doc):
+	# The simulations of an experiment document, from MongoDB for a summary
+	# document (see mongo_store.py) or from its simulation log when they were
+	# streamed to disk. All of them can be indexed with best_id.
+	if doc['results'].get('simulation_collection'):
+		from mongo_store import load_simulations
+		return load_simulations(doc)
+	if doc['results'].get('simulation_log'):
+		return RecordReader(doc['results']['simulation_log'])
+	return doc['results']['simulations']
@@ -0,0 +1,135 @@
+import numpy as np
+
+# Surrogate models of the reward as a function of the normalized CMA-ES
+# parameters, used by Experiment to skip the rollouts of candidates that are
+# unlikely to be among the best of their generation.
+
+def squared_distances(A, B):
+	return np.maximum(np.sum(A**2, 1)[:, None] + np.sum(B**2, 1)[None, :] - 2 * A.dot(B.T), 0)
+
+def rank_correlation(a, b):
+	# Spearman correlation, ties are broken arbitrarily
+	ranks_a = np.argsort(np.argsort(a))
+	ranks_b = np.argsort(np.argsort(b))
+	if np.std(ranks_a) == 0 or np.std(ranks_b) == 0:
+		return 0.0
+	return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+class GaussianProcess:
+	# RBF kernel, the length scale is the median distance between the samples
+	def __init__(self, noise=1e-2):
+		self.noise = noise
+
+	def fit(self, X, y):
+		self.X = X
+		self.y_mean = np.mean(y)
+		self.y_std = np.std(y) if np.std(y) > 0 else 1.0
+
+		d = squared_distances(X, X)
+		self.length_scale = np.sqrt(np.median(d[d > 0])) if np.any(d > 0) else 1.0
+
+		K = np.exp(-d / (2 * self.length_scale**2)) + self.noise * np.eye(len(X))
+		self.L = np.linalg.cholesky(K)
+		self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, (y - self.y_mean) / self.y_std))
+
+	def predict(self, X):
+		k = np.exp(-squared_distances(X, self.X) / (2 * self.length_scale**2))
+		mean = k.dot(self.alpha) * self.y_std + self.y_mean
+		v = np.linalg.solve(self.L, k.T)
+		std = np.sqrt(np.maximum(1 - np.sum(v**2, 0), 0)) * self.y_std
+		return (mean, std)
+
+class QuadraticModel:
+	# Full quadratic fitted with a small ridge penalty on the samples nearest
+	# to the queried candidates, twice as many samples as coefficients
+	def __init__(self, ridge=1e-6):
+		self.ridge = ridge
+
+	def features(self, X):
+		columns = [np.ones(len(X))] + [X[:, i] for i in range(X.shape[1])]
+		columns += [X[:, i] * X[:, j] for i in range(X.shape[1]) for j in range(i, X.shape[1])]
+		return np.array(columns).T
+
+	def fit(self, X, y):
+		self.X = X
+		self.y = y
+
+	def predict(self, X):
+		num_features = self.features(X[:1]).shape[1]
+		nearest = np.argsort(squared_distances(np.mean(X, 0)[None, :], self.X)[0])[:2 * num_features]
+
+		F = self.features(self.X[nearest])
+		coefficients = np.linalg.solve(F.T.dot(F) + self.ridge * np.eye(num_features), F.T.dot(self.y[nearest]))
+		return (self.features(X).dot(coefficients), np.zeros(len(X)))
+
+MODELS = {'gp': GaussianProcess, 'quadratic': QuadraticModel}
+
+class Surrogate:
+	# Pre-screening of a population. Once the model is trusted, only the
+	# evaluate_fraction most promising candidates (highest predicted reward
+	# plus exploration times the predicted standard deviation) are simulated
+	# and the others are told to CMA-ES with their predicted reward.
+	#
+	# Every check_interval generations, and until the model is trusted, the
+	# whole population is simulated and the rank correlation between the
+	# predicted and true rewards is measured. The model is trusted while that
+	# correlation is at least min_correlation.
+	def __init__(self, model='gp', evaluate_fraction=0.5, check_interval=5, min_correlation=0.5, min_samples=None, max_samples=500, exploration=1.0):
+		self.model_type = model
+		self.evaluate_fraction = evaluate_fraction
+		self.check_interval = check_interval
+		self.min_correlation = min_correlation
+		self.min_samples = min_samples
+		self.max_samples = max_samples
+		self.exploration = exploration
+
+		self.X = []
+		self.y = []
+		self.generation = 0
+		self.trusted = False
+		self.correlations = []
+
+	def get_min_samples(self, dimension):
+		if self.min_samples is not None:
+			return self.min_samples
+		if self.model_type == 'quadratic':
+			return (dimension + 1) * (dimension + 2)
+		return 2 * (dimension + 1)
+
+	def predict(self, solutions):
+		X = np.array(solutions)
+		if len(self.X) < self.get_min_samples(X.shape[1]):
+			return None
+
+		# Most recent samples only, they are closest to the current search distribution
+		model = MODELS[self.model_type]()
+		model.fit(np.array(self.X[-self.max_samples:]), np.array(self.y[-self.max_samples:]))
+		return model.predict(X)
+
+	def screen(self, solutions):
+		# Returns which candidates to simulate and the predicted rewards of all
+		# candidates, None before there are enough samples for the model
+		prediction = self.predict(solutions)
+		if prediction is None:
+			return ([True] * len(solutions), None)
+
+		mean, std = prediction
+		mean = np.maximum(mean, 0) # rewards are never negative
+		if not self.trusted or self.generation % self.check_interval == 0:
+			return ([True] * len(solutions), mean)
+
+		num = int(np.ceil(self.evaluate_fraction * len(solutions)))
+		promising = set(np.argsort(-(mean + self.exploration * std))[:num])
+		return ([i in promising for i in range(len(solutions))], mean)
+
+	def update(self, solutions, rewards, predictions):
+		# Add the simulated candidates of a generation, predictions are the
+		# predicted rewards of the same candidates
+		if predictions is not None and len(solutions) == len(predictions) and len(solutions) > 2 and (not self.trusted or self.generation % self.check_interval == 0):
+			correlation = rank_correlation(predictions, rewards)
+			self.correlations.append(correlation)
+			self.trusted = correlation >= self.min_correlation
+
+		self.X.extend(np.array(solution) for solution in solutions)
+		self.y.extend(rewards)
+		self.generation += 1
@@ -0,0 +1,149 @@
+import itertools
+import queue
+import time
+from Experiment import Experiment, split_rollouts, rollout_wrapper, submit_async
+from worker_pool import get_shared_pool
+
+def grid(base_kwargs, repeats=1, **axes):
+	# Experiment kwargs for every combination of the values in axes, e.g.
+	# grid(kwargs, repeats=5, E_ref=[5, 10, 15]) gives 15 experiments
+	names = list(axes.keys())
+	experiments = []
+	for _ in range(repeats):
+		for values in itertools.product(*[axes[name] for name in names]):
+			experiments.append(dict(base_kwargs, **dict(zip(names, values))))
+	return experiments
+
+class SweepRun:
+	# Optimization state of one experiment in a sweep
+	def __init__(self, index, experiment):
+		self.index = index
+		self.experiment = experiment
+		self.step = None
+		self.results = None
+		# Rollouts in flight, see submit_rollouts
+		self.candidates = None
+		self.round_results = None
+		self.remaining = 0
+
+def tagged_rollout(task):
+	# rollout_wrapper with the index of the experiment the rollout belongs to.
+	# Exceptions are returned with the index, so a failing experiment does not
+	# stop the others.
+	index, rollout = task
+	try:
+		return (index, rollout_wrapper(rollout))
+	except Exception as e:
+		return (index, e)
+
+def run_sweep(experiment_kwargs, max_concurrent=None, worker_pool=None, logging=False):
+	# Run many experiments at the same time on one worker pool. Every running
+	# experiment has a step (one generation of each of its active CMA-ES runs)
+	# in flight, so the workers are kept busy while an experiment waits for
+	# its slowest rollout or updates CMA-ES. Each experiment saves its own
+	# results (and checkpoints) as it finishes.
+	#
+	# experiment_kwargs is a list of Experiment keyword arguments, see grid().
+	# At most max_concurrent experiments run at once, all of them by default.
+	# Experiments always run generation by generation here (with racing if
+	# configured), async_mode and batch_threads are not used. Returns the
+	# finished Experiment objects, an experiment that raised is reported and
+	# left out.
+	if worker_pool is None:
+		worker_pool = get_shared_pool()
+	mp_pool = worker_pool.get()
+
+	waiting = list(enumerate(experiment_kwargs))
+	running = {}
+	finished = []
+	done = queue.Queue()
+
+	def submit_rollouts(run, candidates, variables_list):
+		# Rollouts of the given candidates, racing rounds add more to a step
+		tasks = split_rollouts(variables_list)
+		run.candidates = candidates
+		run.round_results = [[None] * len(variables['model_files']) for variables in variables_list]
+		run.remaining = len(tasks)
+		for index, task in tasks:
+			submit_async(mp_pool, tagged_rollout, (run.index, (index, task)), done.put)
+
+	def submit_step(run):
+		run.step = run.experiment.ask_step(logging)
+		run.results = [[] for _ in run.step['variables']]
+		submit_rollouts(run, list(range(len(run.results))), run.step['variables'])
+
+	def start_next():
+		# Start the next waiting experiment that can be started. One that
+		# raises while it is set up or asks its first step is reported and
+		# left out, like an experiment with a failing rollout.
+		while waiting:
+			index, kwargs = waiting.pop(0)
+			experiment = None
+			try:
+				experiment = Experiment(**dict(kwargs, worker_pool=worker_pool))
+				experiment.setup_model_variations()
+				experiment.start_optimization()
+				run = SweepRun(index, experiment)
+				submit_step(run)
+			except Exception as e:
+				print('Experiment {} failed: {!r}'.format(index, e))
+				if experiment is not None:
+					experiment.remove_base_model_file()
+				continue
+
+			running[index] = run
+			return
+
+	start_time = time.time()
+	while waiting and (max_concurrent is None or len(running) < max_concurrent):
+		start_next()
+
+	while running:
+		item = done.get()
+		if isinstance(item, BaseException):
+			raise item
+
+		index, item = item
+		run = running.get(index)
+		if run is None:
+			# Late rollout of an experiment that failed
+			continue
+
+		try:
+			if isinstance(item, BaseException):
+				raise item
+
+			(i, variation), r = item
+			run.round_results[i][variation] = r
+			run.remaining -= 1
+			if run.remaining > 0:
+				continue
+
+			for candidate, result in zip(run.candidates, run.round_results):
+				run.results[candidate].extend(result)
+
+			candidates, variables_list = run.experiment.race_step(run.step, run.results)
+			if candidates:
+				submit_rollouts(run, candidates, variables_list)
+				continue
+
+			# Runs that stopped are restarted here according to the experiment's restart settings
+			if run.experiment.tell_step(run.step, run.results):
+				submit_step(run)
+				continue
+
+			run.experiment.finish_optimization()
+			finished.append(run.experiment)
+		except Exception as e:
+			print('Experiment {} failed: {!r}'.format(index, e))
+			run.experiment.remove_base_model_file()
+
+		del running[index]
+		print('{}/{} experiments finished, {} running'.format(len(finished), len(experiment_kwargs), len(running)))
+		start_next()
+
+	total_time = time.time() - start_time
+	total_rollouts = sum(experiment.total_rollouts for experiment in finished)
+	print('Sweep: {} rollouts in {:.1f} s: {:.2f} rollouts per second'.format(total_rollouts, total_time, total_rollouts / total_time))
+
+	return finished
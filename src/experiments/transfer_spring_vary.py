@@ -3,6 +3,8 @@ import numpy as np
 from pymongo import MongoClient
 import feedback_cpg as sim
 from model_variations import generate_temp_model_file, generate_model_variations
+from record_log import get_simulations
+from experiment_store import print_best
 import multiprocessing
 
 
@@ -122,10 +124,11 @@ NUM_OPTIMIZATION_STEPS = 300
 POPSIZE = 80
 NUM_VARIATIONS = 10
 COLLECTION_NAME = 'spring_noise_inertia'
+# Start from the bound gait found without noise instead of initial, with the
+# step size and covariance of its ES when this is a pickled CMAEvolutionStrategy
+WARM_START = None # e.g. 'final_cpgs/baseline.pickle'
 
-def perform_experiment(E_ref, spring_std_dev):
-	from Experiment import Experiment
-
+def experiment_kwargs(E_ref, spring_std_dev):
 	variation_params = {
 		'legs': {
 			'FL': {
@@ -148,18 +151,31 @@ def perform_experiment(E_ref, spring_std_dev):
 
 	initial = [35, 30, -25, -25, 1, 0.4, 0.4, 0]
 
-	e = Experiment(model_config, False, initial, lb, ub, 0.5, NUM_OPTIMIZATION_STEPS, E_ref=E_ref, variation_params=variation_params, num_variations=NUM_VARIATIONS, collection_name=COLLECTION_NAME,  perturbation_params=None, remarks='Result bound gait: E_ref = ' + str(E_ref) + ' Std dev = ' + str(spring_std_dev), popsize=POPSIZE)
-	e.run()
+	return {
+		'default_morphology': model_config,
+		'closed_loop': False,
+		'initial_values': initial,
+		'lower_bounds': lb,
+		'upper_bounds': ub,
+		'variances': 0.5,
+		'max_iters': NUM_OPTIMIZATION_STEPS,
+		'E_ref': E_ref,
+		'variation_params': variation_params,
+		'num_variations': NUM_VARIATIONS,
+		'collection_name': COLLECTION_NAME,
+		'perturbation_params': None,
+		'remarks': 'Result bound gait: E_ref = ' + str(E_ref) + ' Std dev = ' + str(spring_std_dev),
+		'popsize': POPSIZE,
+		'warm_start': WARM_START,
+	}
 
 def run():
+	from sweep import run_sweep
+
 	e_refs = [15]
 	spring_std_devs_percent = [2, 4, 6, 8, 10, 12, 14, 16, 18, 20]
 
-	for _ in range(1):
-		for e_ref in e_refs:
-			for std_dev_percent in spring_std_devs_percent:
-				print(std_dev_percent)
-				perform_experiment(e_ref, std_dev_percent*211/100)
+	run_sweep([experiment_kwargs(e_ref, std_dev_percent*211/100) for e_ref in e_refs for std_dev_percent in spring_std_devs_percent])
 
 def get_experiments():
 	client = MongoClient('localhost', 27017)
@@ -186,7 +202,7 @@ def view_results():
 		if E0 is None:
 			E0 = doc.get('E_ref')
 		best_simulation_id = doc['results']['best_id']
-		best_simulation = doc['results']['simulations'][best_simulation_id]
+		best_simulation = get_simulations(doc)[best_simulation_id]
 		best_simulation['E_ref'] = E0
 		best_simulations.append(best_simulation)
 
@@ -202,6 +218,8 @@ if __name__ == '__main__':
 		run()
 	elif sys.argv[1] == 'results':
 		view_results()
+	elif sys.argv[1] == 'summary':
+		print_best(COLLECTION_NAME)
 
 	
 
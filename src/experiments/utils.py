@@ -17,4 +17,19 @@ def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1,
     print('\r%s |%s| %s%% %s' % (prefix, bar, percent, suffix), end = '\r')
     # Print New Line on Complete
     if iteration == total: 
-        print()
\ No newline at end of file
+        print()
+
+def to_bson_compatible(obj):
+    """
+    Recursively convert NumPy arrays and scalars (e.g. logged histories) to lists and Python numbers
+    """
+    import numpy as np
+    if isinstance(obj, dict):
+        return {key: to_bson_compatible(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [to_bson_compatible(value) for value in obj]
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    return obj
@@ -3,6 +3,7 @@ import numpy as np
 from pymongo import MongoClient
 import feedback_cpg as sim
 from model_variations import generate_temp_model_file, generate_model_variations
+from record_log import get_simulations
 import multiprocessing
 
 
@@ -122,29 +123,53 @@ NUM_OPTIMIZATION_STEPS = 200
 E_0 = 30
 NUM_VARIATIONS = 1
 COLLECTION_NAME = 'vary_energy_ref_inertia'
+PARETO_COLLECTION_NAME = 'vary_energy_ref_inertia_pareto'
+E_REFS = [5, 10, 15, 20, 25, 30, 35, 40]
 
-def perform_experiment(E_ref):
-	from Experiment import Experiment
-
+def experiment_kwargs(E_ref):
 	lb = [10, 10, 20, 20, -30, -30, 0.5, 0.1, 0.1, 0, 0, 0]
 	ub = [40, 40, 40, 40, 0, 15, 4, 0.9, 0.9, 2*np.pi, 2*np.pi, 2*np.pi]
 
 	initial = [35, 35, 30, 30, -5, 5, 1, 0.4, 0.4, 0, 0, 0]
 
-	e = Experiment(model_config, False, initial, lb, ub, 0.3, NUM_OPTIMIZATION_STEPS, E_ref=E_ref, variation_params=None, num_variations=NUM_VARIATIONS, collection_name=COLLECTION_NAME,  perturbation_params=None, remarks='E_ref = ' + str(E_ref))
-	e.run()
+	return {
+		'default_morphology': model_config,
+		'closed_loop': False,
+		'initial_values': initial,
+		'lower_bounds': lb,
+		'upper_bounds': ub,
+		'variances': 0.3,
+		'max_iters': NUM_OPTIMIZATION_STEPS,
+		'E_ref': E_ref,
+		'variation_params': None,
+		'num_variations': NUM_VARIATIONS,
+		'collection_name': COLLECTION_NAME,
+		'perturbation_params': None,
+		'remarks': 'E_ref = ' + str(E_ref),
+	}
 
 def run():
-	e_refs = [5, 10, 15, 20, 25, 30, 35, 40]
+	from sweep import run_sweep
+
+	run_sweep([experiment_kwargs(e_ref) for e_ref in E_REFS for _ in range(5)])
 
-	for e_ref in e_refs:
-		for _ in range(5):
-			perform_experiment(e_ref)
+def run_pareto():
+	# One multi-objective run instead of the E_ref sweep, the best gait for
+	# every E_ref is picked from its Pareto front in view_pareto_results
+	from sweep import run_sweep
 
-def get_experiments():
+	kwargs = experiment_kwargs(E_0)
+	kwargs.update({
+		'collection_name': PARETO_COLLECTION_NAME,
+		'multi_objective': {'objectives': ['distance', 'energy']},
+		'remarks': 'Pareto front of distance and energy',
+	})
+	run_sweep([kwargs])
+
+def get_experiments(collection_name=COLLECTION_NAME):
 	client = MongoClient('localhost', 27017)
 	db = client['thesis']
-	experiments_collection = db[COLLECTION_NAME]
+	experiments_collection = db[collection_name]
 
 	return experiments_collection.find()
 
@@ -166,13 +191,28 @@ def view_results():
 		if E0 is None:
 			E0 = doc.get('E_ref')
 		best_simulation_id = doc['results']['best_id']
-		best_simulation = doc['results']['simulations'][best_simulation_id]
+		best_simulation = get_simulations(doc)[best_simulation_id]
 		best_simulation['E_ref'] = E0
 		best_simulations.append(best_simulation)
 	import pickle
 	with open(COLLECTION_NAME + '.pickle', 'wb') as f:
 		pickle.dump(best_simulations, f)
 
+def view_pareto_results():
+	# Same output as view_results, with the candidate of the Pareto front
+	# that has the highest d * tanh(E_ref/ec) for every E_ref
+	best_simulations = []
+	for doc in get_experiments(PARETO_COLLECTION_NAME):
+		simulations = get_simulations(doc)
+		front = [simulations[i] for i in doc['results']['pareto_front']]
+		for E_ref in E_REFS:
+			best_simulation = dict(max(front, key=lambda s: np.mean(s['distance']) * np.tanh(E_ref / np.mean(s['energy']))))
+			best_simulation['E_ref'] = E_ref
+			best_simulations.append(best_simulation)
+	import pickle
+	with open(PARETO_COLLECTION_NAME + '.pickle', 'wb') as f:
+		pickle.dump(best_simulations, f)
+
 if __name__ == '__main__':
 	if len(sys.argv) < 2:
 		print('Please specify run or results')
@@ -181,6 +221,10 @@ if __name__ == '__main__':
 		run()
 	elif sys.argv[1] == 'results':
 		view_results()
+	elif sys.argv[1] == 'train_pareto':
+		run_pareto()
+	elif sys.argv[1] == 'results_pareto':
+		view_pareto_results()
 
 	
 
@@ -3,6 +3,7 @@ import numpy as np
 from pymongo import MongoClient
 import feedback_cpg as sim
 from model_variations import generate_temp_model_file, generate_model_variations
+from record_log import get_simulations
 import multiprocessing
 
 
@@ -124,23 +125,35 @@ NUM_VARIATIONS = 1
 POPSIZE = 100
 COLLECTION_NAME = 'vary_energy_ref_inertia_large_pop'
 
-def perform_experiment(E_ref):
-	from Experiment import Experiment
-
+def experiment_kwargs(E_ref):
 	lb = [10, 10, 20, 20, -30, -30, 0.5, 0.1, 0.1, 0, 0, 0]
 	ub = [40, 40, 40, 40, 0, 15, 4, 0.9, 0.9, 2*np.pi, 2*np.pi, 2*np.pi]
 
 	initial = [35, 35, 30, 30, -5, 5, 1, 0.4, 0.4, 0, 0, 0]
 
-	e = Experiment(model_config, False, initial, lb, ub, 0.5, NUM_OPTIMIZATION_STEPS, E_ref=E_ref, variation_params=None, num_variations=NUM_VARIATIONS, collection_name=COLLECTION_NAME,  perturbation_params=None, remarks='E_ref = ' + str(E_ref), popsize=POPSIZE)
-	e.run()
+	return {
+		'default_morphology': model_config,
+		'closed_loop': False,
+		'initial_values': initial,
+		'lower_bounds': lb,
+		'upper_bounds': ub,
+		'variances': 0.5,
+		'max_iters': NUM_OPTIMIZATION_STEPS,
+		'E_ref': E_ref,
+		'variation_params': None,
+		'num_variations': NUM_VARIATIONS,
+		'collection_name': COLLECTION_NAME,
+		'perturbation_params': None,
+		'remarks': 'E_ref = ' + str(E_ref),
+		'popsize': POPSIZE,
+	}
 
 def run():
+	from sweep import run_sweep
+
 	e_refs = [15]
 
-	for e_ref in e_refs:
-		for _ in range(5):
-			perform_experiment(e_ref)
+	run_sweep([experiment_kwargs(e_ref) for e_ref in e_refs for _ in range(5)])
 
 def get_experiments():
 	client = MongoClient('localhost', 27017)
@@ -167,7 +180,7 @@ def view_results():
 		if E0 is None:
 			E0 = doc.get('E_ref')
 		best_simulation_id = doc['results']['best_id']
-		best_simulation = doc['results']['simulations'][best_simulation_id]
+		best_simulation = get_simulations(doc)[best_simulation_id]
 		best_simulation['E_ref'] = E0
 		best_simulations.append(best_simulation)
 	import pickle
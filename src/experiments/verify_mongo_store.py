@@ -0,0 +1,74 @@
+import sys
+import bson
+import numpy as np
+from mongo_store import get_database, save_experiment, load_simulations, BINARY_LIMIT, DOCUMENT_LIMIT
+
+# Round trip of an experiment with generations far above the 16 MB document
+# limit through mongo_store, on the local MongoDB used by Experiment. The
+# experiment is written to a scratch collection, which is dropped afterwards.
+#
+#   python verify_mongo_store.py [COLLECTION]
+
+NUM_ITERS = 2
+POPSIZE = 8
+ROLLOUTS = 3
+HISTORY_SHAPE = (16000, 8) # just below BINARY_LIMIT as .npy, so it is kept in the document
+
+def make_simulations(rng):
+	simulations = []
+	for i in range(NUM_ITERS):
+		for c in range(POPSIZE):
+			# The last candidate of a generation has many small histories, more
+			# than fit in one document
+			rollouts = 4 * DOCUMENT_LIMIT // (HISTORY_SHAPE[0] * HISTORY_SHAPE[1] * 8) if c == POPSIZE - 1 else ROLLOUTS
+			simulations.append({
+				'iter': i,
+				'run': 0,
+				'reward': float(rng.rand()),
+				'cpg_params': list(rng.rand(12)),
+				'distance': list(rng.rand(rollouts)),
+				'energy': list(rng.rand(rollouts)),
+				'simulated_time': [30.0] * rollouts,
+				'action_history': [rng.rand(*HISTORY_SHAPE) for _ in range(rollouts)],
+				'sensor_history': [[] for _ in range(rollouts)],
+			})
+	return simulations
+
+def check(simulations, stored):
+	assert len(stored) == len(simulations), (len(stored), len(simulations))
+	for simulation_id, (simulation, loaded) in enumerate(zip(simulations, stored)):
+		assert loaded['reward'] == simulation['reward'], simulation_id
+		assert loaded['iter'] == simulation['iter'], simulation_id
+		assert len(loaded['action_history']) == len(simulation['action_history']), simulation_id
+		for a, b in zip(loaded['action_history'], simulation['action_history']):
+			assert a.dtype == b.dtype and np.array_equal(a, b), simulation_id
+		assert loaded['sensor_history'] == simulation['sensor_history'], simulation_id
+
+	# Random access, as used for best_id
+	for simulation_id in [0, POPSIZE - 1, POPSIZE, len(simulations) - 1, -1]:
+		assert stored[simulation_id]['reward'] == simulations[simulation_id]['reward'], simulation_id
+
+
+if __name__ == '__main__':
+	collection_name = sys.argv[1] if len(sys.argv) > 1 else 'verify_mongo_store'
+	db = get_database()
+	names = [collection_name, collection_name + '_simulations', collection_name + '_arrays.files', collection_name + '_arrays.chunks']
+
+	simulations = make_simulations(np.random.RandomState(0))
+	assert HISTORY_SHAPE[0] * HISTORY_SHAPE[1] * 8 < BINARY_LIMIT
+	document = {'remarks': ('verify_mongo_store',), 'results': {'best_id': 0, 'simulations': simulations}}
+
+	try:
+		experiment_id, _ = save_experiment(db, collection_name, document, simulations)
+		doc = db[collection_name].find_one({'_id': experiment_id})
+		check(simulations, load_simulations(doc, db))
+
+		generation_documents = db[collection_name + '_simulations'].find({'experiment_id': experiment_id})
+		sizes = [len(bson.encode(generation)) for generation in generation_documents]
+		print('{} simulations in {} generation documents of at most {:.1f} MB, {} GridFS files'.format(
+			len(simulations), len(sizes), max(sizes) / 2**20, db[collection_name + '_arrays.files'].count_documents({})))
+		assert max(sizes) <= 16 * 2**20
+		print('Round trip OK')
+	finally:
+		for name in names:
+			db.drop_collection(name)
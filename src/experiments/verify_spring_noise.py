@@ -72,7 +72,7 @@ def verify_experiment(ex, params=None):
 		test_id = 0
 		for path in variation_paths:
 			printProgressBar(test_id, 100, prefix = 'Progress:', suffix = 'Complete', length = 50)
-			succes, st, d, ec, ah, sh = sim.evaluate(path, False, params, [], False, False)
+			succes, st, d, ec, ah, sh, _ = sim.evaluate(path, False, params, [], False, False)
 			if succes and d > 0:
 				successful.append((d/10, ec/10))
 			else:
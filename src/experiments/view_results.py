@@ -18,6 +18,7 @@ import pymongo
 
 from operator import itemgetter
 from model_variations import generate_temp_model_file, dict_elementwise_operator, generate_model_variations
+from record_log import get_simulations
 
 progname = os.path.basename(sys.argv[0])
 progversion = "0.1"
@@ -84,9 +85,9 @@ class SimulationView(QtWidgets.QVBoxLayout):
         self.model_file = None
 
 
-    def set_simulation(self, experiment, simulation_id):
+    def set_simulation(self, experiment, simulation_id, simulations):
         self.experiment = experiment
-        self.simulation = experiment['results']['simulations'][simulation_id]
+        self.simulation = simulations[simulation_id]
         self.simulation_id = simulation_id
         self.closed_loop = True if self.experiment['type'] == 'closed' else False
 
@@ -244,7 +245,7 @@ class SimulationView(QtWidgets.QVBoxLayout):
         return evaluate(self.model_file, self.closed_loop, cpg_params, perturbations, render, logging)
 
     def analyze_simulation(self):
-        succes, simulated_time, distance, energy_consumed, action_history, sensor_history = self.run_simulation(render=False, logging=True)
+        succes, simulated_time, distance, energy_consumed, action_history, sensor_history, termination = self.run_simulation(render=False, logging=True)
 
         self.simulation['action_history'] = action_history
         self.simulation['sensor_history'] = sensor_history
@@ -302,7 +303,7 @@ class ExperimentView(QtWidgets.QHBoxLayout):
         evaluate(model_file, self.closed_loop, params, perturbations, render, logging)
 
     def show_best(self):
-        params = self.experiment['results']['simulations'][self.experiment['results']['best_id']]['cpg_params']
+        params = self.simulations[self.experiment['results']['best_id']]['cpg_params']
         self.show_run(params)
 
 
@@ -310,7 +311,7 @@ class ExperimentView(QtWidgets.QHBoxLayout):
         variation_best = [(0,0)] * len(self.experiment['delta_dicts'])
 
         counter = 0
-        for simulation in self.experiment['results']['simulations']:
+        for simulation in self.simulations:
             variation_index = simulation['variation_index']
             reward = simulation['reward']
 
@@ -339,7 +340,7 @@ class ExperimentView(QtWidgets.QHBoxLayout):
                 test_perturbations.append(perturbations)
 
             # Test in simulation
-            cpg_params = self.experiment['results']['simulations'][self.experiment['results']['best_id']]['cpg_params']
+            cpg_params = self.simulations[self.experiment['results']['best_id']]['cpg_params']
             model_file=None
             if not self.experiment['default_morphology']:
                 model_file = '/Users/Siebe/Dropbox/Thesis/Scratches/model.xml'
@@ -351,7 +352,7 @@ class ExperimentView(QtWidgets.QHBoxLayout):
             
             rewards = []
             for perturbation in test_perturbations:
-                succes, simulated_time, distance, energy_consumed, action_history, sensor_history = evaluate(model_file, self.closed_loop, cpg_params, perturbation, False, False)
+                succes, simulated_time, distance, energy_consumed, action_history, sensor_history, termination = evaluate(model_file, self.closed_loop, cpg_params, perturbation, False, False)
                 reward = 0 if distance < 0 or not succes else (10-0.01*(energy_consumed-self.experiment['E0'])**2)*(distance)
                 rewards.append(reward)
 
@@ -362,6 +363,12 @@ class ExperimentView(QtWidgets.QHBoxLayout):
 
     def update_experiment(self, experiment):
         self.experiment = experiment
+        # Saved experiments keep their simulations in a separate collection
+        # or record log, see record_log.get_simulations
+        simulations = get_simulations(experiment)
+        self.simulations = list(simulations)
+        if hasattr(simulations, 'close'):
+            simulations.close()
         self.closed_loop = True if self.experiment['type'] == 'closed' else False
 
         self.simulation_list_widget.clear()
@@ -373,13 +380,13 @@ class ExperimentView(QtWidgets.QHBoxLayout):
         self.best_score_label.setText(str(experiment['remarks']))
 
         try:
-            num_variations = len(experiment['results']['simulations'][0]['distance'])
+            num_variations = len(self.simulations[0]['distance'])
         except:
             num_variations = 1
 
         self.num_variations_label.setText('Num variations: ' + str(num_variations))
 
-        simulation_list = experiment['results']['simulations']
+        simulation_list = self.simulations
 
         # sort this list in descending order according to reward
         self.simulation_list = sorted(enumerate(simulation_list), key=lambda x: x[1]['reward'], reverse=True)
@@ -411,7 +418,7 @@ class ExperimentView(QtWidgets.QHBoxLayout):
         simulation_id = item.data(QtCore.Qt.UserRole)
 
         self.simulation_panel = SimulationView()
-        self.simulation_panel.set_simulation(self.experiment, simulation_id)
+        self.simulation_panel.set_simulation(self.experiment, simulation_id, self.simulations)
         simulation_panel_widget = QtWidgets.QWidget()
         simulation_panel_widget.setLayout(self.simulation_panel)
         self.right_panel.addWidget(simulation_panel_widget)
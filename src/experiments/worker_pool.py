@@ -0,0 +1,113 @@
+import atexit
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Imported by every worker process when it starts, so the first rollout a
+# worker receives does not pay for loading the simulator and its helpers
+PRELOAD_MODULES = ['numpy', 'feedback_cpg', 'generate_model', 'model_variations', 'Experiment']
+
+def preload_modules(modules):
+	for name in modules:
+		importlib.import_module(name)
+
+def default_num_workers():
+	return os.cpu_count() or 1
+
+class WorkerPool:
+	# Rollout workers that outlive a single Experiment. Sweeps that run many
+	# experiments back to back (and CMA-ES restarts) reuse the same workers
+	# instead of spawning and importing a fresh pool every time.
+	#
+	# worker_type 'broker' hands the rollouts to worker daemons on other
+	# machines instead, see executors.py. num_workers local workers are
+	# started next to them and broker_options (e.g. address and authkey) are
+	# passed to Broker.
+	def __init__(self, num_workers=None, worker_type='process', preload=PRELOAD_MODULES, broker_options=None):
+		self.local_workers = num_workers if num_workers is not None else default_num_workers()
+		self.worker_type = worker_type
+		self.preload = list(preload)
+		self.broker_options = broker_options if broker_options is not None else {}
+		self.pool = None
+
+	@property
+	def num_workers(self):
+		# Workers that run rollouts, for a broker the workers connected to it
+		# (at least the local ones, which may still be connecting)
+		if self.worker_type == 'broker' and self.pool is not None:
+			return max(self.pool.workers, self.local_workers, 1)
+		return self.local_workers
+
+	def get(self):
+		# The workers are started on first use
+		if self.pool is None:
+			if self.worker_type == 'thread':
+				# Threads share the modules of this process
+				self.pool = ThreadPoolExecutor(self.local_workers)
+			elif self.worker_type == 'broker':
+				from executors import Broker
+				self.pool = Broker(local_workers=self.local_workers, **self.broker_options)
+			else:
+				self.pool = multiprocessing.Pool(self.local_workers, initializer=preload_modules, initargs=(self.preload,))
+		return self.pool
+
+	def matches(self, num_workers, worker_type, broker_options=None):
+		return ((num_workers if num_workers is not None else default_num_workers()) == self.local_workers
+			and worker_type == self.worker_type
+			and (broker_options if broker_options is not None else {}) == self.broker_options)
+
+	def close(self):
+		# Wait for submitted rollouts and stop the workers
+		if self.pool is None:
+			return
+		if self.worker_type == 'thread':
+			self.pool.shutdown()
+		else:
+			self.pool.close()
+			self.pool.join()
+		self.pool = None
+
+	def terminate(self):
+		# Stop the workers without waiting for submitted rollouts
+		if self.pool is None:
+			return
+		if self.worker_type == 'thread':
+			self.pool.shutdown(wait=False)
+		else:
+			self.pool.terminate()
+			self.pool.join()
+		self.pool = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.close()
+		else:
+			self.terminate()
+
+
+_shared_pool = None
+
+def get_shared_pool(num_workers=None, worker_type='process', broker_options=None):
+	# Pool used by every Experiment that is not given one explicitly. It is
+	# only replaced when an experiment asks for a different size, type or
+	# broker options.
+	global _shared_pool
+	if _shared_pool is not None and not _shared_pool.matches(num_workers, worker_type, broker_options):
+		_shared_pool.close()
+		_shared_pool = None
+
+	if _shared_pool is None:
+		_shared_pool = WorkerPool(num_workers, worker_type, broker_options=broker_options)
+	return _shared_pool
+
+def close_shared_pool():
+	global _shared_pool
+	if _shared_pool is not None:
+		_shared_pool.close()
+		_shared_pool = None
+
+atexit.register(close_shared_pool)
@@ -4,6 +4,7 @@
 class Control
 {
 public:
+	virtual ~Control() {}
 	virtual void getAction(double* actions, double* forces, double time) = 0;
 };
 
@@ -18,19 +18,21 @@ using namespace std;
 
 CpgFeedbackControl::CpgFeedbackControl(vector<double> p_mu, vector<double> p_o, vector<double> p_omega, vector<double> p_d, vector<double> phase_offsets)
 {
-    mu = p_mu;
-    o = p_o;
-    omega = p_omega;
-    d = p_d;
-    coupling = {{0,5,5,5}, {5,0,5,5}, {5,5,0,5}, {5,5,5,0}};
-    // coupling = {{0,0,0,0},{0,0,0,0},{0,0,0,0},{0,0,0,0}};
-
-    r = vector<double>(4,1);
-    phi = {PI*p_d[0], PI*p_d[1], PI*p_d[2], PI*p_d[3]};
-    theta = vector<double>(4,0);
-    kappa_r = vector<double>(4,1);
-    kappa_phi = vector<double>(4,1);
-    kappa_o = vector<double>(4,1);
+    mu = Vector4d(p_mu.data());
+    o = Vector4d(p_o.data());
+    omega = Vector4d(p_omega.data());
+    d = Vector4d(p_d.data());
+
+    Matrix4d coupling;
+    coupling << 0,5,5,5,  5,0,5,5,  5,5,0,5,  5,5,5,0;
+    // coupling.setZero();
+
+    r = Vector4d::Ones();
+    phi = PI * d;
+    theta = Vector4d::Zero();
+    kappa_r = Vector4d::Ones();
+    kappa_phi = Vector4d::Ones();
+    kappa_o = Vector4d::Ones();
 
     closed_loop = false;
 
@@ -41,7 +43,10 @@ CpgFeedbackControl::CpgFeedbackControl(vector<double> p_mu, vector<double> p_o,
     double e = a-c;
     double f = b-c;
 
-    psi = {{0, a, b, c}, {-1*a, 0, d, e}, {-1*b, -1*d, 0, f}, {-1*c, -1*e, -1*f, 0}};
+    Matrix4d psi;
+    psi << 0, a, b, c,  -1*a, 0, d, e,  -1*b, -1*d, 0, f,  -1*c, -1*e, -1*f, 0;
+
+    set_coupling(coupling, psi);
 
     // for (int i = 0; i < CPG_INIT; i++)
     //     step_open_loop();
@@ -49,19 +54,21 @@ CpgFeedbackControl::CpgFeedbackControl(vector<double> p_mu, vector<double> p_o,
 
 CpgFeedbackControl::CpgFeedbackControl(vector<double> p_mu, vector<double> p_o, vector<double> p_omega, vector<double> p_d, vector<double> phase_offsets, vector<double> p_kappa_r, vector<double> p_kappa_phi, vector<double> p_kappa_o, const double* p_weights)
 {
-    mu = p_mu;
-    o = p_o;
-    omega = p_omega;
-    d = p_d;
-    coupling = {{0,1,1,1}, {1,0,1,1}, {1,1,0,1}, {1,1,1,0}};
+    mu = Vector4d(p_mu.data());
+    o = Vector4d(p_o.data());
+    omega = Vector4d(p_omega.data());
+    d = Vector4d(p_d.data());
+
+    Matrix4d coupling;
+    coupling << 0,1,1,1,  1,0,1,1,  1,1,0,1,  1,1,1,0;
 
-    r = vector<double>(4,1);
-    phi = vector<double>(4,1);
-    theta = vector<double>(4,0);
+    r = Vector4d::Ones();
+    phi = Vector4d::Ones();
+    theta = Vector4d::Zero();
 
-    kappa_r = p_kappa_r;
-    kappa_phi = p_kappa_phi;
-    kappa_o = p_kappa_o;
+    kappa_r = Vector4d(p_kappa_r.data());
+    kappa_phi = Vector4d(p_kappa_phi.data());
+    kappa_o = Vector4d(p_kappa_o.data());
 
     closed_loop = true;
     double a = phase_offsets[0];
@@ -71,7 +78,10 @@ CpgFeedbackControl::CpgFeedbackControl(vector<double> p_mu, vector<double> p_o,
     double e = phase_offsets[4];
     double f = phase_offsets[5];
 
-    psi = {{0, a, b, c}, {-1*a, 0, d, e}, {-1*b, -1*d, 0, f}, {-1*c, -1*e, -1*f, 0}};
+    Matrix4d psi;
+    psi << 0, a, b, c,  -1*a, 0, d, e,  -1*b, -1*d, 0, f,  -1*c, -1*e, -1*f, 0;
+
+    set_coupling(coupling, psi);
 
     n = Network(4, 12);
     n.finalize();
@@ -84,54 +94,136 @@ CpgFeedbackControl::~CpgFeedbackControl()
 
 }
 
-vector<double> CpgFeedbackControl::step_closed_loop(double* forces)
+void CpgFeedbackControl::set_coupling(const Matrix4d& coupling, const Matrix4d& psi)
 {
-    Map<VectorXd> network_inputs(forces, 4);
+    coupling_cos_psi = coupling.cwiseProduct(psi.array().cos().matrix());
+    coupling_sin_psi = coupling.cwiseProduct(psi.array().sin().matrix());
 
-    VectorXd cpg_parameters = n.calculate_output(network_inputs);
-
-    vector<double> Fr;
-    vector<double> Fphi;
-    vector<double> Fo;
+    sin_phi = phi.array().sin();
+    cos_phi = phi.array().cos();
+}
 
-    for (int i = 0; i < 4; i++)
-    {
-        Fr.push_back(cpg_parameters[i]);
-        Fphi.push_back(cpg_parameters[4 + i]);
-        Fo.push_back(cpg_parameters[8 + i]);
-    }
+void CpgFeedbackControl::setIntegrator(const IntegratorOptions& options)
+{
+    integrator = options.integrator;
+    dt = options.dt;
+    tolerance = options.tolerance;
+    step_size = options.dt;
+}
 
-    return step_cpg(Fr, Fphi, Fo);
+CpgState CpgFeedbackControl::get_state()
+{
+    CpgState y;
+    y << r, phi, o;
+    return y;
 }
 
-vector<double> CpgFeedbackControl::step_open_loop()
+void CpgFeedbackControl::set_state(const CpgState& y)
 {
-    vector<double> Fr(4,0);
-    vector<double> Fphi(4,0);
-    vector<double> Fo(4,0);
+    r = y.col(0);
+    phi = y.col(1);
+    o = y.col(2);
 
-    return step_cpg(Fr, Fphi, Fo);
+    sin_phi = phi.array().sin();
+    cos_phi = phi.array().cos();
 }
 
-vector<double> CpgFeedbackControl::step_cpg(vector<double>& Fr, vector<double>& Fphi, vector<double>& Fo)
+// Time derivative of the CPG state with all oscillators evaluated at the same state
+CpgState CpgFeedbackControl::derivative(const CpgState& y, const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo)
+{
+    Vector4d y_r = y.col(0);
+    Vector4d s = y.col(1).array().sin();
+    Vector4d c = y.col(1).array().cos();
+
+    CpgState dy;
+    dy.col(0) = gamma * (mu + kappa_r.cwiseProduct(Fr) - y_r.cwiseProduct(y_r)).cwiseProduct(y_r);
+    dy.col(1) = omega + kappa_phi.cwiseProduct(Fphi)
+              + c.cwiseProduct(coupling_cos_psi * s - coupling_sin_psi * c)
+              - s.cwiseProduct(coupling_cos_psi * c + coupling_sin_psi * s);
+    dy.col(2) = kappa_o.cwiseProduct(Fo);
+    return dy;
+}
+
+void CpgFeedbackControl::step_euler(const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo)
 {
-    vector<double> actions;
     for (int i = 0; i < 4; i++)
     {
         double d_r = gamma * (mu[i] + kappa_r[i] * Fr[i] - r[i] * r[i]) * r[i];
         double d_phi = omega[i] + kappa_phi[i] * Fphi[i];
         double d_o = kappa_o[i] * Fo[i];
 
-        // Add phase coupling
-        for (int j = 0; j < 4; j++)
-        {
-            d_phi += coupling[i][j] * sin(phi[j] - phi[i] - psi[i][j]);
-        }
+        // Add phase coupling: sum_j coupling_ij * sin(phi_j - phi_i - psi_ij),
+        // expanded with the angle difference identities
+        d_phi += cos_phi[i] * (coupling_cos_psi.row(i).dot(sin_phi) - coupling_sin_psi.row(i).dot(cos_phi))
+               - sin_phi[i] * (coupling_cos_psi.row(i).dot(cos_phi) + coupling_sin_psi.row(i).dot(sin_phi));
 
         r[i] += dt * d_r;
         phi[i] += dt * d_phi;
         o[i] += dt * d_o;
 
+        // The next oscillators are coupled to the updated phase
+        sin_phi[i] = sin(phi[i]);
+        cos_phi[i] = cos(phi[i]);
+    }
+}
+
+void CpgFeedbackControl::step_rk4(const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo, double h)
+{
+    CpgState y = get_state();
+
+    CpgState k1 = derivative(y, Fr, Fphi, Fo);
+    CpgState k2 = derivative(y + h / 2 * k1, Fr, Fphi, Fo);
+    CpgState k3 = derivative(y + h / 2 * k2, Fr, Fphi, Fo);
+    CpgState k4 = derivative(y + h * k3, Fr, Fphi, Fo);
+
+    set_state(y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4));
+}
+
+// Integrate over the interval with Dormand-Prince 5(4) steps, the step size
+// is adapted to keep the local error estimate below the tolerance
+void CpgFeedbackControl::integrate_rk45(const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo, double interval)
+{
+    CpgState y = get_state();
+    double t = 0;
+
+    while (t < interval)
+    {
+        double h = min(step_size, interval - t);
+
+        CpgState k1 = derivative(y, Fr, Fphi, Fo);
+        CpgState k2 = derivative(y + h * (1.0/5*k1), Fr, Fphi, Fo);
+        CpgState k3 = derivative(y + h * (3.0/40*k1 + 9.0/40*k2), Fr, Fphi, Fo);
+        CpgState k4 = derivative(y + h * (44.0/45*k1 - 56.0/15*k2 + 32.0/9*k3), Fr, Fphi, Fo);
+        CpgState k5 = derivative(y + h * (19372.0/6561*k1 - 25360.0/2187*k2 + 64448.0/6561*k3 - 212.0/729*k4), Fr, Fphi, Fo);
+        CpgState k6 = derivative(y + h * (9017.0/3168*k1 - 355.0/33*k2 + 46732.0/5247*k3 + 49.0/176*k4 - 5103.0/18656*k5), Fr, Fphi, Fo);
+        CpgState y_next = y + h * (35.0/384*k1 + 500.0/1113*k3 + 125.0/192*k4 - 2187.0/6784*k5 + 11.0/84*k6);
+        CpgState k7 = derivative(y_next, Fr, Fphi, Fo);
+
+        // Difference between the fifth and fourth order solutions
+        CpgState error_estimate = h * (71.0/57600*k1 - 71.0/16695*k3 + 71.0/1920*k4 - 17253.0/339200*k5 + 22.0/525*k6 - 1.0/40*k7);
+        CpgState scale = tolerance * (1 + y.array().abs().max(y_next.array().abs()));
+        double error = (error_estimate.array().abs() / scale.array()).maxCoeff();
+
+        bool accepted = error <= 1;
+        if (accepted)
+        {
+            y = y_next;
+            t += h;
+        }
+
+        // Do not grow the step size from a step that was shortened to end on the interval
+        double factor = error > 0 ? min(5.0, max(0.2, 0.9 * pow(error, -0.2))) : 5.0;
+        if (!accepted || h == step_size || factor < 1)
+            step_size = max(h * factor, 1e-9);
+    }
+
+    set_state(y);
+}
+
+void CpgFeedbackControl::update_output()
+{
+    for (int i = 0; i < 4; i++)
+    {
         double two_pi = 2 * 3.141592654;
 
         double phi_L = 0;
@@ -141,30 +233,59 @@ vector<double> CpgFeedbackControl::step_cpg(vector<double>& Fr, vector<double>&
         else
             phi_L = (phi_2pi + two_pi * (1 - 2 * d[i])) / (2 * (1 - d[i]));
 
-        double action = r[i] * cos(phi_L) + o[i];
-        actions.push_back(action);
+        theta[i] = r[i] * cos(phi_L) + o[i];
     }
-
-    return actions;
-    
 }
 
 void CpgFeedbackControl::getAction(double* actions, double* forces, double time)
 {
+    // Euler takes whole steps of dt up to the current time, as it always has.
+    // The Runge-Kutta integrators integrate exactly up to the current time, so
+    // a dt close to the control period neither skips nor doubles steps.
     int num_steps = (int) (time / dt) - prev_time;
+    double interval = time - cpg_time;
     // printf("time: %f \t Num steps: %d\n", time, num_steps);
-    vector<double> new_actions;
 
-    for (int i=0; i<num_steps; i++)
+    // The feedback is constant during a control step, so the network only has to be evaluated once
+    Vector4d Fr = Vector4d::Zero();
+    Vector4d Fphi = Vector4d::Zero();
+    Vector4d Fo = Vector4d::Zero();
+
+    if (closed_loop && (integrator == EULER ? num_steps > 0 : interval > 0))
     {
-        if (closed_loop)
-            new_actions = step_closed_loop(forces);
-        else
-            new_actions = step_open_loop();
+        const VectorXd& cpg_parameters = n.calculate_output(Map<Vector4d>(forces));
+        Fr = cpg_parameters.segment<4>(0);
+        Fphi = cpg_parameters.segment<4>(4);
+        Fo = cpg_parameters.segment<4>(8);
+    }
+
+    switch (integrator)
+    {
+    case EULER:
+        for (int i=0; i<num_steps; i++)
+            step_euler(Fr, Fphi, Fo);
+        break;
+    case RK4:
+        if (interval > 0)
+        {
+            // Equal steps of at most dt
+            int n_steps = (int) ceil(interval / dt - 1e-6);
+            double h = interval / max(n_steps, 1);
+            for (int i=0; i<max(n_steps, 1); i++)
+                step_rk4(Fr, Fphi, Fo, h);
+        }
+        break;
+    case RK45:
+        if (interval > 0)
+            integrate_rk45(Fr, Fphi, Fo, interval);
+        break;
     }
 
     prev_time = (int) (time/dt);
+    cpg_time = max(cpg_time, time);
+
+    update_output();
 
     for (int i = 0; i < 4; i++)
-    	actions[i] = new_actions[i];
+    	actions[i] = theta[i];
 }
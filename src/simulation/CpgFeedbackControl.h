@@ -3,48 +3,84 @@
 
 #include "Control.h"
 #include <vector>
+#include <Eigen/Dense>
 #include "Network.h"
 
 using namespace std;
+using namespace Eigen;
+
+enum Integrator
+{
+	EULER,		// Forward Euler, oscillators updated in order
+	RK4,		// Classic fourth order Runge-Kutta
+	RK45		// Adaptive Dormand-Prince 5(4)
+};
+
+struct IntegratorOptions
+{
+	Integrator integrator = EULER;
+	double dt = 0.001;			// Step size, initial step size for RK45
+	double tolerance = 1e-6;	// Error tolerance for RK45
+};
+
+// CPG state, columns: radius r, phase phi and offset o
+typedef Matrix<double, 4, 3> CpgState;
 
 class CpgFeedbackControl : public Control
 {
 public:
+	EIGEN_MAKE_ALIGNED_OPERATOR_NEW
+
 	CpgFeedbackControl(vector<double> p_mu, vector<double> p_o, vector<double> p_omega, vector<double> p_d, vector<double> phase_offsets);
 	CpgFeedbackControl(vector<double> p_mu, vector<double> p_o, vector<double> p_omega, vector<double> p_d, vector<double> phase_offsets, vector<double> kappa_r, vector<double> kappa_phi, vector<double> kappa_o, const double* weights);
 	~CpgFeedbackControl();
 
+	void setIntegrator(const IntegratorOptions& options);
 	void getAction(double* actions, double* forces, double time);
 private:
-	vector<double> step_closed_loop(double* forces);
-	vector<double> step_open_loop();
-	vector<double> step_cpg(vector<double>& Fr, vector<double>& Fphi, vector<double>& Fo);
+	void step_euler(const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo);
+	void step_rk4(const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo, double h);
+	void integrate_rk45(const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo, double interval);
+	CpgState derivative(const CpgState& y, const Vector4d& Fr, const Vector4d& Fphi, const Vector4d& Fo);
+	CpgState get_state();
+	void set_state(const CpgState& y);
+	void update_output();
+	void set_coupling(const Matrix4d& coupling, const Matrix4d& psi);
 
 	bool closed_loop;
 	double prev_time = -1;
+	double cpg_time = 0;		// Time the CPG state has been integrated to by the Runge-Kutta integrators
 	double dt = 0.001;
 
+	Integrator integrator = EULER;
+	double tolerance = 1e-6;
+	double step_size = 0.001;	// Last accepted step size of the adaptive integrator
+
 	Network n;
 
 	// CPG parameters
 	double gamma = 0.1;			// Speed of convergence
-	vector<double> mu; 			// Vector of amplitudes
-	vector<double> omega;		// Vector of target frequencies
-	vector<double> d;			// Vector of duty factor (stance duration / swing duration)
-	vector<vector<double>> coupling;	// Coupling weights for phase differences
-	vector<double> o;			// Vector of CPG offsets
-
-	vector<vector<double>> psi; // 2D vector of phase differences between i and j
-	
+	Vector4d mu; 				// Vector of amplitudes
+	Vector4d omega;				// Vector of target frequencies
+	Vector4d d;					// Vector of duty factor (stance duration / swing duration)
+	Vector4d o;					// Vector of CPG offsets
+
+	// Coupling weights multiplied with the cosine and sine of the phase differences psi,
+	// precomputed so the coupling term only needs the sine and cosine of each phase
+	Matrix4d coupling_cos_psi;
+	Matrix4d coupling_sin_psi;
+
 	// Variables CPG
-	vector<double> r;			// Vector of CPG radius
-	vector<double> phi;			// Vector of CPG frequency
-	vector<double> theta;		// Vector of CPG output
+	Vector4d r;					// Vector of CPG radius
+	Vector4d phi;				// Vector of CPG phase
+	Vector4d sin_phi;			// sin(phi), kept up to date with phi
+	Vector4d cos_phi;			// cos(phi), kept up to date with phi
+	Vector4d theta;				// Vector of CPG output
 
 	// Feedback weights
-	vector<double> kappa_r;		// Vector of feedback weights on radius
-	vector<double> kappa_phi;	// Vector of feedback weights on frequency
-	vector<double> kappa_o;		// Vector of feedback weights on offset
+	Vector4d kappa_r;			// Vector of feedback weights on radius
+	Vector4d kappa_phi;			// Vector of feedback weights on frequency
+	Vector4d kappa_o;			// Vector of feedback weights on offset
 };
 
-#endif
\ No newline at end of file
+#endif
@@ -1,18 +1,21 @@
 #include "Experiment.h"
+#include "PlaybackControl.h"
 
 #include "stdlib.h"
 #include <math.h>
 #include <vector>
+#include <algorithm>
 
 #define MAX_SIMULATION_TIME 10000.0
 
 using namespace std;
 
-Experiment::Experiment(Control *control, bool closed_loop, const char* modelpath, vector<pair<double, vector<double>>> p_perturbations, const int skip_frames, bool render)
+Experiment::Experiment(Control *control, bool closed_loop, const char* modelpath, vector<pair<double, vector<double>>> p_perturbations, const SimulationOptions& options, bool render, const ModelDeltas& model_deltas)
 {
 	mControl = control;
     mClosedLoop = closed_loop;
-	mEnv = new QuadrupedEnv(modelpath, skip_frames, render);
+    duration = options.duration;
+	mEnv = new QuadrupedEnv(modelpath, options, render, model_deltas);
     perturbations = p_perturbations;
 }
 
@@ -21,7 +24,53 @@ Experiment::~Experiment()
 	delete(mEnv);
 }
 
-bool Experiment::start(double* time_simulated, double* distance, double* energy_consumed, vector<vector<double>>* action_history, vector<vector<double>>* sensor_history)
+// Record the actions the open-loop control would produce during start(), to
+// replay them with a PlaybackControl on every variation of the model
+void Experiment::recordOpenLoop(HistoryRecorder* trajectory)
+{
+    recordOpenLoopTrajectory(mControl, mEnv->getTimestep(), mEnv->getSkipFrames(), duration, trajectory);
+}
+
+void Experiment::setStopRules(const StopRules& rules)
+{
+    stopRules = rules;
+    sort(stopRules.min_progress.begin(), stopRules.min_progress.end());
+    nextCheckpoint = 0;
+}
+
+Termination Experiment::checkStopRules()
+{
+    if (!mEnv->isMeasuring())
+        return COMPLETED;
+
+    double time = mEnv->getTime();
+    double distance = mEnv->getDistance();
+    double energy = mEnv->getEnergyConsumed();
+
+    // Each progress checkpoint is checked once, when its time is reached
+    while (nextCheckpoint < stopRules.min_progress.size() && time >= stopRules.min_progress[nextCheckpoint].first)
+    {
+        if (distance < stopRules.min_progress[nextCheckpoint].second)
+            return MIN_PROGRESS;
+        nextCheckpoint++;
+    }
+
+    if (stopRules.max_energy >= 0 && energy > stopRules.max_energy)
+        return ENERGY_BUDGET;
+
+    // Energy only grows, so tanh(E_ref / energy) can only decrease from here
+    if (stopRules.min_reward > 0 && stopRules.max_speed > 0)
+    {
+        double max_distance = distance + stopRules.max_speed * max(0.0, duration - time);
+        double max_efficiency = energy > 0 ? tanh(stopRules.E_ref / energy) : 1;
+        if (max_distance * max_efficiency < stopRules.min_reward)
+            return REWARD_BOUND;
+    }
+
+    return COMPLETED;
+}
+
+bool Experiment::start(double* time_simulated, double* distance, double* energy_consumed, HistoryRecorder* action_history, HistoryRecorder* sensor_history)
 {
 	// main loop
 	double actions[4] = {0};
@@ -39,6 +88,13 @@ bool Experiment::start(double* time_simulated, double* distance, double* energy_
     if (perturb_begin != perturb_end)
         next_perturb_time = perturb_begin->first;
 
+    // Allocate the histories for the full episode up front
+    int num_control_steps = (int) ceil(duration / mEnv->getControlTimestep()) + 1;
+    if (action_history)
+        action_history->reserve(num_control_steps);
+    if (sensor_history)
+        sensor_history->reserve(num_control_steps);
+
     while( mEnv->getTime() < duration)
     {
         if (mClosedLoop)
@@ -51,16 +107,12 @@ bool Experiment::start(double* time_simulated, double* distance, double* energy_
 
         // Logging
         if (action_history) 
-        {
-            for (int i = 0; i < 4; i++)
-                (*action_history)[i].push_back(actions[i]);
-        }
+            action_history->record(actions);
 
         if (sensor_history) 
         {
             mEnv->getForces(forces);
-            for (int i = 0; i < 4; i++)
-                (*sensor_history)[i].push_back(forces[i]);
+            sensor_history->record(forces);
         }
 
         // Scale actions
@@ -86,8 +138,18 @@ bool Experiment::start(double* time_simulated, double* distance, double* energy_
             *time_simulated = mEnv->getTime();
             *distance = mEnv->getDistance();
             *energy_consumed = mEnv->getEnergyConsumed();
+            mTermination = mEnv->getTermination();
         	return false;
         }
+
+        mTermination = checkStopRules();
+        if (mTermination != COMPLETED)
+        {
+            *time_simulated = mEnv->getTime();
+            *distance = mEnv->getDistance();
+            *energy_consumed = mEnv->getEnergyConsumed();
+            return false;
+        }
     }
 
     *time_simulated = mEnv->getTime();
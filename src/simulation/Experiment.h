@@ -3,25 +3,55 @@
 
 #include "QuadrupedEnv.h"
 #include "Control.h"
+#include "History.h"
 #include <vector>
 
 using namespace std;
 
+// Rules that end a rollout as soon as it can no longer turn out well. They are
+// checked once distance is being measured, after the initialization phase.
+struct StopRules
+{
+	// (time, distance) checkpoints: stop when the distance walked at the
+	// checkpoint time is below the checkpoint distance
+	vector<pair<double, double>> min_progress;
+
+	// Stop once the consumed energy exceeds this budget, disabled when negative
+	double max_energy = -1;
+
+	// Stop when even walking at max_speed for the rest of the episode cannot
+	// reach the reward distance * tanh(E_ref / energy) of min_reward.
+	// Disabled while min_reward or max_speed is not positive.
+	double min_reward = -1;
+	double max_speed = -1;
+	double E_ref = 20;
+};
+
 class Experiment
 {
 public:
-	Experiment(Control *control, bool closed_loop, const char* filename, vector<pair<double, vector<double>>> p_perturbations, const int skip_frames, bool render);
+	Experiment(Control *control, bool closed_loop, const char* filename, vector<pair<double, vector<double>>> p_perturbations, const SimulationOptions& options, bool render, const ModelDeltas& model_deltas = ModelDeltas());
 	~Experiment();
 
-	bool start(double* time_simulated, double* distance, double* energy_consumed, vector<vector<double>>* action_history, vector<vector<double>>* sensor_history);
+	bool start(double* time_simulated, double* distance, double* energy_consumed, HistoryRecorder* action_history, HistoryRecorder* sensor_history);
+	void recordOpenLoop(HistoryRecorder* trajectory);
+
+	void setStopRules(const StopRules& rules);
+	Termination getTermination() {return mTermination;}
 private:
+	Termination checkStopRules();
+
 	bool mClosedLoop = false;
 	Control *mControl;
 	QuadrupedEnv *mEnv;
-	double duration = 15;
+	double duration;
 	double amplitude = 30;
 
 	vector<pair<double, vector<double>>> perturbations;
+
+	StopRules stopRules;
+	size_t nextCheckpoint = 0;
+	Termination mTermination = COMPLETED;
 };
 
 #endif
\ No newline at end of file
@@ -0,0 +1,73 @@
+#ifndef _HISTORY_H
+#define _HISTORY_H
+
+#include <algorithm>
+#include <vector>
+
+using namespace std;
+
+// Records one value per channel per control step
+class HistoryRecorder
+{
+public:
+	virtual ~HistoryRecorder() {}
+
+	virtual void reserve(int capacity) = 0;
+	virtual void record(const double* values) = 0;
+};
+
+// Channel-major history buffer. Every channel occupies a block of `capacity`
+// values, so after finalize() the data is one contiguous (channels, length)
+// array that can be handed to NumPy without copying.
+template <typename T>
+class History : public HistoryRecorder
+{
+public:
+	History(int p_channels) : channels(p_channels) {}
+
+	void reserve(int p_capacity)
+	{
+		if (p_capacity > capacity)
+			resize(p_capacity);
+	}
+
+	void record(const double* values)
+	{
+		if (length == capacity)
+			resize(max(2 * capacity, 64));
+
+		for (int i = 0; i < channels; i++)
+			data[i * capacity + length] = (T) values[i];
+		length++;
+	}
+
+	// Pack the channels back to back and release the unused capacity
+	T* finalize()
+	{
+		if (capacity != length)
+			resize(length);
+		return data.data();
+	}
+
+	const T* getData() {return data.data();}
+	int getChannels() {return channels;}
+	int getLength() {return length;}
+
+private:
+	void resize(int new_capacity)
+	{
+		vector<T> new_data(channels * new_capacity);
+		for (int i = 0; i < channels; i++)
+			copy(data.begin() + i * capacity, data.begin() + i * capacity + length, new_data.begin() + i * new_capacity);
+
+		data.swap(new_data);
+		capacity = new_capacity;
+	}
+
+	int channels;
+	int capacity = 0;
+	int length = 0;
+	vector<T> data;
+};
+
+#endif
@@ -0,0 +1,158 @@
+#include "ModelCache.h"
+
+#include "stdio.h"
+#include "string.h"
+#include <fstream>
+#include <iterator>
+
+// Guards activation and the XML parser/compiler, which are not reentrant.
+// Stepping separate mjModel/mjData pairs from several threads is safe.
+static mutex mujoco_mutex;
+static bool activated = false;
+
+mjModel* loadModel(const char* filename)
+{
+    lock_guard<mutex> lock(mujoco_mutex);
+
+    // activate
+    if (!activated)
+    {
+        activated = true;
+        mj_activate("/Users/Siebe/.mujoco/mjkey.txt");
+    }
+
+    // load and compile
+    mjModel* m;
+    char error[1000] = "Could not load binary model";
+    if( strlen(filename)>4 && !strcmp(filename+strlen(filename)-4, ".mjb") )
+        m = mj_loadModel(filename, 0, 0);
+    else
+        m = mj_loadXML(filename, 0, error, 1000);
+    if( !m )
+        mju_error_s("Load model error: %s", error);
+
+    return m;
+}
+
+// 64-bit FNV-1a hash of the file contents
+static string hashFile(const char* filename)
+{
+    ifstream file(filename, ios::binary);
+    uint64_t hash = 14695981039346656037ULL;
+
+    char buffer[4096];
+    while (file.read(buffer, sizeof(buffer)) || file.gcount() > 0)
+    {
+        for (streamsize i = 0; i < file.gcount(); i++)
+        {
+            hash ^= (unsigned char) buffer[i];
+            hash *= 1099511628211ULL;
+        }
+    }
+
+    char hex[17];
+    snprintf(hex, sizeof(hex), "%016llx", (unsigned long long) hash);
+    return string(hex);
+}
+
+ModelCache& ModelCache::instance()
+{
+    static ModelCache cache;
+    return cache;
+}
+
+shared_ptr<mjModel> ModelCache::get(const char* filename)
+{
+    string key = string(filename) + ":" + hashFile(filename);
+
+    {
+        lock_guard<mutex> lock(cache_mutex);
+        auto it = index.find(key);
+        if (it != index.end())
+        {
+            // Move to the front of the LRU list
+            entries.splice(entries.begin(), entries, it->second);
+            hits++;
+            return it->second->model;
+        }
+        misses++;
+    }
+
+    // Compile outside the cache lock so hits from other threads are not blocked
+    shared_ptr<mjModel> model(loadModel(filename), mj_deleteModel);
+    size_t model_bytes = mj_sizeModel(model.get());
+
+    lock_guard<mutex> lock(cache_mutex);
+
+    // Another thread may have compiled the same file in the meantime
+    auto it = index.find(key);
+    if (it != index.end())
+        return it->second->model;
+
+    if (model_bytes <= max_bytes)
+    {
+        entries.push_front(Entry{key, model, model_bytes});
+        index[key] = entries.begin();
+        bytes += model_bytes;
+        evict();
+    }
+
+    return model;
+}
+
+void ModelCache::evict()
+{
+    while (bytes > max_bytes && !entries.empty())
+    {
+        bytes -= entries.back().bytes;
+        index.erase(entries.back().key);
+        entries.pop_back();
+    }
+}
+
+void ModelCache::setMaxBytes(size_t p_max_bytes)
+{
+    lock_guard<mutex> lock(cache_mutex);
+    max_bytes = p_max_bytes;
+    evict();
+}
+
+void ModelCache::clear()
+{
+    lock_guard<mutex> lock(cache_mutex);
+    entries.clear();
+    index.clear();
+    bytes = 0;
+    hits = 0;
+    misses = 0;
+}
+
+long ModelCache::getHits()
+{
+    lock_guard<mutex> lock(cache_mutex);
+    return hits;
+}
+
+long ModelCache::getMisses()
+{
+    lock_guard<mutex> lock(cache_mutex);
+    return misses;
+}
+
+size_t ModelCache::getBytes()
+{
+    lock_guard<mutex> lock(cache_mutex);
+    return bytes;
+}
+
+size_t ModelCache::getMaxBytes()
+{
+    lock_guard<mutex> lock(cache_mutex);
+    return max_bytes;
+}
+
+size_t ModelCache::getSize()
+{
+    lock_guard<mutex> lock(cache_mutex);
+    return entries.size();
+}
@@ -0,0 +1,58 @@
+#ifndef _MODELCACHE_H
+#define _MODELCACHE_H
+
+#include "mujoco.h"
+#include <list>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <unordered_map>
+
+using namespace std;
+
+// Process-wide LRU cache of compiled models, keyed by file path and content hash.
+// Returned models are shared and must not be modified; an evicted model stays
+// alive until the last environment using it releases its reference.
+class ModelCache
+{
+public:
+	static ModelCache& instance();
+
+	shared_ptr<mjModel> get(const char* filename);
+
+	void setMaxBytes(size_t max_bytes);
+	void clear();
+
+	long getHits();
+	long getMisses();
+	size_t getBytes();
+	size_t getMaxBytes();
+	size_t getSize();
+
+private:
+	ModelCache() {}
+
+	struct Entry
+	{
+		string key;
+		shared_ptr<mjModel> model;
+		size_t bytes;
+	};
+
+	void evict();
+
+	list<Entry> entries;		// Most recently used entry first
+	unordered_map<string, list<Entry>::iterator> index;
+	mutex cache_mutex;
+
+	size_t max_bytes = 64 * 1024 * 1024;
+	size_t bytes = 0;
+	long hits = 0;
+	long misses = 0;
+};
+
+// Load and compile a model from an XML or binary (.mjb) file.
+// Activation and the XML compiler are not reentrant, so all loads are serialised.
+mjModel* loadModel(const char* filename);
+
+#endif
@@ -0,0 +1,112 @@
+#include "ModelVariation.h"
+
+#include "stdio.h"
+#include <sstream>
+
+static const char* LEG_NAMES[4] = {"FL", "FR", "BL", "BR"};
+static const char* LEG_PARAMS[5] = {"foot_friction", "spring_stiffness", "hip_damping", "knee_damping", "actuator_kp"};
+
+static vector<string> splitKey(const string& key)
+{
+    vector<string> parts;
+    stringstream ss(key);
+    string part;
+    while (getline(ss, part, '.'))
+        parts.push_back(part);
+    return parts;
+}
+
+// Returns the leg id used by the model generator (1: FL, 2: FR, 3: BL, 4: BR) or 0
+static int legId(const string& name)
+{
+    for (int i = 0; i < 4; i++)
+        if (name == LEG_NAMES[i])
+            return i + 1;
+    return 0;
+}
+
+// The torso segment masses (body.*.mass) are not supported: the segments are
+// geoms of the same body, their masses also set its center of mass and
+// principal axes, which cannot be recomputed from the compiled model.
+bool isSupportedModelDelta(const string& key)
+{
+    vector<string> parts = splitKey(key);
+
+    if (parts.size() == 1)
+        return parts[0] == "battery_weight";
+
+    if (parts.size() == 3 && parts[0] == "legs" && legId(parts[1]))
+    {
+        for (int i = 0; i < 5; i++)
+            if (parts[2] == LEG_PARAMS[i])
+                return true;
+    }
+
+    return false;
+}
+
+static int findId(const mjModel* m, int type, const string& name)
+{
+    int id = mj_name2id(m, type, name.c_str());
+    if (id < 0)
+        throw ModelVariationError("model variation cannot be applied, the model has no element named " + name);
+    return id;
+}
+
+static void addBodyMass(mjModel* m, int body_id, double delta)
+{
+    // Scale the inertia with the mass, only exact for a body with a single geom
+    double mass = m->body_mass[body_id];
+    double scale = (mass + delta) / mass;
+
+    m->body_mass[body_id] += delta;
+    for (int i = 0; i < 3; i++)
+        m->body_inertia[3*body_id + i] *= scale;
+}
+
+static void applyModelDelta(mjModel* m, const string& key, double delta)
+{
+    vector<string> parts = splitKey(key);
+
+    if (parts[0] == "battery_weight")
+    {
+        // Only models generated with a battery have this body, variations of
+        // models without one are generated as XML (see can_patch_variations)
+        addBodyMass(m, findId(m, mjOBJ_BODY, "battery_body"), delta);
+    }
+    else
+    {
+        string leg = to_string(legId(parts[1]));
+        const string& param = parts[2];
+
+        if (param == "foot_friction")
+        {
+            m->geom_friction[3*findId(m, mjOBJ_GEOM, "foot_" + leg)] += delta;
+        }
+        else if (param == "spring_stiffness")
+        {
+            m->tendon_stiffness[findId(m, mjOBJ_TENDON, "spring_" + leg)] += delta;
+        }
+        else if (param == "hip_damping")
+        {
+            m->dof_damping[m->jnt_dofadr[findId(m, mjOBJ_JOINT, "shoulder_" + leg)]] += delta;
+        }
+        else if (param == "knee_damping")
+        {
+            m->dof_damping[m->jnt_dofadr[findId(m, mjOBJ_JOINT, "knee_" + leg)]] += delta;
+        }
+        else if (param == "actuator_kp")
+        {
+            // Position servo: force = kp * ctrl - kp * qpos
+            int id = findId(m, mjOBJ_ACTUATOR, "act_" + leg);
+            m->actuator_gainprm[mjNGAIN*id] += delta;
+            m->actuator_biasprm[mjNBIAS*id + 1] -= delta;
+        }
+    }
+}
+
+void applyModelDeltas(mjModel* m, const ModelDeltas& deltas)
+{
+    for (auto& delta : deltas)
+        applyModelDelta(m, delta.first, delta.second);
+}
@@ -0,0 +1,28 @@
+#ifndef _MODELVARIATION_H
+#define _MODELVARIATION_H
+
+#include "mujoco.h"
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+using namespace std;
+
+// Morphology variations applied directly to a compiled model.
+// Keys follow the paths of the Python variation_params dictionaries, e.g.
+// "legs.FL.foot_friction" or "battery_weight", and values are added to the
+// value the model was compiled with.
+typedef vector<pair<string, double>> ModelDeltas;
+
+// Thrown when the model lacks an element that a variation applies to,
+// Boost.Python raises it as a ValueError
+class ModelVariationError : public invalid_argument
+{
+public:
+    explicit ModelVariationError(const string& message) : invalid_argument(message) {}
+};
+
+bool isSupportedModelDelta(const string& key);
+void applyModelDeltas(mjModel* m, const ModelDeltas& deltas);
+
+#endif
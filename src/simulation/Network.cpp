@@ -33,21 +33,19 @@ Network::finalize()
 	add_layer(m_outputs);
 }
 
-VectorXd
-Network::calculate_output(VectorXd inputs)
+// Evaluate the network into the preallocated layer values, no heap allocations
+const VectorXd&
+Network::calculate_output(const Ref<const VectorXd>& inputs)
 {
 	for (int i = 0; i < m_layers; i++)
 	{
-		VectorXd prev_layer;
 		if (i == 0)
-			prev_layer = inputs;
+			m_values[i].noalias() = m_weights[i].transpose() * inputs;
 		else
-			prev_layer = m_values[i - 1];
-
-		VectorXd cell_inputs = prev_layer.transpose() * m_weights[i];
+			m_values[i].noalias() = m_weights[i].transpose() * m_values[i - 1];
 
 		// Put this through tanh
-		m_values[i] = cell_inputs.unaryExpr([](double x) { return tanh(x); });
+		m_values[i] = m_values[i].array().tanh();
 	}
 
 	return m_values[m_layers - 1];
@@ -14,7 +14,7 @@ public:
 	Network(int inputs, int outputs);
 	void add_layer(int hidden);
 	void finalize();
-	VectorXd calculate_output(VectorXd inputs);
+	const VectorXd& calculate_output(const Ref<const VectorXd>& inputs);
 	int get_number_weights();
 	void set_weights(const double* weights);
 
@@ -0,0 +1,38 @@
+#include "PlaybackControl.h"
+
+#include <math.h>
+#include <algorithm>
+
+using namespace std;
+
+PlaybackControl::PlaybackControl(const double* trajectory, int length)
+{
+	mTrajectory = trajectory;
+	mLength = length;
+}
+
+void PlaybackControl::getAction(double* actions, double* forces, double time)
+{
+	int step = min(mStep, mLength - 1);
+	for (int i = 0; i < 4; i++)
+		actions[i] = mTrajectory[i * mLength + step];
+
+	mStep++;
+}
+
+void recordOpenLoopTrajectory(Control* control, double timestep, int skip_frames, double duration, HistoryRecorder* trajectory)
+{
+	double actions[4] = {0};
+	double time = 0;
+
+	trajectory->reserve((int) ceil(duration / (timestep * skip_frames)) + 1);
+
+	while (time < duration)
+	{
+		control->getAction(actions, 0, time);
+		trajectory->record(actions);
+
+		for (int i = 0; i < skip_frames; i++)
+			time = time + timestep;
+	}
+}
@@ -0,0 +1,28 @@
+#ifndef _PLAYBACKCONTROL_H
+#define _PLAYBACKCONTROL_H
+
+#include "Control.h"
+#include "History.h"
+
+// Replays a precomputed open-loop trajectory. The trajectory is a channel-major
+// (4, length) array with one column per control step, so the k-th call to
+// getAction returns column k. The last column is held if the rollout outlasts it.
+// The trajectory is not copied and must outlive the control.
+class PlaybackControl : public Control
+{
+public:
+	PlaybackControl(const double* trajectory, int length);
+
+	void getAction(double* actions, double* forces, double time);
+private:
+	const double* mTrajectory;
+	int mLength;
+	int mStep = 0;
+};
+
+// Record the open-loop actions of a control at the times an Experiment would
+// request them: the simulation time advances skip_frames times by timestep
+// between control steps, with the same floating point accumulation as MuJoCo.
+void recordOpenLoopTrajectory(Control* control, double timestep, int skip_frames, double duration, HistoryRecorder* trajectory);
+
+#endif
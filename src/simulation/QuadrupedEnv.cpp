@@ -1,4 +1,5 @@
 #include "QuadrupedEnv.h"
+#include "ModelCache.h"
 
 
 #include "stdio.h"
@@ -8,49 +9,55 @@
 
 #ifdef WITH_RENDER
 #include "glfw3.h"
+#include <atomic>
 #endif
 
 #define E0 100
-#define NUM_ROTATION_SAMPLES 10
-#define INITIALIZATION_DURATION 5 // Only start measuring distance and energy after 5 seconds
-
-QuadrupedEnv* env = 0;
-bool activated = false;
-
 
 #ifdef WITH_RENDER
+// GLFW callbacks are plain functions, so they are forwarded to the one
+// environment that owns the window. Other environments never render.
+std::atomic<QuadrupedEnv*> env(NULL);
+
 void mouse_button_g(GLFWwindow* window, int button, int act, int mods)
 {
-    if (env != NULL)
-	   env->mouse_button(window, button, act, mods);
+    QuadrupedEnv* e = env;
+    if (e != NULL)
+	   e->mouse_button(window, button, act, mods);
 }
 
 void mouse_move_g(GLFWwindow* window, double xpos, double ypos)
 {
-    if (env != NULL)
-	   env->mouse_move(window, xpos, ypos);
+    QuadrupedEnv* e = env;
+    if (e != NULL)
+	   e->mouse_move(window, xpos, ypos);
 }
 void scroll_g(GLFWwindow* window, double xoffset, double yoffset)
 {
-    if (env != NULL)
-	   env->scroll(window, xoffset, yoffset);
+    QuadrupedEnv* e = env;
+    if (e != NULL)
+	   e->scroll(window, xoffset, yoffset);
 }
 
 void keyboard_g(GLFWwindow* window, int key, int scancode, int act, int mods)
 {
-    if (env != NULL)
-        env->keyboard(window, key, scancode, act, mods);
+    QuadrupedEnv* e = env;
+    if (e != NULL)
+        e->keyboard(window, key, scancode, act, mods);
 }
 #endif
 
-QuadrupedEnv::QuadrupedEnv(const char* filename, const int skip_frames, bool render)
+QuadrupedEnv::QuadrupedEnv(const char* filename, const SimulationOptions& options, bool render, const ModelDeltas& deltas)
 {
 
 #ifdef WITH_RENDER
-	render_env = render;
+	QuadrupedEnv* no_env = NULL;
+	render_env = render && env.compare_exchange_strong(no_env, this);
+	if (render && !render_env)
+		printf("Another environment is already rendering, running without rendering\n");
+
 	if (render_env)
 	{
-		env = this;
 		// init GLFW
 	    if (!glfwInit())
 	        printf("Error initializing glfw\n");
@@ -104,8 +111,10 @@ QuadrupedEnv::QuadrupedEnv(const char* filename, const int skip_frames, bool ren
 	}
 #endif
 
-	mSkipFrames = skip_frames;
-	initMuJoCo(filename);
+	mSkipFrames = options.skip_frames;
+	mWarmup = options.warmup;			// Only start measuring distance and energy after the warm-up
+	mRotationSamples = options.rotation_samples;
+	initMuJoCo(filename, deltas, options);
 
 	// Model is initialized, save the starting position
 	int free_joint_id = mj_name2id(m, mjOBJ_JOINT, "gravity");
@@ -120,27 +129,33 @@ QuadrupedEnv::~QuadrupedEnv()
 	closeMuJoCo();
 }
 
-void QuadrupedEnv::initMuJoCo(const char* filename)
+void QuadrupedEnv::initMuJoCo(const char* filename, const ModelDeltas& deltas, const SimulationOptions& options)
 {
-	// activate
-	if (!activated)
-	{
-		activated = true;
-		mj_activate("/Users/Siebe/.mujoco/mjkey.txt");
-	}
+    // get the compiled model from the process-wide cache
+    model = ModelCache::instance().get(filename);
 
-    // load and compile
-    char error[1000] = "Could not load binary model";
-    if( strlen(filename)>4 && !strcmp(filename+strlen(filename)-4, ".mjb") )
-        m = mj_loadModel(filename, 0, 0);
-    else
-        m = mj_loadXML(filename, 0, error, 1000);
-    if( !m )
-        mju_error_s("Load model error: %s", error);
+    // variations and simulation options are applied to a private copy, the cached model is shared
+    if (!deltas.empty() || options.overridesModel())
+    {
+        model = shared_ptr<mjModel>(mj_copyModel(NULL, model.get()), mj_deleteModel);
+        applyModelDeltas(model.get(), deltas);
+    }
+    m = model.get();
+
+    if (options.timestep > 0)
+        m->opt.timestep = options.timestep;
+    if (options.iterations > 0)
+        m->opt.iterations = options.iterations;
+    if (options.tolerance >= 0)
+        m->opt.tolerance = options.tolerance;
 
     // make data, run one computation to initialize all fields
     d = mj_makeData(m);
 
+    // recompute the constant fields derived from the patched masses
+    if (!deltas.empty())
+        mj_setConst(m, d, 0);
+
     mj_forward(m, d);
 
     // printf("Model mass: %f\n", mj_getTotalmass(m))
@@ -179,7 +194,7 @@ void QuadrupedEnv::initMuJoCo(const char* filename)
 void QuadrupedEnv::closeMuJoCo()
 {
 	mj_deleteData(d);
-    mj_deleteModel(m);
+    model.reset();
     d = NULL;
     m = NULL;
 
@@ -189,14 +204,18 @@ void QuadrupedEnv::closeMuJoCo()
     	mjr_freeContext(&con);
         mjv_freeScene(&scn);
         glfwTerminate();
-        mj_deactivate();
-        activated = false;
         env = NULL;
     }
 #endif
     // mj_deactivate();
 }
 
+const char* getTerminationName(Termination termination)
+{
+    static const char* names[NUM_TERMINATIONS] = {"completed", "numerical_warning", "rotation", "torso_height", "render_stopped", "min_progress", "energy_budget", "reward_bound"};
+    return names[termination];
+}
+
 bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
 {
 	bool survived = true;
@@ -221,7 +240,7 @@ bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
 		mj_step(m, d);
 
     // Update consumed energy after initialization phase
-    if (d->time > INITIALIZATION_DURATION)
+    if (d->time > mWarmup)
     {
         for (int i = 0; i < 4; i++)
         {
@@ -235,9 +254,9 @@ bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
     }    
 
     // Get position samples to compensate direction after initialization phase
-    if (!pos_sample_1_done && d->time > INITIALIZATION_DURATION)
+    if (!pos_sample_1_done && d->time > mWarmup)
     {
-        if (rotation_sample_counter < NUM_ROTATION_SAMPLES)
+        if (rotation_sample_counter < mRotationSamples)
         {
             // Check current rotation. If it is too high, abort
             double* rotation_frame_2 = &d->xmat[9];
@@ -248,9 +267,10 @@ bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
             rotation_sample_counter++;
         }
 
-        if (rotation_sample_counter == NUM_ROTATION_SAMPLES)
+        if (rotation_sample_counter >= mRotationSamples)
         {
-            rotation_after_init /= NUM_ROTATION_SAMPLES;
+            if (mRotationSamples > 0)
+                rotation_after_init /= mRotationSamples;
 
             pos_sample_1_x = d->qpos[freeJointAddress];
             pos_sample_1_y = d->qpos[freeJointAddress + 1];
@@ -270,6 +290,7 @@ bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
 	if (warnings)
 	{
 		printf("Warning generated and detected! Aborting this run...\n");
+		termination = NUMERICAL_WARNING;
 		return false;
 	}
 
@@ -283,12 +304,14 @@ bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
 	if (fabs(rotation) > maxRotation)
 	{
 		survived = false;
+		termination = ROTATION;
 	}
 
     // Check for torso too low
     if (d->geom_xpos[3*torso_xpos_id+2] < -0.7)
     {
         survived = false;
+        termination = TORSO_HEIGHT;
     }
 
 #ifdef WITH_RENDER
@@ -296,7 +319,10 @@ bool QuadrupedEnv::step(double* action, vector<double>* perturb_ft)
 	if (render_env)
 	{
         if (stop_simulation)
+        {
+            termination = RENDER_STOPPED;
             return false;
+        }
 		render(window);
 		glfwPollEvents();
 	}
@@ -2,6 +2,8 @@
 #define _QUADRUPEDENV_H
 
 #include "mujoco.h"
+#include "ModelVariation.h"
+#include <memory>
 #include <vector>
 
 #ifdef WITH_RENDER
@@ -10,15 +12,51 @@
 
 using namespace std;
 
+// Why a rollout ended
+enum Termination
+{
+	COMPLETED,
+	NUMERICAL_WARNING,
+	ROTATION,
+	TORSO_HEIGHT,
+	RENDER_STOPPED,
+	MIN_PROGRESS,
+	ENERGY_BUDGET,
+	REWARD_BOUND,
+	NUM_TERMINATIONS
+};
+
+const char* getTerminationName(Termination termination);
+
+// Episode timing and simulation fidelity. The defaults reproduce the original
+// episodes, MuJoCo options left negative keep the value of the model file.
+struct SimulationOptions
+{
+	double duration = 15;		// Simulated seconds per rollout
+	int skip_frames = 5;		// MuJoCo steps per control step
+	double warmup = 5;			// Distance and energy are only measured after the warm-up
+	int rotation_samples = 10;	// Control steps after the warm-up averaged for the walking direction
+	double timestep = -1;		// MuJoCo opt.timestep
+	int iterations = -1;		// MuJoCo opt.iterations of the constraint solver
+	double tolerance = -1;		// MuJoCo opt.tolerance of the constraint solver
+
+	bool overridesModel() const {return timestep > 0 || iterations > 0 || tolerance >= 0;}
+};
+
 class QuadrupedEnv
 {
 public:
-	QuadrupedEnv(const char* filename, const int skip_frames, bool render);
+	QuadrupedEnv(const char* filename, const SimulationOptions& options, bool render, const ModelDeltas& deltas = ModelDeltas());
 	~QuadrupedEnv();
 
 	void setMaxRotation(int max) {maxRotation = max;}
 	bool step(double* action, std::vector<double>* perturb_ft);
 	double getTime();
+	Termination getTermination() {return termination;}
+	bool isMeasuring() {return pos_sample_1_done;}
+	double getTimestep() {return m->opt.timestep;}
+	int getSkipFrames() {return mSkipFrames;}
+	double getControlTimestep() {return m->opt.timestep * mSkipFrames;}
 	double getDistance();
 	double getEnergyConsumed();
 	void getForces(double* forces);
@@ -32,6 +70,7 @@ public:
 #endif
 	
 private:
+	shared_ptr<mjModel> model;	// Shared with the model cache unless variations are applied
 	mjModel* m;
 	mjData* d;
 
@@ -67,12 +106,15 @@ private:
 #endif
 
 	int mSkipFrames = 1;
+	double mWarmup = 5;
+	int mRotationSamples = 10;
 	double initialX = 0.0;
 	double initialY = 0.0;
 	int freeJointAddress = 0;
 	int maxRotation = 75;
 
 	double energy = 0;
+	Termination termination = COMPLETED;
 	double y_rotation = 0;
 
 	// Position samples to get direction after initialization
@@ -91,7 +133,7 @@ private:
 	int torso_body_id;
 	int torso_xpos_id;
 
-	void initMuJoCo(const char* filename);
+	void initMuJoCo(const char* filename, const ModelDeltas& deltas, const SimulationOptions& options);
 	void closeMuJoCo();
 	void unitVector(double* v);
 	double angleBetween(double* a, double* b);
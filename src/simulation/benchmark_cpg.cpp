@@ -0,0 +1,93 @@
+// Micro-benchmark of the CPG controller.
+//
+//   ./benchmark_cpg                  time the open-loop controller on its own
+//   ./benchmark_cpg model.xml        also time full rollouts and report the
+//                                    share of the rollout spent in the controller
+
+#include <stdio.h>
+#include <chrono>
+#include <vector>
+
+#include "Experiment.h"
+#include "CpgFeedbackControl.h"
+
+using namespace std;
+
+typedef chrono::steady_clock Clock;
+
+#define NUM_ROLLOUTS 10
+#define CONTROL_DT 0.01
+#define DURATION 15
+
+// Forwards to the wrapped controller and accumulates the time spent in it
+class TimedControl : public Control
+{
+public:
+	TimedControl(Control* p_control) : control(p_control) {}
+
+	void getAction(double* actions, double* forces, double time)
+	{
+		Clock::time_point start = Clock::now();
+		control->getAction(actions, forces, time);
+		elapsed += chrono::duration<double>(Clock::now() - start).count();
+	}
+
+	double elapsed = 0;
+private:
+	Control* control;
+};
+
+CpgFeedbackControl* getControl()
+{
+	vector<double> mu = {900, 900, 400, 400};
+	vector<double> o = {-5, -5, 5, 5};
+	vector<double> omega = {6.28, 6.28, 6.28, 6.28};
+	vector<double> d = {0.4, 0.4, 0.6, 0.6};
+	vector<double> phase_offsets = {0, 3.14, 3.14};
+
+	return new CpgFeedbackControl(mu, o, omega, d, phase_offsets);
+}
+
+int main(int argc, char** argv)
+{
+	// Controller only: one simulated episode per rollout at the default control rate
+	double controller_time = 0;
+	for (int i = 0; i < NUM_ROLLOUTS; i++)
+	{
+		CpgFeedbackControl* control = getControl();
+		TimedControl timed(control);
+		double actions[4];
+
+		for (int k = 0; k * CONTROL_DT < DURATION; k++)
+			timed.getAction(actions, 0, k * CONTROL_DT);
+
+		controller_time += timed.elapsed;
+		delete control;
+	}
+	printf("Controller only:  %8.3f ms per %d s episode\n", controller_time / NUM_ROLLOUTS * 1000, DURATION);
+
+	if (argc < 2)
+		return 0;
+
+	// Full rollouts on the given model
+	double rollout_time = 0;
+	controller_time = 0;
+	for (int i = 0; i < NUM_ROLLOUTS; i++)
+	{
+		CpgFeedbackControl* control = getControl();
+		TimedControl timed(control);
+		double time_simulated, distance, energy_consumed;
+
+		Clock::time_point start = Clock::now();
+		Experiment exp(&timed, false, argv[1], vector<pair<double, vector<double>>>(), SimulationOptions(), false);
+		exp.start(&time_simulated, &distance, &energy_consumed, 0, 0);
+		rollout_time += chrono::duration<double>(Clock::now() - start).count();
+
+		controller_time += timed.elapsed;
+		delete control;
+	}
+	printf("Rollout:          %8.3f ms per rollout\n", rollout_time / NUM_ROLLOUTS * 1000);
+	printf("Controller share: %8.2f %%\n", controller_time / rollout_time * 100);
+
+	return 0;
+}
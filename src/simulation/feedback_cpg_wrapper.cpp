@@ -1,7 +1,17 @@
 #include <boost/python.hpp>
+#include <boost/python/raw_function.hpp>
+#include <boost/python/numpy.hpp>
 
 #include <iostream>
 #include <fstream>
+#include <string>
+#include <algorithm>
+#include <atomic>
+#include <thread>
+#include <mutex>
+#include <exception>
+#include <map>
+#include <functional>
 
 #include "stdio.h"
 #include "stdlib.h"
@@ -11,15 +21,18 @@
 
 #include "Experiment.h"
 #include "CpgFeedbackControl.h"
+#include "PlaybackControl.h"
+#include "ModelCache.h"
+#include "ModelVariation.h"
 
 using namespace std;
 
 namespace bp = boost::python;
+namespace np = boost::python::numpy;
 
-
-int counter = 0;
-double total_simulated_time = 0;
-
+// Releases the GIL for the lifetime of the object. Only plain C++ data may be
+// touched in this scope, all conversion from and to Python objects happens
+// before or after it. This lets rollouts run in parallel from Python threads.
 class ScopedGILRelease {
 public:
     inline ScopedGILRelease() { m_thread_state = PyEval_SaveThread(); }
@@ -32,13 +45,22 @@ private:
 };
 
 template <class T>
-boost::python::list toPythonList(std::vector<T> vector) {
-  typename std::vector<T>::iterator iter;
-  boost::python::list list;
-  for (iter = vector.begin(); iter != vector.end(); ++iter) {
-    list.append(*iter);
-  }
-  return list;
+void deleteHistory(PyObject* capsule)
+{
+  delete reinterpret_cast<History<T>*>(PyCapsule_GetPointer(capsule, NULL));
+}
+
+// Wrap the history buffer in a (channels, length) array without copying.
+// The array takes ownership of the history and frees it when collected.
+template <class T>
+np::ndarray historyToArray(History<T>* history)
+{
+  T* data = history->finalize();
+  int channels = history->getChannels();
+  int length = history->getLength();
+
+  bp::object owner(bp::handle<>(PyCapsule_New(history, NULL, deleteHistory<T>)));
+  return np::from_data(data, np::dtype::get_builtin<T>(), bp::make_tuple(channels, length), bp::make_tuple(length * sizeof(T), sizeof(T)), owner);
 }
 
 CpgFeedbackControl* getOpenControl(const double *x, const int N)
@@ -70,40 +92,226 @@ CpgFeedbackControl* getClosedControl(const double *x, const int N)
   return control;
 }
 
-bool _evaluate(const char* model_file, bool closed_loop, const double *x, const int N, bool render, vector<pair<double, vector<double>>> perturbations, double* time_simulated, double* distance, double* energy_consumed, vector<vector<double>>* action_history, vector<vector<double>>* sensor_history)
+// Settings shared by all rollouts of an evaluate or evaluate_batch call
+struct RolloutOptions
 {
-  CpgFeedbackControl* control;
+  IntegratorOptions integrator;
+  SimulationOptions simulation;
+  StopRules stop_rules;
+};
 
-  if (closed_loop)
-    control = getClosedControl(x, N);
+// Open-loop rollouts replay the trajectory instead of integrating the CPG
+// when one is given, see _open_loop_trajectory
+bool _evaluate(const char* model_file, bool closed_loop, const double *x, const int N, bool render, vector<pair<double, vector<double>>> perturbations, const ModelDeltas& model_deltas, const RolloutOptions& options, const double* trajectory, int trajectory_length, double* time_simulated, double* distance, double* energy_consumed, Termination* termination, HistoryRecorder* action_history, HistoryRecorder* sensor_history)
+{
+  Control* control;
+
+  if (!closed_loop && trajectory)
+    control = new PlaybackControl(trajectory, trajectory_length);
   else
-    control = getOpenControl(x, N);
-  
-  Experiment exp(control, closed_loop, model_file, perturbations, 5, render);
-  bool result = exp.start(time_simulated, distance, energy_consumed, action_history, sensor_history);
+  {
+    CpgFeedbackControl* cpg = closed_loop ? getClosedControl(x, N) : getOpenControl(x, N);
+    cpg->setIntegrator(options.integrator);
+    control = cpg;
+  }
+
+  bool result;
+  try
+  {
+    Experiment exp(control, closed_loop, model_file, perturbations, options.simulation, render, model_deltas);
+    exp.setStopRules(options.stop_rules);
+    result = exp.start(time_simulated, distance, energy_consumed, action_history, sensor_history);
+    *termination = exp.getTermination();
+  }
+  catch (...)
+  {
+    // e.g. a ModelVariationError while the model is patched
+    delete(control);
+    throw;
+  }
 
   delete(control);
   return result;
 };
 
-boost::python::tuple evaluate(const char* model_file, bool closed_loop, bp::list& ls, bp::list& py_perturbations, bool render, bool logging) {
-    ScopedGILRelease scoped;
+// The open-loop CPG output does not depend on the simulation, so it is
+// computed once per parameter vector and shared by all model variations
+void _open_loop_trajectory(const char* model_file, const double *x, const int N, const RolloutOptions& options, HistoryRecorder* trajectory)
+{
+  CpgFeedbackControl* control = getOpenControl(x, N);
+  control->setIntegrator(options.integrator);
+
+  Experiment exp(control, false, model_file, vector<pair<double, vector<double>>>(), options.simulation, false);
+  exp.recordOpenLoop(trajectory);
+
+  delete(control);
+}
+
+vector<pair<double, vector<double>>> extractPerturbations(const bp::object& py_perturbations)
+{
+    vector<pair<double, vector<double>>> perturbations(len(py_perturbations));
+    for (int i = 0; i < len(py_perturbations); i++)
+    {
+      bp::object t = py_perturbations[i];
+      perturbations[i].first = bp::extract<double>(t[0]);
+
+      bp::object py_application_ft = t[1];
+      for (int j = 0; j < len(py_application_ft); j++)
+        perturbations[i].second.push_back(bp::extract<double>(py_application_ft[j]));
+    }
+    return perturbations;
+}
 
+ModelDeltas extractModelDeltas(const bp::object& py_deltas)
+{
+    ModelDeltas deltas;
+    if (py_deltas.is_none())
+      return deltas;
+
+    bp::list items = bp::dict(py_deltas).items();
+    for (int i = 0; i < len(items); i++)
+    {
+      string key = bp::extract<string>(items[i][0]);
+      if (!isSupportedModelDelta(key))
+      {
+        PyErr_SetString(PyExc_ValueError, ("model variation cannot be applied to a compiled model: " + key).c_str());
+        bp::throw_error_already_set();
+      }
+      deltas.push_back(make_pair(key, bp::extract<double>(items[i][1])()));
+    }
+    return deltas;
+}
+
+IntegratorOptions extractIntegratorOptions(const bp::dict& kwargs)
+{
+    IntegratorOptions options;
+
+    string integrator = bp::extract<string>(bp::str(kwargs.get("integrator", "euler")));
+    if (integrator == "euler")
+      options.integrator = EULER;
+    else if (integrator == "rk4")
+      options.integrator = RK4;
+    else if (integrator == "rk45")
+      options.integrator = RK45;
+    else
+    {
+      PyErr_SetString(PyExc_ValueError, "integrator must be euler, rk4 or rk45");
+      bp::throw_error_already_set();
+    }
+
+    options.dt = bp::extract<double>(kwargs.get("dt", options.dt));
+    options.tolerance = bp::extract<double>(kwargs.get("tolerance", options.tolerance));
+    if (options.dt <= 0 || options.tolerance <= 0)
+    {
+      PyErr_SetString(PyExc_ValueError, "dt and tolerance must be positive");
+      bp::throw_error_already_set();
+    }
+    return options;
+}
+
+StopRules extractStopRules(const bp::object& py_rules)
+{
+    StopRules rules;
+    if (py_rules.is_none())
+      return rules;
+
+    bp::dict d(py_rules);
+    bp::list keys = d.keys();
+    for (int i = 0; i < len(keys); i++)
+    {
+      string key = bp::extract<string>(keys[i]);
+      bp::object value = d[keys[i]];
+
+      if (key == "min_progress")
+      {
+        for (int j = 0; j < len(value); j++)
+          rules.min_progress.push_back(make_pair(bp::extract<double>(value[j][0])(), bp::extract<double>(value[j][1])()));
+      }
+      else if (key == "max_energy")
+        rules.max_energy = bp::extract<double>(value);
+      else if (key == "min_reward")
+        rules.min_reward = bp::extract<double>(value);
+      else if (key == "max_speed")
+        rules.max_speed = bp::extract<double>(value);
+      else if (key == "E_ref")
+        rules.E_ref = bp::extract<double>(value);
+      else
+      {
+        PyErr_SetString(PyExc_ValueError, ("unknown stop rule: " + key).c_str());
+        bp::throw_error_already_set();
+      }
+    }
+    return rules;
+}
+
+SimulationOptions extractSimulationOptions(const bp::dict& kwargs)
+{
+    SimulationOptions options;
+    options.duration = bp::extract<double>(kwargs.get("duration", options.duration));
+    options.skip_frames = bp::extract<int>(kwargs.get("skip_frames", options.skip_frames));
+    options.warmup = bp::extract<double>(kwargs.get("warmup", options.warmup));
+    options.rotation_samples = bp::extract<int>(kwargs.get("rotation_samples", options.rotation_samples));
+    options.timestep = bp::extract<double>(kwargs.get("timestep", options.timestep));
+    options.iterations = bp::extract<int>(kwargs.get("solver_iterations", options.iterations));
+    options.tolerance = bp::extract<double>(kwargs.get("solver_tolerance", options.tolerance));
+
+    if (options.duration <= 0 || options.skip_frames < 1 || options.rotation_samples < 0)
+    {
+      PyErr_SetString(PyExc_ValueError, "duration must be positive, skip_frames at least 1 and rotation_samples not negative");
+      bp::throw_error_already_set();
+    }
+    return options;
+}
+
+RolloutOptions extractRolloutOptions(const bp::dict& kwargs)
+{
+    RolloutOptions options;
+    options.integrator = extractIntegratorOptions(kwargs);
+    options.simulation = extractSimulationOptions(kwargs);
+    options.stop_rules = extractStopRules(kwargs.get("stop_rules"));
+    return options;
+}
+
+const vector<string> INTEGRATOR_KEYWORDS = {"integrator", "dt", "tolerance"};
+const vector<string> SIMULATION_KEYWORDS = {"duration", "skip_frames", "warmup", "rotation_samples", "timestep", "solver_iterations", "solver_tolerance"};
+
+// The integrator and simulation keywords are accepted by every entry point
+void checkKeywords(const char* function, const bp::dict& kwargs, vector<string> allowed)
+{
+    allowed.insert(allowed.end(), INTEGRATOR_KEYWORDS.begin(), INTEGRATOR_KEYWORDS.end());
+    allowed.insert(allowed.end(), SIMULATION_KEYWORDS.begin(), SIMULATION_KEYWORDS.end());
+
+    bp::list keys = kwargs.keys();
+    for (int i = 0; i < len(keys); i++)
+    {
+      string key = bp::extract<string>(keys[i]);
+      if (std::find(allowed.begin(), allowed.end(), key) == allowed.end())
+      {
+        PyErr_SetString(PyExc_TypeError, (string(function) + "() got an unexpected keyword argument '" + key + "'").c_str());
+        bp::throw_error_already_set();
+      }
+    }
+}
+
+boost::python::tuple evaluate(const char* model_file, bool closed_loop, bp::list& ls, bp::list& py_perturbations, bool render, bool logging, const ModelDeltas& model_deltas, const RolloutOptions& options, bool single_precision, const double* trajectory, int trajectory_length) {
     double time_simulated = 0;
     double distance = 0;
     double energy_consumed = 0;
+    Termination termination = COMPLETED;
 
-    vector<vector<double>> action_history;
-    vector<vector<double>> sensor_history;
+    // Histories are recorded straight into buffers that are handed to NumPy
+    HistoryRecorder* action_history = 0;
+    HistoryRecorder* sensor_history = 0;
 
-    // Initialize history vectors
     if (logging)
     {
-      for (int i = 0; i < 4; i++){
-        action_history.push_back(vector<double>());
-      }
-      for (int i = 0; i < 4; i++){
-        sensor_history.push_back(vector<double>());
+      if (single_precision)
+      {
+        action_history = new History<float>(4);
+        sensor_history = new History<float>(4);
+      } else {
+        action_history = new History<double>(4);
+        sensor_history = new History<double>(4);
       }
     }
 
@@ -116,51 +324,357 @@ boost::python::tuple evaluate(const char* model_file, bool closed_loop, bp::list
       variables[i] = bp::extract<double>(ls[i]);
 
     // Extract perturbations from python list
-    vector<pair<double, vector<double>>> perturbations(len(py_perturbations));
-    for (int i = 0; i < len(py_perturbations); i++)
+    vector<pair<double, vector<double>>> perturbations = extractPerturbations(py_perturbations);
+
+    try
+    {
+      ScopedGILRelease scoped;
+      result = _evaluate(model_file, closed_loop, variables, num_variables, render, perturbations, model_deltas, options, trajectory, trajectory_length, &time_simulated, &distance, &energy_consumed, &termination, action_history, sensor_history);
+    }
+    catch (...)
     {
-      bp::list t = bp::extract<bp::list>(py_perturbations[i]);
-      double application_time = bp::extract<double>(t[0]);
-      bp::list py_application_ft = bp::extract<bp::list>(t[1]);
+      // Raised in Python once the GIL is held again
+      delete[] variables;
+      delete action_history;
+      delete sensor_history;
+      throw;
+    }
 
-      perturbations[i].first = application_time;
+    delete[] variables;
 
-      for (int j = 0; j < len(py_application_ft); j++)
-        perturbations[i].second.push_back(bp::extract<double>(py_application_ft[j]));
+    bp::object action_history_array = bp::list();
+    bp::object sensor_history_array = bp::list();
+
+    if (logging) 
+    {
+      if (single_precision)
+      {
+        action_history_array = historyToArray(static_cast<History<float>*>(action_history));
+        sensor_history_array = historyToArray(static_cast<History<float>*>(sensor_history));
+      } else {
+        action_history_array = historyToArray(static_cast<History<double>*>(action_history));
+        sensor_history_array = historyToArray(static_cast<History<double>*>(sensor_history));
+      }
     }
 
-    if (logging)
+    return boost::python::make_tuple(result, time_simulated, distance, energy_consumed, action_history_array, sensor_history_array, getTerminationName(termination));
+}
+
+struct RolloutResult
+{
+  bool success = false;
+  double time_simulated = 0;
+  double distance = 0;
+  double energy_consumed = 0;
+  Termination termination = COMPLETED;
+};
+
+// Run task(0) ... task(n - 1) on n_threads worker threads which pull the next
+// index from a shared counter, so slow tasks do not stall the others. The
+// first exception thrown by a task stops the remaining tasks and is rethrown
+// once all threads have joined.
+void parallelFor(int n, int n_threads, const std::function<void(int)>& task)
+{
+  std::atomic<int> next_task(0);
+  std::exception_ptr error;
+  std::mutex error_mutex;
+
+  auto worker = [&]() {
+    int i;
+    while ((i = next_task++) < n)
     {
-      result = _evaluate(model_file, closed_loop, variables, num_variables, render, perturbations, &time_simulated, &distance, &energy_consumed, &action_history, &sensor_history);
-    } else {
-      result = _evaluate(model_file, closed_loop, variables, num_variables, render, perturbations, &time_simulated, &distance, &energy_consumed, 0, 0);
+      try
+      {
+        task(i);
+      }
+      catch (...)
+      {
+        std::lock_guard<std::mutex> lock(error_mutex);
+        if (!error)
+          error = std::current_exception();
+        next_task = n;
+      }
     }
-    
+  };
 
-    delete[] variables;
+  if (n_threads < 1)
+    n_threads = std::max(1u, std::thread::hardware_concurrency());
+  n_threads = std::min(n_threads, n);
 
-    bp::list action_history_list;
-    bp::list sensor_history_list;
+  vector<std::thread> threads;
+  for (int t = 1; t < n_threads; t++)
+    threads.push_back(std::thread(worker));
 
-    if (logging) 
+  worker();
+
+  for (auto& t : threads)
+    t.join();
+
+  if (error)
+    std::rethrow_exception(error);
+}
+
+// Evaluate every row of the parameter matrix on its own model file.
+// In open loop, rows with the same parameters replay one trajectory that is
+// computed once on the model of the first such row. Model variations do not
+// change the simulation timestep, so it is valid for all of them.
+void _evaluate_batch(const vector<string>& model_files, bool closed_loop, const vector<double>& params, const int N, const vector<vector<pair<double, vector<double>>>>& perturbations, const vector<ModelDeltas>& model_deltas, const RolloutOptions& options, int n_threads, vector<RolloutResult>& results)
+{
+  const int num_rollouts = model_files.size();
+
+  vector<int> trajectory_index(num_rollouts, -1);
+  vector<int> trajectory_rows;
+  if (!closed_loop)
+  {
+    map<vector<double>, int> unique_params;
+    for (int i = 0; i < num_rollouts; i++)
+    {
+      vector<double> row(params.begin() + i * N, params.begin() + (i + 1) * N);
+      auto it = unique_params.insert(make_pair(row, (int) trajectory_rows.size()));
+      if (it.second)
+        trajectory_rows.push_back(i);
+      trajectory_index[i] = it.first->second;
+    }
+  }
+
+  vector<History<double>> trajectories(trajectory_rows.size(), History<double>(4));
+  parallelFor(trajectory_rows.size(), n_threads, [&](int k) {
+    int row = trajectory_rows[k];
+    _open_loop_trajectory(model_files[row].c_str(), &params[row * N], N, options, &trajectories[k]);
+    trajectories[k].finalize();
+  });
+
+  parallelFor(num_rollouts, n_threads, [&](int i) {
+    RolloutResult& r = results[i];
+    const double* trajectory = 0;
+    int trajectory_length = 0;
+    if (trajectory_index[i] >= 0)
+    {
+      History<double>& t = trajectories[trajectory_index[i]];
+      trajectory = t.getData();
+      trajectory_length = t.getLength();
+    }
+    r.success = _evaluate(model_files[i].c_str(), closed_loop, &params[i * N], N, false, perturbations[i], model_deltas[i], options, trajectory, trajectory_length, &r.time_simulated, &r.distance, &r.energy_consumed, &r.termination, 0, 0);
+  });
+}
+
+boost::python::tuple evaluate_batch(bp::list& py_model_files, bool closed_loop, bp::object& py_params, bp::list& py_perturbations, int n_threads, bp::object& py_model_deltas, const RolloutOptions& options) {
+    // Convert all arguments while holding the GIL
+    np::ndarray params_matrix = np::from_object(py_params, np::dtype::get_builtin<double>(), 2, 2, np::ndarray::C_CONTIGUOUS);
+    const int num_rollouts = params_matrix.shape(0);
+    const int num_variables = params_matrix.shape(1);
+
+    if (len(py_model_files) != num_rollouts || len(py_perturbations) != num_rollouts || (!py_model_deltas.is_none() && len(py_model_deltas) != num_rollouts))
+    {
+      PyErr_SetString(PyExc_ValueError, "model_files, params, perturbations and model_deltas must have the same number of rows");
+      bp::throw_error_already_set();
+    }
+
+    const double* data = reinterpret_cast<const double*>(params_matrix.get_data());
+    vector<double> params(data, data + num_rollouts * num_variables);
+
+    vector<string> model_files;
+    vector<vector<pair<double, vector<double>>>> perturbations;
+    vector<ModelDeltas> model_deltas(num_rollouts);
+    for (int i = 0; i < num_rollouts; i++)
+    {
+      model_files.push_back(bp::extract<string>(py_model_files[i]));
+      perturbations.push_back(extractPerturbations(py_perturbations[i]));
+      if (!py_model_deltas.is_none())
+        model_deltas[i] = extractModelDeltas(py_model_deltas[i]);
+    }
+
+    vector<RolloutResult> results(num_rollouts);
+
+    {
+      ScopedGILRelease scoped;
+      _evaluate_batch(model_files, closed_loop, params, num_variables, perturbations, model_deltas, options, n_threads, results);
+    }
+
+    bp::tuple shape = bp::make_tuple(num_rollouts);
+    np::ndarray success = np::zeros(shape, np::dtype::get_builtin<bool>());
+    np::ndarray time_simulated = np::zeros(shape, np::dtype::get_builtin<double>());
+    np::ndarray distance = np::zeros(shape, np::dtype::get_builtin<double>());
+    np::ndarray energy_consumed = np::zeros(shape, np::dtype::get_builtin<double>());
+    np::ndarray termination = np::zeros(shape, np::dtype::get_builtin<int>());
+
+    bool* success_data = reinterpret_cast<bool*>(success.get_data());
+    double* time_data = reinterpret_cast<double*>(time_simulated.get_data());
+    double* distance_data = reinterpret_cast<double*>(distance.get_data());
+    double* energy_data = reinterpret_cast<double*>(energy_consumed.get_data());
+    int* termination_data = reinterpret_cast<int*>(termination.get_data());
+
+    for (int i = 0; i < num_rollouts; i++)
     {
-      for (int i = 0; i < 4; i++)
-        action_history_list.append(toPythonList(action_history[i]));
-      for (int i = 0; i < 4; i++)
-        sensor_history_list.append(toPythonList(sensor_history[i])); 
+      success_data[i] = results[i].success;
+      time_data[i] = results[i].time_simulated;
+      distance_data[i] = results[i].distance;
+      energy_data[i] = results[i].energy_consumed;
+      termination_data[i] = results[i].termination;
     }
 
-    return boost::python::make_tuple(result, time_simulated, distance, energy_consumed, action_history_list, sensor_history_list);
+    return boost::python::make_tuple(success, time_simulated, distance, energy_consumed, termination);
 }
 
+// Python entry points taking the positional arguments plus keyword options:
+//   evaluate(model_file, closed_loop, params, perturbations, render, logging, model_deltas=None, history_dtype="float64", trajectory=None, stop_rules=None, **options)
+//   evaluate_batch(model_files, closed_loop, params, perturbations, n_threads, model_deltas=None, stop_rules=None, **options)
+//   open_loop_trajectory(params, model_file=None, **options)
+// The CPG integrator is selected with integrator="euler"|"rk4"|"rk45", dt=0.001 and tolerance=1e-6 (rk45 only).
+// Episode timing and fidelity follow SimulationOptions: duration=15, skip_frames=5, warmup=5, rotation_samples=10,
+// and timestep, solver_iterations and solver_tolerance override the MuJoCo options of the model.
+// An open-loop evaluate replays trajectory, a (4, T) array from open_loop_trajectory, instead of running the CPG.
+// With model_file the trajectory is sampled at the control steps of evaluate on that model, otherwise every
+// skip_frames * timestep seconds for duration seconds.
+// stop_rules is a dict with the fields of StopRules: min_progress=[(time, distance), ...], max_energy,
+// min_reward, max_speed and E_ref. evaluate reports why the rollout ended as a name from
+// TERMINATION_REASONS, evaluate_batch as an index into it.
+bp::object evaluate_kw(bp::tuple args, bp::dict kwargs)
+{
+  if (len(args) != 6)
+  {
+    PyErr_SetString(PyExc_TypeError, "evaluate() takes 6 positional arguments");
+    bp::throw_error_already_set();
+  }
+  checkKeywords("evaluate", kwargs, {"model_deltas", "history_dtype", "trajectory", "stop_rules"});
+
+  string model_file = bp::extract<string>(args[0]);
+  bp::list ls = bp::list(args[2]);
+  bp::list perturbations = bp::list(args[3]);
+  ModelDeltas model_deltas = extractModelDeltas(kwargs.get("model_deltas"));
+  RolloutOptions options = extractRolloutOptions(kwargs);
+
+  string history_dtype = bp::extract<string>(bp::str(kwargs.get("history_dtype", "float64")));
+  if (history_dtype != "float64" && history_dtype != "float32")
+  {
+    PyErr_SetString(PyExc_ValueError, "history_dtype must be float64 or float32");
+    bp::throw_error_already_set();
+  }
+
+  // The array is kept alive by this scope while the rollout reads from it
+  bp::object trajectory_object = kwargs.get("trajectory");
+  const double* trajectory = 0;
+  int trajectory_length = 0;
+  if (!trajectory_object.is_none())
+  {
+    np::ndarray trajectory_array = np::from_object(trajectory_object, np::dtype::get_builtin<double>(), 2, 2, np::ndarray::C_CONTIGUOUS);
+    if (trajectory_array.shape(0) != 4 || trajectory_array.shape(1) < 1)
+    {
+      PyErr_SetString(PyExc_ValueError, "trajectory must have shape (4, T)");
+      bp::throw_error_already_set();
+    }
+    trajectory_object = trajectory_array;
+    trajectory = reinterpret_cast<const double*>(trajectory_array.get_data());
+    trajectory_length = trajectory_array.shape(1);
+  }
+
+  return evaluate(model_file.c_str(), bp::extract<bool>(args[1]), ls, perturbations, bp::extract<bool>(args[4]), bp::extract<bool>(args[5]), model_deltas, options, history_dtype == "float32", trajectory, trajectory_length);
+}
+
+bp::object evaluate_batch_kw(bp::tuple args, bp::dict kwargs)
+{
+  if (len(args) != 5)
+  {
+    PyErr_SetString(PyExc_TypeError, "evaluate_batch() takes 5 positional arguments");
+    bp::throw_error_already_set();
+  }
+  checkKeywords("evaluate_batch", kwargs, {"model_deltas", "stop_rules"});
+
+  bp::list model_files = bp::list(args[0]);
+  bp::object params = args[2];
+  bp::list perturbations = bp::list(args[3]);
+  bp::object model_deltas = kwargs.get("model_deltas");
+  RolloutOptions options = extractRolloutOptions(kwargs);
+
+  return evaluate_batch(model_files, bp::extract<bool>(args[1]), params, perturbations, bp::extract<int>(args[4]), model_deltas, options);
+}
+
+bp::object open_loop_trajectory_kw(bp::tuple args, bp::dict kwargs)
+{
+  if (len(args) != 1)
+  {
+    PyErr_SetString(PyExc_TypeError, "open_loop_trajectory() takes 1 positional argument");
+    bp::throw_error_already_set();
+  }
+  checkKeywords("open_loop_trajectory", kwargs, {"model_file"});
+
+  bp::list ls = bp::list(args[0]);
+  vector<double> variables(len(ls));
+  for (size_t i = 0; i < variables.size(); i++)
+    variables[i] = bp::extract<double>(ls[i]);
+
+  RolloutOptions options = extractRolloutOptions(kwargs);
+  bp::object model_file_object = kwargs.get("model_file");
+
+  if (model_file_object.is_none() == (options.simulation.timestep <= 0))
+  {
+    PyErr_SetString(PyExc_TypeError, "open_loop_trajectory() needs either model_file or timestep");
+    bp::throw_error_already_set();
+  }
+
+  History<double>* trajectory = new History<double>(4);
+
+  if (!model_file_object.is_none())
+  {
+    // Sampled exactly as an evaluate on this model would request the actions
+    string model_file = bp::extract<string>(model_file_object);
+    ScopedGILRelease scoped;
+    _open_loop_trajectory(model_file.c_str(), variables.data(), variables.size(), options, trajectory);
+  } else {
+    ScopedGILRelease scoped;
+    CpgFeedbackControl* control = getOpenControl(variables.data(), variables.size());
+    control->setIntegrator(options.integrator);
+    recordOpenLoopTrajectory(control, options.simulation.timestep, options.simulation.skip_frames, options.simulation.duration, trajectory);
+    delete(control);
+  }
+
+  return historyToArray(trajectory);
+}
+
+bp::dict model_cache_info()
+{
+  ModelCache& cache = ModelCache::instance();
+
+  bp::dict info;
+  info["hits"] = cache.getHits();
+  info["misses"] = cache.getMisses();
+  info["size"] = cache.getSize();
+  info["bytes"] = cache.getBytes();
+  info["max_bytes"] = cache.getMaxBytes();
+  return info;
+}
+
+void set_model_cache_size(size_t max_bytes)
+{
+  ModelCache::instance().setMaxBytes(max_bytes);
+}
+
+void clear_model_cache()
+{
+  ModelCache::instance().clear();
+}
+
+// Version 2: evaluate returns the termination reason as a 7th element
 int get_cpg_version()
 {
-  return 1;
+  return 2;
 }
 
 BOOST_PYTHON_MODULE(feedback_cpg)
 {
   using namespace boost::python;
+  np::initialize();
+
+  bp::list termination_reasons;
+  for (int i = 0; i < NUM_TERMINATIONS; i++)
+    termination_reasons.append(getTerminationName((Termination) i));
+  scope().attr("TERMINATION_REASONS") = bp::tuple(termination_reasons);
+
   def("get_cpg_version", get_cpg_version);
-  def("evaluate", evaluate);
+  def("evaluate", raw_function(evaluate_kw, 6));
+  def("evaluate_batch", raw_function(evaluate_batch_kw, 5));
+  def("open_loop_trajectory", raw_function(open_loop_trajectory_kw, 1));
+  def("model_cache_info", model_cache_info);
+  def("set_model_cache_size", set_model_cache_size);
+  def("clear_model_cache", clear_model_cache);
 }
\ No newline at end of file
@@ -5,7 +5,13 @@ import sys
 
 
 class CPGControl:
-	def __init__(self, mu, offset, omega, duty_factor, phase_offset):
+	def __init__(self, mu, offset, omega, duty_factor, phase_offset, integrator='euler', dt=0.001, tolerance=1e-6):
+		# Same integrator options as the simulator (see CpgFeedbackControl.cpp)
+		if integrator not in ['euler', 'rk4', 'rk45']:
+			raise ValueError('integrator must be euler, rk4 or rk45')
+		if dt <= 0 or tolerance <= 0:
+			raise ValueError('dt and tolerance must be positive')
+
 		self.mu = mu
 		self.o = offset
 		self.omega = omega
@@ -27,8 +33,12 @@ class CPGControl:
 		]
 
 		self.gamma = 0.1
-		self.dt = 0.001
+		self.dt = dt
+		self.integrator = integrator # 'euler', 'rk4' or 'rk45'
+		self.tolerance = tolerance # error tolerance of rk45
+		self.step_size = dt # current step size of rk45
 		self.prev_time = -1
+		self.cpg_time = 0
 
 		self.r = [1] * 4
 		self.phi = [np.pi * duty_factor[i] for i in range(4)]
@@ -64,21 +74,92 @@ class CPGControl:
 			self.phi[i] += self.dt * d_phi
 			self.o[i] += self.dt * d_o
 
-			two_pi = 2 * 3.141592654
-
-			phi_L = 0
-			phi_2pi = self.phi[i] % two_pi
-			if phi_2pi < (two_pi * self.d[i]):
-				phi_L = phi_2pi / (2 * self.d[i])
-			else:
-				phi_L = (phi_2pi + two_pi * (1 - 2 * self.d[i])) / (2 * (1 - self.d[i]))
-
-			action = self.r[i] * np.cos(phi_L) + self.o[i]
-			actions.append(action)
+			actions.append(self.output(i))
 
 		return actions
 
+	def derivative(self, r, phi, Fr, Fphi, Fo):
+		d_r = self.gamma * (np.asarray(self.mu) + np.asarray(self.kappa_r) * Fr - r * r) * r
+		d_phi = np.asarray(self.omega, dtype=float) + np.asarray(self.kappa_phi) * Fphi
+		d_phi += np.sum(np.asarray(self.coupling) * np.sin(phi[np.newaxis, :] - phi[:, np.newaxis] - np.asarray(self.psi)), axis=1)
+		d_o = np.asarray(self.kappa_o) * Fo
+		return d_r, d_phi, d_o
+
+	def step_rk4(self, h, Fr, Fphi, Fo):
+		# Classic Runge-Kutta step, all oscillators are evaluated at the same state
+		# so a much larger dt can be used than with the Euler update
+		r = np.asarray(self.r, dtype=float)
+		phi = np.asarray(self.phi, dtype=float)
+		Fr, Fphi, Fo = np.asarray(Fr), np.asarray(Fphi), np.asarray(Fo)
+
+		k1 = self.derivative(r, phi, Fr, Fphi, Fo)
+		k2 = self.derivative(r + h/2 * k1[0], phi + h/2 * k1[1], Fr, Fphi, Fo)
+		k3 = self.derivative(r + h/2 * k2[0], phi + h/2 * k2[1], Fr, Fphi, Fo)
+		k4 = self.derivative(r + h * k3[0], phi + h * k3[1], Fr, Fphi, Fo)
+
+		for n, state in enumerate([self.r, self.phi, self.o]):
+			for i in range(4):
+				state[i] += h / 6 * (k1[n][i] + 2*k2[n][i] + 2*k3[n][i] + k4[n][i])
+
+	def state_derivative(self, y, Fr, Fphi, Fo):
+		# derivative() of the state vector [r, phi, o]
+		return np.concatenate(self.derivative(y[0:4], y[4:8], Fr, Fphi, Fo))
+
+	def integrate_rk45(self, interval, Fr, Fphi, Fo):
+		# Integrate over the interval with Dormand-Prince 5(4) steps, the step
+		# size is adapted to keep the local error estimate below the tolerance
+		y = np.concatenate([self.r, self.phi, self.o]).astype(float)
+		Fr, Fphi, Fo = np.asarray(Fr), np.asarray(Fphi), np.asarray(Fo)
+		f = lambda y: self.state_derivative(y, Fr, Fphi, Fo)
+		t = 0
+
+		while t < interval:
+			h = min(self.step_size, interval - t)
+
+			k1 = f(y)
+			k2 = f(y + h * (1/5*k1))
+			k3 = f(y + h * (3/40*k1 + 9/40*k2))
+			k4 = f(y + h * (44/45*k1 - 56/15*k2 + 32/9*k3))
+			k5 = f(y + h * (19372/6561*k1 - 25360/2187*k2 + 64448/6561*k3 - 212/729*k4))
+			k6 = f(y + h * (9017/3168*k1 - 355/33*k2 + 46732/5247*k3 + 49/176*k4 - 5103/18656*k5))
+			y_next = y + h * (35/384*k1 + 500/1113*k3 + 125/192*k4 - 2187/6784*k5 + 11/84*k6)
+			k7 = f(y_next)
+
+			# Difference between the fifth and fourth order solutions
+			error_estimate = h * (71/57600*k1 - 71/16695*k3 + 71/1920*k4 - 17253/339200*k5 + 22/525*k6 - 1/40*k7)
+			scale = self.tolerance * (1 + np.maximum(np.abs(y), np.abs(y_next)))
+			error = np.max(np.abs(error_estimate) / scale)
+
+			accepted = error <= 1
+			if accepted:
+				y = y_next
+				t += h
+
+			# Do not grow the step size from a step that was shortened to end on the interval
+			factor = min(5.0, max(0.2, 0.9 * error**-0.2)) if error > 0 else 5.0
+			if not accepted or h == self.step_size or factor < 1:
+				self.step_size = max(h * factor, 1e-9)
+
+		self.r, self.phi, self.o = list(y[0:4]), list(y[4:8]), list(y[8:12])
+
+	def output(self, i):
+		two_pi = 2 * 3.141592654
+
+		phi_L = 0
+		phi_2pi = self.phi[i] % two_pi
+		if phi_2pi < (two_pi * self.d[i]):
+			phi_L = phi_2pi / (2 * self.d[i])
+		else:
+			phi_L = (phi_2pi + two_pi * (1 - 2 * self.d[i])) / (2 * (1 - self.d[i]))
+
+		return self.r[i] * np.cos(phi_L) + self.o[i]
+
 	def get_action(self, time, forces=None):
+		if self.integrator == 'rk4':
+			return self.get_action_rk4(time)
+		if self.integrator == 'rk45':
+			return self.get_action_rk45(time)
+
 		num_steps = (int(time/self.dt) - self.prev_time)
 		actions = []
 
@@ -93,21 +174,40 @@ class CPGControl:
 		self.prev_time = int(time/self.dt)
 		return actions
 
-def loadCpgParamsFromFile(filename):
+	def get_action_rk4(self, time):
+		# Integrate exactly up to the requested time in equal steps of at most dt
+		interval = time - self.cpg_time
+		if interval > 0:
+			num_steps = max(int(np.ceil(interval / self.dt - 1e-6)), 1)
+			for _ in range(num_steps):
+				self.step_rk4(interval / num_steps, [0] * 4, [0] * 4, [0] * 4)
+			self.cpg_time = time
+
+		return [self.output(i) for i in range(4)]
+
+	def get_action_rk45(self, time):
+		interval = time - self.cpg_time
+		if interval > 0:
+			self.integrate_rk45(interval, [0] * 4, [0] * 4, [0] * 4)
+			self.cpg_time = time
+
+		return [self.output(i) for i in range(4)]
+
+def loadCpgParamsFromFile(filename, **kwargs):
     import pickle
     with open(filename, 'rb') as f:
         params = pickle.load(f)
-        return loadCpgParams(params)
+        return loadCpgParams(params, **kwargs)
 
 
-def loadCpgParams(x):
+def loadCpgParams(x, **kwargs):
     mu = [x[0], x[1], x[2], x[3]]
     o = [x[4], x[4], x[5], x[5]]
     omega = [x[6], x[6], x[6], x[6]]
     d = [x[7], x[7], x[8], x[8]]
     phase_offset = [x[9], x[10], x[11]]
 
-    cpg = CPGControl(mu, o, omega, d, phase_offset)
+    cpg = CPGControl(mu, o, omega, d, phase_offset, **kwargs)
     return cpg
 
 if __name__ == '__main__':
@@ -115,17 +215,27 @@ if __name__ == '__main__':
 		print('Please specify a file to convert to the control signal')
 	else:
 		file = sys.argv[1]
-		cpg = loadCpgParamsFromFile(file)
 
 		actions = []
 
 		timestep = 0.01 # 10 ms
 		duration = 30 # seconds
 
-		# Get actions for 15 seconds
-		for time in range(int(duration/timestep)):
-			action = cpg.get_action(time*timestep)
-			actions.append(action)
+		try:
+			# Export exactly the trajectory the simulator replays in open loop
+			import feedback_cpg
+			import pickle
+			with open(file, 'rb') as f:
+				params = pickle.load(f)
+			trajectory = feedback_cpg.open_loop_trajectory(list(params), timestep=timestep, skip_frames=1, duration=duration)
+			actions = trajectory.T.tolist()
+		except ImportError:
+			cpg = loadCpgParamsFromFile(file)
+
+			# Get actions for 15 seconds
+			for time in range(int(duration/timestep)):
+				action = cpg.get_action(time*timestep)
+				actions.append(action)
 
 		with open(file.split('.')[0] + '_control_signal.pickle', 'wb') as f:
 			import pickle